@@ -0,0 +1,420 @@
+import argparse
+import asyncio
+import csv
+import json
+import random
+import subprocess
+import time
+from datetime import datetime, timedelta, timezone
+
+import discord
+
+import mood
+import tldr
+import utils
+from embeddingStore import EmbeddingStore
+from languageDetector import languageDetector
+from messageAnalysis import analysisCache
+from messageBuffer import MessageBuffer
+
+
+# •====================•
+#    STUB MESSAGES
+# •====================•
+
+class StubAuthor:
+    """
+    Stands for a discord.Member in the benchmarks
+    """
+
+    def __init__(self, id: int, name: str, nick: str | None = None, bot: bool = False):
+        """
+        Constructor
+        :param id: the id of the author
+        :param name: the name of the author
+        :param nick: the nickname of the author in the guild
+        :param bot: True if the author is a bot
+        """
+        self.id = id
+        self.name = name
+        self.nick = nick
+        self.bot = bot
+
+
+class StubMessage:
+    """
+    Stands for a discord.Message in the benchmarks
+    """
+
+    def __init__(self, id: int, author: StubAuthor, content: str, created_at: datetime | None = None,
+                 channel=None, repliedId: int | None = None):
+        """
+        Constructor
+        :param id: the id of the message
+        :param author: the author of the message
+        :param content: the content of the message
+        :param created_at: the time the message was sent
+        :param channel: the channel of the message
+        :param repliedId: the id of the message it replies to, None if it is not a reply
+        """
+        self.id = id
+        self.author = author
+        self.content = content
+        self.created_at = created_at if created_at is not None else datetime.now(timezone.utc)
+        self.channel = channel
+        if repliedId is None:
+            self.type = discord.MessageType.default
+            self.reference = None
+        else:
+            self.type = discord.MessageType.reply
+            self.reference = discord.MessageReference(message_id=repliedId, channel_id=channel.id if channel else 0)
+
+    @property
+    def clean_content(self) -> str:
+        """
+        Gets the content of the message
+        :return: the content of the message
+        """
+        return self.content
+
+
+class StubChannel:
+    """
+    Stands for a discord.TextChannel in the benchmarks, its history is read from a list of messages
+    :messages: the messages of the channel, from the oldest to the most recent
+    :historyCalls: the number of calls to history
+    """
+
+    def __init__(self, id: int):
+        """
+        Constructor
+        :param id: the id of the channel
+        """
+        self.id = id
+        self.messages: list[StubMessage] = []
+        self.historyCalls = 0
+
+    async def history(self, limit: int = 100, before=None, after=None):
+        """
+        Asynchronous generator of the messages of the channel, like discord.TextChannel.history
+        :param limit: the maximum number of messages
+        :param before: the messages before this one are read, from the most recent to the oldest
+        :param after: the messages after this one are read, from the oldest to the most recent
+        :return: Asynchronous generator of messages
+        """
+        self.historyCalls += 1
+        if after is not None:
+            messages = [m for m in self.messages if m.id > after.id]
+        else:
+            messages = [m for m in reversed(self.messages) if before is None or m.id < before.id]
+        for message in messages[:limit]:
+            yield message
+
+
+class StubBot:
+    """
+    Stands for the discordBot.Bot in the benchmarks
+    :messageBuffer: the recent messages of every channel
+    """
+
+    def __init__(self, bufferSize: int = 500):
+        """
+        Constructor
+        :param bufferSize: the maximum number of messages kept per channel
+        """
+        self.messageBuffer = MessageBuffer(bufferSize)
+
+
+SENTENCES = [
+    "did anyone finish the assignment for tomorrow",
+    "I think the deadline was moved to friday",
+    "the server crashed again during the update",
+    "we should restart it after the backup is done",
+    "who wants to play tonight after dinner",
+    "I can join around nine if that works for you",
+    "the new album is really good, listen to the third song",
+    "has anyone tried the pizza place next to the station",
+    "the meeting notes are in the shared folder",
+    "can someone review my pull request before the release",
+]
+
+
+def randomCluster(rng: random.Random, nbMessages: int, firstId: int = 0) -> list[StubMessage]:
+    """
+    Builds a cluster of messages of random authors and sentences
+    :param rng: the random generator
+    :param nbMessages: the number of messages of the cluster
+    :param firstId: the id of the first message
+    :return: the list of messages
+    """
+    authors = [StubAuthor(i, f"user{i}") for i in range(5)]
+    return [StubMessage(firstId + i, rng.choice(authors), rng.choice(SENTENCES)) for i in range(nbMessages)]
+
+
+def syntheticTranscript(rng: random.Random, nbMessages: int, botRate: float = 0.05, replyRate: float = 0.15,
+                        gapRate: float = 0.02) -> StubChannel:
+    """
+    Builds the transcript of a channel: topics of random sentences, reply chains, bot messages and time gaps
+    :param rng: the random generator
+    :param nbMessages: the number of messages of the channel
+    :param botRate: the probability of a message to be sent by a bot
+    :param replyRate: the probability of a message to reply to one of the 30 previous messages
+    :param gapRate: the probability of a silence longer than the tldr time gap before a message
+    :return: the channel holding the messages
+    """
+    channel = StubChannel(1)
+    authors = [StubAuthor(i, f"user{i}", nick=f"nick{i}" if i % 3 == 0 else None) for i in range(12)]
+    bot = StubAuthor(100, "bot", bot=True)
+    date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    topic = rng.choice(SENTENCES)
+    for i in range(nbMessages):
+        if rng.random() < gapRate:
+            date += timedelta(minutes=rng.randint(10, 120))
+        else:
+            date += timedelta(seconds=rng.randint(5, 90))
+        if rng.random() < 0.1:
+            topic = rng.choice(SENTENCES)
+
+        id = 1000 + i
+        repliedId = None
+        if i > 0 and rng.random() < replyRate:
+            repliedId = rng.choice(channel.messages[-30:]).id
+        if rng.random() < botRate:
+            message = StubMessage(id, bot, "Summarizing...", date, channel)
+        else:
+            content = topic if rng.random() < 0.6 else rng.choice(SENTENCES)
+            message = StubMessage(id, rng.choice(authors), content, date, channel, repliedId)
+        channel.messages.append(message)
+    return channel
+
+
+# •====================•
+#    SUMMARIZATION
+# •====================•
+
+def benchmarkSummarize(clusterCounts=(1, 3, 10), repeats: int = 3, seed: int = 0) -> dict:
+    """
+    Times the summarization of several clusters one by one and in batches
+    :param clusterCounts: the numbers of clusters to summarize
+    :param repeats: the number of runs, the best one is kept
+    :param seed: the random seed
+    :return: a dict linking every number of clusters to the serial and batched times (in seconds) and the speedup
+    """
+    rng = random.Random(seed)
+    results = {}
+    for nbClusters in clusterCounts:
+        clusters = [randomCluster(rng, rng.randint(3, 15), 1000 * i) for i in range(nbClusters)]
+        timings = {}
+        for mode, batchSize in (("serial", 1), ("batched", None)):
+            best = float("inf")
+            for _ in range(repeats):
+                start = time.perf_counter()
+                tldr.summarize(clusters, batchSize=batchSize, useCache=False)
+                best = min(best, time.perf_counter() - start)
+            timings[mode] = best
+        timings["speedup"] = timings["serial"] / timings["batched"]
+        results[nbClusters] = timings
+        print(f"{nbClusters} cluster(s): serial {timings['serial']:.2f}s, batched {timings['batched']:.2f}s, "
+              f"speedup x{timings['speedup']:.2f}")
+    return results
+
+
+# •====================•
+#    TL;DR STAGES
+# •====================•
+
+def gitCommit() -> str | None:
+    """
+    Gets the commit the benchmark runs on
+    :return: the hash of the commit, None outside of a git repository
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def timeStage(function, repeats: int, reset=None) -> tuple[dict, object]:
+    """
+    Times a stage of the tldr command
+    :param function: the function running the stage
+    :param repeats: the number of runs
+    :param reset: the function run (untimed) before every run, None to run nothing
+    :return: the timings (in seconds) of the first (cold) and best runs, and the result of the last run
+    """
+    times = []
+    result = None
+    for _ in range(repeats):
+        if reset is not None:
+            reset()
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return {"first": times[0], "best": min(times), "mean": sum(times) / len(times)}, result
+
+
+def benchmarkTldr(sizes=(100, 200, 1000, 5000), repeats: int = 3, seed: int = 0, timeGap: int = 5,
+                  quantity: str = "one", buffered: bool = False) -> dict:
+    """
+    Times every stage of tldr.doTldr separately on synthetic transcripts
+    getChatByTime reads the channel around its middle message, the other stages run on the whole transcript (without
+    the bot messages) so that they are measured at every size
+    The analysis, translation and embedding caches and the language priors of the authors are emptied before every run,
+    so that every run measures the models and not cache hits
+    Every result also gives the share of the texts resolved by every language detection tier
+    :param sizes: the numbers of messages of the transcripts
+    :param repeats: the number of runs of every stage
+    :param seed: the random seed
+    :param timeGap: the tldr time gap in minutes
+    :param quantity: the quantity parameter of the tldr command ("one" or "all")
+    :param buffered: True to serve getChatByTime from the bot's message buffer instead of the channel history
+    :return: the report
+    """
+    # The benchmark must not fill the on-disk embedding store of the bot with synthetic messages
+    embeddingStore = tldr.embeddingStore
+    report = {"commit": gitCommit(), "date": datetime.now(timezone.utc).isoformat(), "repeats": repeats,
+              "seed": seed, "timeGap": timeGap, "quantity": quantity, "buffered": buffered, "results": {}}
+    try:
+        for nbMessages in sizes:
+            def coldCaches() -> None:
+                tldr.embeddingStore = EmbeddingStore(embeddingStore.dimension, capacity=max(2 * nbMessages, 1))
+                analysisCache.clear()
+                with utils.translationCacheLock:
+                    utils.translationCache.clear()
+                with languageDetector.lock:
+                    languageDetector.history.clear()
+
+            coldCaches()
+            with languageDetector.lock:
+                for tier in languageDetector.counts:
+                    languageDetector.counts[tier] = 0
+            channel = syntheticTranscript(random.Random(seed), nbMessages)
+            bot = StubBot(bufferSize=max(nbMessages, 1))
+            if buffered:
+                for message in channel.messages:
+                    bot.messageBuffer.add(message)
+            messageInit = channel.messages[len(channel.messages) // 2]
+            messages = [m for m in channel.messages if not m.author.bot]
+            stages = {}
+
+            stages["getChatByTime"], (chat, _) = timeStage(
+                lambda: asyncio.run(tldr.getChatByTime(bot, messageInit, timeGap)), repeats)
+            stages["getTranslatedMessage"], translatedMessages = timeStage(
+                lambda: tldr.getTranslatedMessage(messages), repeats, coldCaches)
+            stages["similarity"], similarityMatrix = timeStage(
+                lambda: tldr.similarity(translatedMessages, messages), repeats, coldCaches)
+            stages["clustering"], clusters = timeStage(
+                lambda: tldr.clustering(messages, similarityMatrix, quantity, len(messages) // 2), repeats)
+            stages["summarize"], summaries = timeStage(
+                lambda: tldr.summarize(clusters, useCache=False,
+                                       texts={m.id: text for m, text in zip(messages, translatedMessages)}),
+                repeats)
+
+            report["results"][nbMessages] = {
+                "messages": len(messages),
+                "chatMessages": len(chat),
+                "historyCalls": channel.historyCalls // repeats,
+                "clusters": len(clusters),
+                "summaries": len(summaries),
+                "stages": stages,
+                "total": sum(stage["best"] for stage in stages.values()),
+                "languageTiers": languageDetector.report(),
+            }
+            print(f"{nbMessages} messages: " +
+                  ", ".join(f"{name} {stage['best']:.3f}s" for name, stage in stages.items()))
+    finally:
+        tldr.embeddingStore = embeddingStore
+    return report
+
+
+# •====================•
+#    BACKENDS
+# •====================•
+
+def emotionDataset(path: str = "emotion_dataset.csv") -> tuple[list[str], list[str]]:
+    """
+    Reads the emotions dataset
+    :param path: the path of the csv file
+    :return: the texts and their emotion
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = [row for row in csv.DictReader(f) if row["text"] and row["emotion"]]
+    return [row["text"] for row in rows], [row["emotion"] for row in rows]
+
+
+def benchmarkBackends(backends=utils.BACKENDS, path: str = "emotion_dataset.csv", batchSize: int = 16,
+                      repeats: int = 1) -> dict:
+    """
+    Measures the accuracy and latency of the emotion model with every inference backend
+    The accuracy only counts the emotions the model knows, the agreement is the rate of predictions identical to the
+    torch backend
+    :param backends: the backends to compare
+    :param path: the path of the emotions dataset
+    :param batchSize: the number of texts per call of the model
+    :param repeats: the number of runs, the best one is kept
+    :return: the report
+    """
+    texts, emotions = emotionDataset(path)
+    known = {m.emotionName for m in mood.Mood} - {"sleepiness"}
+    report = {"commit": gitCommit(), "date": datetime.now(timezone.utc).isoformat(), "model": "emotion",
+              "dataset": path, "texts": len(texts), "batchSize": batchSize, "results": {}}
+    reference = None
+    for backend in backends:
+        start = time.perf_counter()
+        classifier = utils.loadPipeline("emotion", "text-classification",
+                                        "j-hartmann/emotion-english-distilroberta-base", backend=backend)
+        loadTime = time.perf_counter() - start
+
+        best = float("inf")
+        for _ in range(repeats):
+            start = time.perf_counter()
+            predictions = [p["label"] for p in classifier(texts, batch_size=batchSize, truncation=True)]
+            best = min(best, time.perf_counter() - start)
+        if reference is None:
+            reference = predictions
+
+        scored = [(p, e) for p, e in zip(predictions, emotions) if e in known]
+        report["results"][backend] = {
+            "loadTime": loadTime,
+            "time": best,
+            "latency": best / len(texts),
+            "accuracy": sum(p == e for p, e in scored) / max(len(scored), 1),
+            "agreement": sum(p == r for p, r in zip(predictions, reference)) / len(texts),
+        }
+        result = report["results"][backend]
+        print(f"{backend}: accuracy {result['accuracy']:.3f}, agreement {result['agreement']:.3f}, "
+              f"{1000 * result['latency']:.2f}ms per text")
+    return report
+
+
+def main():
+    """
+    Runs the benchmarks given on the command line
+    """
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the TL;DR bot")
+    parser.add_argument("benchmark", choices=["summarize", "tldr", "backends"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 200, 1000, 5000],
+                        help="numbers of messages of the synthetic transcripts (tldr)")
+    parser.add_argument("--quantity", choices=["one", "all"], default="one")
+    parser.add_argument("--buffered", action="store_true", help="serve the history from the message buffer (tldr)")
+    parser.add_argument("--backends", nargs="+", choices=utils.BACKENDS, default=list(utils.BACKENDS))
+    parser.add_argument("--output", default="data/benchmark.json", help="path of the JSON report")
+    arguments = parser.parse_args()
+
+    if arguments.benchmark == "summarize":
+        report = benchmarkSummarize(repeats=arguments.repeats)
+    elif arguments.benchmark == "tldr":
+        report = benchmarkTldr(sizes=arguments.sizes, repeats=arguments.repeats, quantity=arguments.quantity,
+                               buffered=arguments.buffered)
+    elif arguments.benchmark == "backends":
+        report = benchmarkBackends(backends=arguments.backends, repeats=arguments.repeats)
+
+    with open(arguments.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Report written to {arguments.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
 import asyncio
 import csv
 import os
+import time
 
 import discord
 from discord import Embed
@@ -56,8 +57,9 @@ async def bye(bot, message):
     :param message: the message to process
     :return: None
     """
-    bot.save()
+    bot.flush()
     await bot.socialGraphWorker.save()
+    tldr.embeddingStore.save()
     # mood.resetMoods()
     await message.channel.send("Cya! :D")
     await bot.close()
@@ -752,8 +754,8 @@ async def tldrCommand(bot, message: discord.Message, guildData) -> None:
         channel = message.channel
         message = [msg async for msg in channel.history(limit=2, before=message)][0]
 
-    asyncio.run_coroutine_threadsafe(tldr.doTldr(bot, message, messageBot, quantity=quantity, position=position),
-                                     bot.tldrLoop)
+    # Runs on the bot's loop, the commands asking for the same summary share one computation
+    bot.tldrScheduler.submit(message, messageBot, quantity=quantity, position=position, timeGap=guildData.tldrTimeGap)
 
 
 def tldrSettings(bot, message: discord.Message, guildData) -> None:
@@ -1461,7 +1463,8 @@ def unmuteUser(bot, message, guildData, mots) -> None:
         # print all the muted users in this server in the description
         mutedUsersString = "\n"
         for user in guildData.muted_users:
-            mutedUsersString += f"{guildData.displayName[user]} muted for {guildData.muted_users[user][0]} minutes\n"
+            minutes = max(round((guildData.muted_users[user][0] - time.time()) / 60), 0)
+            mutedUsersString += f"{guildData.displayName[user]} muted for {minutes} more minutes\n"
 
         description = f"""
         `{guildData.prefix}unmuteuser <user>` - Unmute a user
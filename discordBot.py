@@ -2,16 +2,26 @@ import asyncio
 import json
 import os
 import time
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
 import discord
 from dotenv import load_dotenv
 
+import guildStore
+import languageDetector
+import messageAnalysis
+import messageBuffer
 import messageProcess
 import mod
 import mood
+import muteScheduler
 import socialGraph
+import tldr
+import tldrScheduler
 import utils
+from inferenceService import inferenceService
+from modelRegistry import registry
 
 load_dotenv()
 
@@ -85,7 +95,8 @@ class GuildData:
         self.badWords = badWords
         self.permUser = permUser
         self.permGroup = permGroup
-        self.muted_users = {int(k): v for (k, v) in muted_users.items()}
+        # The mutes saved as remaining minutes by older versions are converted to expiry timestamps
+        self.muted_users = {int(k): [muteScheduler.expiryTimestamp(v[0]), v[1]] for (k, v) in muted_users.items()}
         self.moderators = moderators
 
     def toDict(self) -> dict:
@@ -119,13 +130,19 @@ class Bot(discord.Client):
     The bot class inherits from discord.Client
     :guidsId: a set of all guilds id the bot is in
     :guildsDict: a dict of all guildData the bot is in, with the guild id as key
-    :tldrLoop: the loop for the tldr command
+    :tldrLoop: the loop ingesting the messages for the tldr command
+    :tldrExecutor: the threads running the model stages of the tldr command, off the bot's loop
+    :tldrScheduler: the scheduler of the tldr commands, running on the bot's loop
+    :modelsWarmedUp: True once the background warm-up of the models is started
     :moodLoop: the loop for the mood command
     :socialGraphLoop: the loop for the social graph command
     :autoModLoop: the loop for the auto mod command
     :moodUpdates: a list of list of tuples (guildId, updateType) where updateType is True for refresh and False for reset
     :moodUpdateMinute: the current minute of the "clock" used to know when to update the moods
     :socialGraphWorker: the worker for the social graph command
+    :messageBuffer: the recent consented messages of every channel, read by the tldr command
+    :guildStore: the debounced persistence of the guilds' data
+    :muteScheduler: the timer lifting the mutes when they expire
     """
 
     def __init__(self, *args, **kwargs):
@@ -152,6 +169,18 @@ class Bot(discord.Client):
         self.moodUpdateMinute: int = 0  # Current minute of the "clock"
         # SocialGraph
         self.socialGraphWorker = None
+        # TL;DR
+        self.messageBuffer = messageBuffer.MessageBuffer(utils.getSetting("MESSAGE_BUFFER_SIZE", 500))
+        self.tldrExecutor = ThreadPoolExecutor(max_workers=utils.getSetting("TLDR_WORKERS", 2),
+                                               thread_name_prefix="tldr")
+        self.tldrScheduler = tldrScheduler.TldrScheduler(self, workers=utils.getSetting("TLDR_JOBS", 2))
+        # Models
+        self.modelsWarmedUp = False
+        # Persistence
+        self.guildStore = guildStore.GuildStore('data/guilds.json', utils.getSetting("SAVE_DELAY", 5.0),
+                                                lambda: self.guildsId, lambda: self.guildsDict)
+        # AutoMod
+        self.muteScheduler = muteScheduler.MuteScheduler(self)
 
     async def on_ready(self) -> None:
         """
@@ -200,6 +229,11 @@ class Bot(discord.Client):
 
         print('Logged on as', self.user)
 
+        # Loads the models of the warm-up list without delaying the connection (on_ready is called on reconnections)
+        if utils.getSetting("MODEL_WARMUP_BACKGROUND", True) and not self.modelsWarmedUp:
+            self.modelsWarmedUp = True
+            registry.warmUpInBackground(modelWarmUpList())
+
         for id in self.guildsDict:
             guildData = self.guildsDict[id]
             print(guildData.id)
@@ -223,6 +257,11 @@ class Bot(discord.Client):
         # Launches mood updates clock
         Thread(target=self.timeLoop, daemon=True).start()
 
+        # Lifts the mutes expired while the bot was offline, then sleeps until the next expiry
+        if self.muteScheduler.loop is None:
+            self.muteScheduler.load()
+            self.muteScheduler.start(self.autoModLoop)
+
         # Resets the mood roles for each guild
         for guildID in self.guildsId:
             guild = self.get_guild(guildID)
@@ -242,13 +281,19 @@ class Bot(discord.Client):
             if not mod.rolesPresent(guild):
                 asyncio.run_coroutine_threadsafe(mod.createRole(self, guild), self.autoModLoop)
 
-    def save(self):
-        data = {
-            "guildsId":   list(self.guildsId),
-            "guildsDict": {id: guildData.toDict() for id, guildData in self.guildsDict.items()}
-        }
-        with open('data/guilds.json', 'w') as f:
-            json.dump(data, f, indent=4)
+    def save(self) -> None:
+        """
+        Requests a write of the guilds' data to data/guilds.json, done in the background within SAVE_DELAY seconds
+        :return: None
+        """
+        self.guildStore.request()
+
+    def flush(self) -> None:
+        """
+        Writes the guilds' data now if a write was requested, used at shutdown
+        :return: None
+        """
+        self.guildStore.flush()
 
     async def initialise_social_graphs(self) -> None:
         """
@@ -270,10 +315,18 @@ class Bot(discord.Client):
             self.socialGraphLoop
         )
 
-    async def on_message(self, message) -> None:
+    async def on_disconnect(self) -> None:
+        """
+        Called when the connection to Discord is lost, the messages sent until it is back never reach on_message
+        :return: None
+        """
+        self.messageBuffer.reset()
+
+    async def on_message(self, message, edited: bool = False) -> None:
         """
         Called when a message is sent in a channel the bot can see
         :param message: The message sent
+        :param edited: True if the message is an edited message
         :return: None
         """
         if message.author == self.user or message.author.bot:  # First part useless? self.user is bot
@@ -285,7 +338,11 @@ class Bot(discord.Client):
         if message.author not in guildData.users:
             return
 
-        message.content = utils.toEnglish(message.clean_content)
+        # The commands run on the raw content, the other messages are analysed in the background and their consumers
+        # (tldr, mood, social graph) await the English text
+        if not message.clean_content.startswith(guildData.prefix):
+            messageAnalysis.analysisPipeline.submit(message)
+        self.messageBuffer.add(message, edited)
         # await message.channel.send(f"Language: {utils.getLanguage(message.clean_content)}, Message: {message.content}")
 
         # message.content = message.content.lower()
@@ -303,7 +360,24 @@ class Bot(discord.Client):
         :param after: The message after it was edited
         :return: None
         """
-        await self.on_message(after)
+        await self.on_message(after, edited=True)
+
+    async def on_raw_message_delete(self, payload) -> None:
+        """
+        Called when a message is deleted
+        :param payload: The payload of the deletion
+        :return: None
+        """
+        self.messageBuffer.remove(payload.channel_id, payload.message_id)
+
+    async def on_raw_bulk_message_delete(self, payload) -> None:
+        """
+        Called when messages are deleted in bulk
+        :param payload: The payload of the deletion
+        :return: None
+        """
+        for messageId in payload.message_ids:
+            self.messageBuffer.remove(payload.channel_id, messageId)
 
     async def on_raw_reaction_add(self, payload) -> None:
         """
@@ -356,7 +430,7 @@ class Bot(discord.Client):
             emoji = payload.emoji.name
             if emoji == "✅":
                 emotion = guildData.emotionCheckMessages[messageID].emotionName
-                mood.addCSV(utils.toEnglish(referencedMessage.clean_content), emotion)
+                mood.addCSV(await messageAnalysis.analysisPipeline.english(referencedMessage), emotion)
             elif emoji == "➡️":
                 for emoji in [m.emoji for m in mood.Mood]:
                     try:
@@ -366,7 +440,7 @@ class Bot(discord.Client):
                 return
             elif emoji in [m.emoji for m in mood.Mood]:
                 emotion = [m.emotionName for m in mood.Mood if m.emoji == emoji][0]
-                mood.addCSV(utils.toEnglish(referencedMessage.clean_content), emotion)
+                mood.addCSV(await messageAnalysis.analysisPipeline.english(referencedMessage), emotion)
 
             try:
                 await message.delete()
@@ -558,27 +632,58 @@ class Bot(discord.Client):
         Keeps track of time and calls the functions that need to be called every minute
         """
         self.moodUpdateMinute = 0
+        statisticsMinutes = utils.getSetting("STATISTICS_LOG_MINUTES", 10)
+        minutes = 0
         while True:
             # Goes to next minute
             time.sleep(60)
+            minutes += 1
 
             # Mood updates
             self.moodUpdateMinute = (self.moodUpdateMinute + 1) % 181  # Goes up to 3 hours
             asyncio.run_coroutine_threadsafe(mood.updateMoods(self), self.moodLoop)
 
-            # AutoMod updates
-            asyncio.run_coroutine_threadsafe(mod.updateMuted(self), self.autoModLoop)
-
             # Socialgraph save
             if self.moodUpdateMinute % 2 == 0:
                 asyncio.run_coroutine_threadsafe(self.socialGraphWorker.save(), self.socialGraphLoop)
 
+            # Embedding store save
+            if self.moodUpdateMinute % 10 == 0:
+                tldr.embeddingStore.save()
+
+            # Statistics of the models
+            if statisticsMinutes and minutes % statisticsMinutes == 0:
+                self.logStatistics()
+
+    @utils.printExceptions
+    def logStatistics(self) -> None:
+        """
+        Prints the statistics of the models since the bot started
+        :return: None
+        """
+        print(f"Language detection tiers: {json.dumps(languageDetector.languageDetector.report())}")
+        print(f"Translation pairs: {json.dumps(utils.translationPool.report())}")
+        print(f"Inference service: {json.dumps(inferenceService.report())}")
+
+
+def modelWarmUpList() -> list[str] | None:
+    """
+    Reads the models to load before they are used from the MODEL_WARMUP setting
+    :return: the names of the models, None for every model ("all")
+    """
+    names = [name.strip() for name in utils.getSetting("MODEL_WARMUP", "").split(",") if name.strip()]
+    if "all" in names:
+        return None
+    return names
+
 
 def main():
     """
     Main function of the bot
     Starts the bot
     """
+    if not utils.getSetting("MODEL_WARMUP_BACKGROUND", True):
+        registry.warmUp(modelWarmUpList())
     intents = discord.Intents.default()
     intents.message_content = True
     intents.reactions = True
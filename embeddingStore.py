@@ -0,0 +1,247 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+
+from utils import contentHash, printExceptions
+
+
+# •===================•
+#    EMBEDDING STORE
+# •===================•
+
+class EmbeddingStore:
+    """
+    Bounded store of the embeddings of the messages, keyed by message id and content hash
+    An edited message gets a new key, so its old embedding is never served again
+    :dimension: the size of an embedding
+    :capacity: the maximum number of embeddings kept, the least recently used ones are evicted first
+    :dtype: the dtype of the stored embeddings (float16 halves the memory used)
+    :path: the path (without extension) of the on-disk backing, None to keep everything in memory
+    :fingerprints: the fingerprint of the key of every row (0 for a free row), written next to the rows so that an
+    index older than the rows (after a crash) never serves a row reused by another message
+    :slots: links every key to its row in vectors, from the least to the most recently used
+    :messageKeys: links every message id to its current key
+    :hits: the number of embeddings served from the store
+    :misses: the number of embeddings that had to be computed
+    """
+
+    def __init__(self, dimension: int, capacity: int = 20000, half: bool = False, path: str | None = None):
+        """
+        Constructor
+        :param dimension: the size of an embedding
+        :param capacity: the maximum number of embeddings kept
+        :param half: True to store the embeddings as float16
+        :param path: the path (without extension) of the memory-mapped file, None to keep the store in memory
+        """
+        self.dimension = dimension
+        self.capacity = capacity
+        self.dtype = np.dtype(np.float16 if half else np.float32)
+        self.path = path
+        self.slots: OrderedDict[str, int] = OrderedDict()
+        self.messageKeys: dict[int, str] = {}
+        self.freeSlots: list[int] = []
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.vectors, self.fingerprints = self.open()
+
+    # •======================•
+    #    STORAGE
+    # •======================•
+
+    def open(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Opens the storage of the embeddings, reloading the on-disk backing if it matches the store's settings
+        The entries of the index whose row holds another key (rows written after the last save) are dropped
+        :return: the array holding one embedding per row and the array holding the fingerprint of every row
+        """
+        if self.path is None:
+            self.freeSlots = list(range(self.capacity - 1, -1, -1))
+            return (np.zeros((self.capacity, self.dimension), dtype=self.dtype),
+                    np.zeros(self.capacity, dtype=np.uint64))
+
+        vectorsPath, fingerprintsPath, indexPath = self.path + ".npy", self.path + ".keys.npy", self.path + ".json"
+        os.makedirs(os.path.dirname(vectorsPath) or ".", exist_ok=True)
+        try:
+            vectors = np.lib.format.open_memmap(vectorsPath, mode="r+")
+            fingerprints = np.lib.format.open_memmap(fingerprintsPath, mode="r+")
+            with open(indexPath, "r") as f:
+                index = json.load(f)
+            if vectors.shape != (self.capacity, self.dimension) or vectors.dtype != self.dtype or \
+                    fingerprints.shape != (self.capacity,) or fingerprints.dtype != np.uint64:
+                raise ValueError("Embedding store settings changed")
+        except (OSError, ValueError):
+            vectors = np.lib.format.open_memmap(vectorsPath, mode="w+", dtype=self.dtype,
+                                                shape=(self.capacity, self.dimension))
+            fingerprints = np.lib.format.open_memmap(fingerprintsPath, mode="w+", dtype=np.uint64,
+                                                     shape=(self.capacity,))
+            index = []
+
+        stale = 0
+        for key, slot in index:
+            if fingerprints[slot] != self.fingerprint(key):
+                stale += 1
+                continue
+            self.slots[key] = slot
+            self.messageKeys[int(key.split(":")[0])] = key
+        if stale:
+            print(f"Embedding store: {stale} entries of the index were overwritten since it was saved, they are dropped")
+        used = set(self.slots.values())
+        self.freeSlots = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+        return vectors, fingerprints
+
+    @printExceptions
+    def save(self) -> None:
+        """
+        Writes the on-disk backing, does nothing for an in-memory store
+        :return: None
+        """
+        if self.path is None:
+            return
+        with self.lock:
+            self.vectors.flush()
+            self.fingerprints.flush()
+            index = list(self.slots.items())
+        temporaryPath = self.path + ".json.tmp"
+        with open(temporaryPath, "w") as f:
+            json.dump(index, f)
+        os.replace(temporaryPath, self.path + ".json")
+
+    # •======================•
+    #    ACCESS
+    # •======================•
+
+    @staticmethod
+    def key(messageId: int, text: str) -> str:
+        """
+        Computes the key of a message
+        :param messageId: the id of the message
+        :param text: the text that is embedded
+        :return: the key
+        """
+        return f"{messageId}:{contentHash(text)}"
+
+    @staticmethod
+    def fingerprint(key: str) -> int:
+        """
+        Computes the fingerprint of a key, stored next to its row
+        :param key: the key
+        :return: the fingerprint, never 0 (the fingerprint of the free rows)
+        """
+        return int(contentHash(key), 16) or 1
+
+    def get(self, messageId: int, text: str) -> np.ndarray | None:
+        """
+        Gets the embedding of a message
+        :param messageId: the id of the message
+        :param text: the text that is embedded
+        :return: the embedding as float32, None if it is not in the store
+        """
+        key = self.key(messageId, text)
+        with self.lock:
+            if key not in self.slots:
+                return None
+            self.slots.move_to_end(key)
+            return self.vectors[self.slots[key]].astype(np.float32)
+
+    def put(self, messageId: int, text: str, vector: np.ndarray) -> None:
+        """
+        Stores the embedding of a message, replacing the embedding of a previous version of the message
+        :param messageId: the id of the message
+        :param text: the text that is embedded
+        :param vector: the embedding
+        :return: None
+        """
+        with self.lock:
+            self.insert(messageId, self.key(messageId, text), vector)
+
+    def insert(self, messageId: int, key: str, vector: np.ndarray) -> None:
+        """
+        Stores an embedding, the lock must be held
+        :param messageId: the id of the message
+        :param key: the key of the message
+        :param vector: the embedding
+        :return: None
+        """
+        if key in self.slots:
+            self.slots.move_to_end(key)
+            self.write(self.slots[key], key, vector)
+            return
+
+        oldKey = self.messageKeys.get(messageId)
+        if oldKey is not None and oldKey in self.slots:  # The message was edited
+            self.freeSlots.append(self.slots.pop(oldKey))
+
+        if not self.freeSlots:  # Evicts the least recently used embedding
+            evictedKey, slot = self.slots.popitem(last=False)
+            evictedId = int(evictedKey.split(":")[0])
+            if self.messageKeys.get(evictedId) == evictedKey:
+                del self.messageKeys[evictedId]
+            self.freeSlots.append(slot)
+
+        slot = self.freeSlots.pop()
+        self.write(slot, key, vector)
+        self.slots[key] = slot
+        self.messageKeys[messageId] = key
+
+    def write(self, slot: int, key: str, vector: np.ndarray) -> None:
+        """
+        Writes an embedding in a row, the fingerprint is cleared while the row is written so that a crash in between
+        leaves a row that no key matches
+        :param slot: the row
+        :param key: the key of the embedding
+        :param vector: the embedding
+        :return: None
+        """
+        self.fingerprints[slot] = 0
+        self.vectors[slot] = vector
+        self.fingerprints[slot] = self.fingerprint(key)
+
+    def getEmbeddings(self, messageIds: list[int], texts: list[str],
+                      encoder: Callable[[list[str]], np.ndarray]) -> np.ndarray:
+        """
+        Gets the embeddings of a list of messages, only the messages missing from the store are embedded
+        :param messageIds: the ids of the messages
+        :param texts: the texts to embed, one per message
+        :param encoder: the function embedding a list of texts
+        :return: np.ndarray of size len(texts) x dimension
+        """
+        embeddings = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        keys = [self.key(messageId, text) for messageId, text in zip(messageIds, texts)]
+        missing: dict[str, list[int]] = {}
+
+        with self.lock:
+            for i, key in enumerate(keys):
+                if key in self.slots:
+                    self.slots.move_to_end(key)
+                    embeddings[i] = self.vectors[self.slots[key]]
+                else:
+                    missing.setdefault(key, []).append(i)
+            nbMissing = sum(len(indexes) for indexes in missing.values())
+            self.hits += len(keys) - nbMissing
+            self.misses += nbMissing
+
+        if not missing:
+            return embeddings
+
+        firstIndexes = [indexes[0] for indexes in missing.values()]
+        vectors = encoder([texts[i] for i in firstIndexes])
+
+        with self.lock:
+            for (key, indexes), i, vector in zip(missing.items(), firstIndexes, vectors):
+                self.insert(messageIds[i], key, vector)
+                # read back so that a message has the same (possibly float16) embedding on every call
+                embeddings[indexes] = self.vectors[self.slots[key]]
+
+        return embeddings
+
+    def __len__(self) -> int:
+        """
+        Gets the number of embeddings in the store
+        :return: the number of embeddings
+        """
+        return len(self.slots)
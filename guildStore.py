@@ -0,0 +1,97 @@
+import json
+import os
+import threading
+import traceback
+from typing import Callable
+
+
+# •===============•
+#    GUILD STORE
+# •===============•
+
+class GuildStore:
+    """
+    Debounced persistence of the guilds' data: saving only requests a write, and the requests made during the debounce
+    delay are written together by a background thread
+    Every write serializes all the guilds again (the guilds' data is changed in many places, a write never misses one)
+    and the file is replaced atomically (temporary file then rename)
+    :path: the path of the JSON file
+    :delay: the number of seconds between the first request and the write
+    :guildsId: the function getting the ids of the guilds of the bot
+    :guildsDict: the function getting the dict linking the id of every guild to its data
+    :pending: True if a write was requested since the last write
+    :timer: the timer of the next write, None if no write is scheduled
+    :writes: the number of times the file was written
+    :requests: the number of write requests since the bot started
+    """
+
+    def __init__(self, path: str, delay: float, guildsId: Callable[[], set], guildsDict: Callable[[], dict]):
+        """
+        Constructor
+        :param path: the path of the JSON file
+        :param delay: the number of seconds between the first request and the write
+        :param guildsId: the function getting the ids of the guilds of the bot
+        :param guildsDict: the function getting the dict linking the id of every guild to its data
+        """
+        self.path = path
+        self.delay = delay
+        self.guildsId = guildsId
+        self.guildsDict = guildsDict
+        self.pending = False
+        self.timer: threading.Timer | None = None
+        self.writes = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        # Only one write at a time, the timer and a forced flush may race
+        self.writeLock = threading.Lock()
+
+    def request(self) -> None:
+        """
+        Requests a write of the guilds' data and schedules it if none is scheduled
+        :return: None
+        """
+        with self.lock:
+            self.requests += 1
+            self.pending = True
+            self.schedule()
+
+    def schedule(self) -> None:
+        """
+        Schedules a write if none is scheduled, the lock must be held
+        :return: None
+        """
+        if self.timer is None:
+            self.timer = threading.Timer(self.delay, self.flush)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def flush(self) -> None:
+        """
+        Writes the data of every guild now if a write was requested, called by the timer and at shutdown
+        :return: None
+        """
+        with self.writeLock:
+            with self.lock:
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+                pending, self.pending = self.pending, False
+            if not pending:
+                return
+
+            try:
+                records = {id: guildData.toDict() for id, guildData in list(self.guildsDict().items())}
+                data = json.dumps({"guildsId": list(self.guildsId()), "guildsDict": records}, separators=(",", ":"))
+
+                temporaryPath = self.path + ".tmp"
+                with open(temporaryPath, 'w') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(temporaryPath, self.path)
+                self.writes += 1
+            except:  # The guilds changed while they were serialized (or the disk failed), the write is retried
+                traceback.print_exc()
+                with self.lock:
+                    self.pending = True
+                    self.schedule()
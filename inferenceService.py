@@ -0,0 +1,196 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable
+
+from utils import getSetting
+
+
+class InferenceRequest:
+    """
+    An input waiting to be given to a model
+    :item: the input
+    :future: the future receiving the output
+    :time: the time the request was submitted (time.monotonic)
+    """
+
+    def __init__(self, item):
+        """
+        Constructor
+        :param item: the input
+        """
+        self.item = item
+        self.future = Future()
+        self.time = time.monotonic()
+
+
+# •=====================•
+#    INFERENCE SERVICE
+# •=====================•
+
+class InferenceService:
+    """
+    Runs the models of every part of the bot on one thread, the requests for the same model are gathered into
+    micro-batches: a batch starts once its oldest request waited for the batching window or once it is full
+    Running every model on one thread keeps the loops of the bot from competing for the same CPU threads
+    The summaries are the exception, they run on the tldr executor since one generation would hold the short requests
+    of the other models for seconds
+    :window: the number of seconds the oldest request of a model waits for other requests
+    :maxBatch: the maximum number of requests in a batch
+    :handlers: links the name of every model to the function computing the outputs of a batch of inputs
+    :queues: links the name of every model to its waiting requests, in order
+    :stats: links the name of every model to its number of requests, batches and batched requests, the largest batch
+    and the largest queue depth
+    """
+
+    def __init__(self, window: float = 0.01, maxBatch: int = 32):
+        """
+        Constructor
+        :param window: the number of seconds the oldest request of a model waits for other requests
+        :param maxBatch: the maximum number of requests in a batch
+        """
+        self.window = window
+        self.maxBatch = maxBatch
+        self.handlers: dict[str, Callable[[list], list]] = {}
+        self.queues: dict[str, deque[InferenceRequest]] = {}
+        self.stats: dict[str, dict[str, int]] = {}
+        self.condition = threading.Condition()
+        self.thread: threading.Thread | None = None
+
+    def register(self, name: str, handler: Callable[[list], list]) -> None:
+        """
+        Registers a model
+        :param name: the name of the model
+        :param handler: the function computing the outputs of a list of inputs, in order
+        :return: None
+        """
+        with self.condition:
+            self.handlers[name] = handler
+            self.queues[name] = deque()
+            self.stats[name] = {"requests": 0, "batches": 0, "batched": 0, "maxBatch": 0,
+                                "maxQueueDepth": 0}
+
+    def submit(self, name: str, item) -> Future:
+        """
+        Asks for the output of a model on an input
+        :param name: the name of the model
+        :param item: the input
+        :return: the future receiving the output
+        """
+        request = InferenceRequest(item)
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True, name="inferenceService")
+                self.thread.start()
+            queue = self.queues[name]
+            queue.append(request)
+            stats = self.stats[name]
+            stats["requests"] += 1
+            stats["maxQueueDepth"] = max(stats["maxQueueDepth"], len(queue))
+            self.condition.notify()
+        return request.future
+
+    def infer(self, name: str, item):
+        """
+        Gets the output of a model on an input, waiting for it
+        :param name: the name of the model
+        :param item: the input
+        :return: the output
+        """
+        return self.submit(name, item).result()
+
+    def inferMany(self, name: str, items: list) -> list:
+        """
+        Gets the outputs of a model on many inputs, waiting for them
+        :param name: the name of the model
+        :param items: the inputs
+        :return: the outputs, in order
+        """
+        return [future.result() for future in [self.submit(name, item) for item in items]]
+
+    async def inferAsync(self, name: str, item):
+        """
+        Gets the output of a model on an input without blocking the running loop
+        :param name: the name of the model
+        :param item: the input
+        :return: the output
+        """
+        return await asyncio.wrap_future(self.submit(name, item))
+
+    def nextBatch(self) -> tuple[str, list[InferenceRequest]]:
+        """
+        Waits for the next batch to run: the requests of the model with the oldest request, once that request waited
+        for the batching window or the model has a full batch
+        :return: the name of the model and the requests of the batch
+        """
+        with self.condition:
+            while True:
+                waiting = [name for name, queue in self.queues.items() if queue]
+                if not waiting:
+                    self.condition.wait()
+                    continue
+                name = min(waiting, key=lambda n: self.queues[n][0].time)
+                queue = self.queues[name]
+                delay = queue[0].time + self.window - time.monotonic()
+                if delay > 0 and len(queue) < self.maxBatch:
+                    self.condition.wait(delay)
+                    continue
+                batch = [queue.popleft() for _ in range(min(len(queue), self.maxBatch))]
+                stats = self.stats[name]
+                stats["batches"] += 1
+                stats["batched"] += len(batch)
+                stats["maxBatch"] = max(stats["maxBatch"], len(batch))
+                return name, batch
+
+    @staticmethod
+    def resolve(batch: list[InferenceRequest], outputs: list) -> None:
+        """
+        Gives their output to the requests of a batch
+        :param batch: the requests
+        :param outputs: the outputs of the handler, in order
+        :return: None
+        """
+        outputs = list(outputs)
+        if len(outputs) != len(batch):  # No request may be left without an output
+            raise ValueError(f"The model returned {len(outputs)} outputs for {len(batch)} inputs")
+        for request, output in zip(batch, outputs):
+            request.future.set_result(output)
+
+    def run(self) -> None:
+        """
+        Runs the batches forever, runs in the thread of the service
+        A failed batch is run again one request at a time so that one bad input only fails its own request
+        :return: None
+        """
+        while True:
+            name, batch = self.nextBatch()
+            handler = self.handlers[name]
+            try:
+                self.resolve(batch, handler([request.item for request in batch]))
+            except Exception as e:
+                if len(batch) == 1:
+                    batch[0].future.set_exception(e)
+                    continue
+                for request in batch:
+                    try:
+                        self.resolve([request], handler([request.item]))
+                    except Exception as itemError:
+                        request.future.set_exception(itemError)
+
+    def report(self) -> dict:
+        """
+        Gets the statistics of every model
+        :return: a dict linking the name of every model to its current queue depth, number of requests and batches,
+        mean and largest batch size and largest queue depth
+        """
+        with self.condition:
+            return {name: {"queueDepth": len(self.queues[name]),
+                           "meanBatch": stats["batched"] / stats["batches"] if stats["batches"] else 0.0,
+                           **stats}
+                    for name, stats in self.stats.items()}
+
+
+inferenceService = InferenceService(getSetting("INFERENCE_BATCH_WINDOW_MS", 10) / 1000,
+                                    getSetting("INFERENCE_MAX_BATCH", 32))
@@ -0,0 +1,156 @@
+import datetime
+import json
+import os
+import sqlite3
+import threading
+
+from utils import getSetting
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS infractions (
+    id INTEGER PRIMARY KEY,
+    guild INTEGER NOT NULL,
+    user INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    time TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS infractionsGuildUser ON infractions (guild, user);
+CREATE INDEX IF NOT EXISTS infractionsUser ON infractions (user);
+CREATE TABLE IF NOT EXISTS migrations (name TEXT PRIMARY KEY);
+"""
+
+
+# •====================•
+#    INFRACTION STORE
+# •====================•
+
+class InfractionStore:
+    """
+    Moderation infractions stored in an embedded SQLite database, indexed on (guild, user) and on user
+    Adding an infraction is one insert and reading the infractions of a user is one indexed query, whatever the size of
+    the history
+    :path: the path of the database
+    :legacyPath: the path of the JSON file the infractions used to be stored in, migrated on the first connection
+    :connection: the connection to the database, opened on first use
+    """
+
+    def __init__(self, path: str, legacyPath: str | None = None):
+        """
+        Constructor
+        :param path: the path of the database
+        :param legacyPath: the path of the JSON file to migrate, None to migrate nothing
+        """
+        self.path = path
+        self.legacyPath = legacyPath
+        self.connection: sqlite3.Connection | None = None
+        self.lock = threading.Lock()
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Gets the connection to the database, creating the database and migrating the JSON file the first time
+        The lock must be held
+        :return: the connection
+        """
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # The moderation runs on several loops, the lock serializes the uses of the connection
+            self.connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(SCHEMA)
+            self.migrate()
+        return self.connection
+
+    def migrate(self) -> None:
+        """
+        Imports the infractions of the legacy JSON file ({guild: {user: {type: {reason: time}}}}) once, the lock must
+        be held
+        :return: None
+        """
+        if self.legacyPath is None or not os.path.exists(self.legacyPath):
+            return
+        if self.connection.execute("SELECT 1 FROM migrations WHERE name = ?", (self.legacyPath,)).fetchone():
+            return
+
+        with open(self.legacyPath, 'r') as f:
+            data = json.load(f)
+        rows = [(int(guild), int(user), type, reason, time)
+                for guild, users in data.items()
+                for user, types in users.items()
+                for type, reasons in types.items()
+                for reason, time in reasons.items()]
+        with self.connection:
+            self.connection.executemany("INSERT INTO infractions (guild, user, type, reason, time) "
+                                        "VALUES (?, ?, ?, ?, ?)", rows)
+            self.connection.execute("INSERT INTO migrations (name) VALUES (?)", (self.legacyPath,))
+        print(f"Migrated {len(rows)} infractions from {self.legacyPath}")
+
+    def add(self, userID: int, guildID: int, infractionType: str, reason: str) -> None:
+        """
+        Adds an infraction
+        :param userID: the id of the user
+        :param guildID: the id of the guild
+        :param infractionType: the type of infraction
+        :param reason: the reason of the infraction
+        :return: None
+        """
+        time = datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.execute("INSERT INTO infractions (guild, user, type, reason, time) VALUES (?, ?, ?, ?, ?)",
+                                   (guildID, userID, infractionType, reason, time))
+
+    @staticmethod
+    def nest(rows: list[tuple[str, str, str]]) -> dict[str, dict[str, str]]:
+        """
+        Groups infractions by type, like the legacy JSON file (a reason given twice keeps its last time)
+        :param rows: the (type, reason, time) of the infractions, from the oldest
+        :return: links every type to a dict linking every reason to its time
+        """
+        infractions = {}
+        for infractionType, reason, time in rows:
+            infractions.setdefault(infractionType, {})[reason] = time
+        return infractions
+
+    def infractions(self, userID: int, guildID: int) -> dict[str, dict[str, str]]:
+        """
+        Gets the infractions of a user in a guild
+        :param userID: the id of the user
+        :param guildID: the id of the guild
+        :return: links every type of infraction to a dict linking every reason to its time
+        """
+        with self.lock:
+            rows = self.connect().execute("SELECT type, reason, time FROM infractions WHERE guild = ? AND user = ? "
+                                          "ORDER BY id", (guildID, userID)).fetchall()
+        return self.nest(rows)
+
+    def infractionsEverywhere(self, userID: int) -> list[dict[str, dict[str, str]]]:
+        """
+        Gets the infractions of a user in every guild
+        :param userID: the id of the user
+        :return: the infractions of the user in every guild they have infractions in
+        """
+        with self.lock:
+            rows = self.connect().execute("SELECT guild, type, reason, time FROM infractions WHERE user = ? "
+                                          "ORDER BY id", (userID,)).fetchall()
+        guilds: dict[int, list] = {}
+        for guild, infractionType, reason, time in rows:
+            guilds.setdefault(guild, []).append((infractionType, reason, time))
+        return [self.nest(guildRows) for guildRows in guilds.values()]
+
+    def close(self) -> None:
+        """
+        Closes the connection to the database
+        :return: None
+        """
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+infractionStore = InfractionStore(getSetting("INFRACTION_DATABASE", "data/infractions.sqlite3"), "data/userInfo.json")
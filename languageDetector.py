@@ -0,0 +1,217 @@
+import re
+import threading
+from collections import Counter, deque
+from typing import Callable
+
+from utils import getSetting
+
+# Parts of a message saying nothing about its language: links, custom emojis, mentions and channels
+NOISE = re.compile(r"https?://\S+|<a?:\w+:\d+>|<[@#][!&]?\d+>")
+LETTER = re.compile(r"[^\W\d_]")
+WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+# Scripts only written in one of the languages of the detection model
+SCRIPTS = [(re.compile(r"[\u3040-\u30ff]"), "ja"),  # Kana, checked before the Han characters shared with Chinese
+           (re.compile(r"[\u0370-\u03ff]"), "el"),
+           (re.compile(r"[\u0e00-\u0e7f]"), "th"),
+           (re.compile(r"[\u0900-\u097f]"), "hi"),
+           (re.compile(r"[\u4e00-\u9fff]"), "zh")]
+
+# The Latin-script languages told apart without the model, a word or a letter shared by several of them is no evidence
+STOPWORDS = {
+    "en": {"the", "and", "is", "are", "was", "were", "you", "i", "it", "to", "of", "in", "that", "this", "what", "for",
+           "with", "have", "has", "not", "but", "be", "do", "does", "don't", "i'm", "it's", "my", "your", "we", "they",
+           "on", "at", "just", "so", "if", "can", "will", "would", "there", "about", "how", "why", "who"},
+    "fr": {"le", "la", "les", "des", "et", "est", "un", "une", "je", "tu", "il", "elle", "nous", "vous", "ils", "pas",
+           "que", "qui", "ce", "ça", "c'est", "dans", "pour", "sur", "avec", "mais", "ou", "donc", "du", "au", "aux",
+           "mon", "ton", "son", "mes", "tes", "ses", "j'ai", "suis", "sont", "fait", "oui", "non", "très", "quoi",
+           "pourquoi", "comment", "ne", "en"},
+    "es": {"el", "la", "los", "las", "de", "del", "que", "y", "en", "es", "un", "una", "por", "para", "con", "pero",
+           "muy", "yo", "tú", "mi", "su", "lo", "le", "se", "está", "son", "como", "más", "qué", "porque", "también",
+           "hay", "esto", "eso", "pues", "no"},
+    "it": {"il", "lo", "la", "gli", "le", "di", "che", "è", "e", "un", "una", "non", "per", "con", "sono", "mi", "ti",
+           "ci", "si", "ma", "anche", "questo", "quello", "della", "del", "nel", "alla", "perché", "cosa", "io", "tu",
+           "lui", "lei", "noi", "voi", "loro", "ho", "hai", "molto", "mia", "mio", "tuo", "sei", "no"},
+    "pt": {"os", "da", "das", "dos", "de", "que", "e", "é", "um", "uma", "não", "eu", "você", "ele", "ela", "nós",
+           "eles", "com", "para", "por", "mas", "muito", "isso", "isto", "está", "são", "tem", "meu", "minha", "também",
+           "mais", "como", "na", "no", "nos", "ao", "se"},
+    "de": {"der", "die", "das", "und", "ist", "nicht", "ich", "du", "sie", "wir", "ihr", "ein", "eine", "zu", "mit",
+           "auf", "für", "den", "dem", "des", "sich", "auch", "noch", "nur", "wie", "aber", "oder", "kann", "habe",
+           "bin", "sind", "wenn", "dass", "schon", "es"},
+}
+LETTERS = {"fr": set("îïûÿœë"), "es": set("ñ¿¡"), "it": set("ìò"), "pt": set("ãõ"), "de": set("äöß")}
+
+# The stopwords and letters of only one language
+DISTINCTIVE_WORDS = {language: words - set().union(*(other for name, other in STOPWORDS.items() if name != language))
+                     for language, words in STOPWORDS.items()}
+DISTINCTIVE_LETTERS = {language: letters - set().union(*(other for name, other in LETTERS.items() if name != language))
+                       for language, letters in LETTERS.items()}
+
+
+def onlyLanguage(scores: dict[str, int], language: str) -> bool:
+    """
+    Checks that a text has no stopword of the languages other than one
+    :param scores: links every language to its stopword score in the text
+    :param language: the language
+    :return: True if every other language has a score of 0
+    """
+    return all(score == 0 for other, score in scores.items() if other != language)
+
+
+# •=====================•
+#    LANGUAGE DETECTOR
+# •=====================•
+
+class LanguageDetector:
+    """
+    Detects the language of the messages with the cheapest tier able to decide, the transformer model only runs on the
+    messages the other tiers find ambiguous
+    Tiers, in order: "trivial" (no letters: emojis, links, numbers), "charset" (a script used by one language),
+    "stopwords" (stopwords and letters of only one of English, French, Spanish, Italian, Portuguese and German), "prior"
+    (the language the author almost always writes in) and "model" (the transformer)
+    :defaultLanguage: the language given to the messages without letters
+    :minStopwords: the number of stopwords of a language needed to decide when the other language has none
+    :priorSize: the number of recent languages kept per author
+    :priorMinMessages: the number of recent languages an author needs before the prior is used
+    :priorShare: the share of the recent messages of an author that must be in one language to use the prior
+    :history: links every author id to the languages of its recent messages
+    :counts: links every tier to the number of texts it resolved
+    """
+
+    TIERS = ("trivial", "charset", "stopwords", "prior", "model")
+
+    def __init__(self, defaultLanguage: str = "en", minStopwords: int = 2, priorSize: int = 20,
+                 priorMinMessages: int = 5, priorShare: float = 0.9):
+        """
+        Constructor
+        :param defaultLanguage: the language given to the messages without letters
+        :param minStopwords: the number of stopwords of a language needed to decide
+        :param priorSize: the number of recent languages kept per author
+        :param priorMinMessages: the number of recent languages an author needs before the prior is used
+        :param priorShare: the share of the recent messages of an author that must be in one language
+        """
+        self.defaultLanguage = defaultLanguage
+        self.minStopwords = minStopwords
+        self.priorSize = priorSize
+        self.priorMinMessages = priorMinMessages
+        self.priorShare = priorShare
+        self.history: dict[int, deque[str]] = {}
+        self.counts: Counter[str] = Counter({tier: 0 for tier in self.TIERS})
+        self.lock = threading.Lock()
+
+    def stopwordScores(self, text: str) -> dict[str, int]:
+        """
+        Counts the stopwords only used by every language in a text, a letter only used by a language counts as one
+        stopword ("que" or "é" say nothing, "je" or "ñ" do)
+        :param text: the text
+        :return: links every language to its score
+        """
+        words = WORD.findall(text.lower())
+        scores = {language: sum(word in stopwords for word in words)
+                  for language, stopwords in DISTINCTIVE_WORDS.items()}
+        characters = set(text.lower())
+        for language, letters in DISTINCTIVE_LETTERS.items():
+            if letters & characters:
+                scores[language] += 1
+        return scores
+
+    def prior(self, authorId: int | None) -> str | None:
+        """
+        Gets the language an author almost always writes in, the lock must be held
+        :param authorId: the id of the author
+        :return: the language, None if the author has no clear prior
+        """
+        languages = self.history.get(authorId)
+        if not languages or len(languages) < self.priorMinMessages:
+            return None
+        language, count = Counter(languages).most_common(1)[0]
+        return language if count >= self.priorShare * len(languages) else None
+
+    def cheapTier(self, text: str, authorId: int | None) -> tuple[str, str] | None:
+        """
+        Tries to detect the language of a text without the model, the lock must be held
+        :param text: the text
+        :param authorId: the id of the author, None if unknown
+        :return: (tier, language), None if the text is ambiguous
+        """
+        text = NOISE.sub(" ", text)
+        if not LETTER.search(text):
+            return "trivial", self.defaultLanguage
+
+        for script, language in SCRIPTS:
+            if script.search(text):
+                return "charset", language
+
+        scores = self.stopwordScores(text)
+        decided = [language for language, score in scores.items()
+                   if score >= self.minStopwords and onlyLanguage(scores, language)]
+        if decided:
+            return "stopwords", decided[0]
+
+        # The prior only decides when the text has no stopword of another language
+        language = self.prior(authorId)
+        if language is not None and onlyLanguage(scores, language):
+            return "prior", language
+        return None
+
+    def observe(self, authorId: int | None, language: str) -> None:
+        """
+        Adds a detected language to the recent languages of an author, the lock must be held
+        :param authorId: the id of the author, None if unknown
+        :param language: the language
+        :return: None
+        """
+        if authorId is None:
+            return
+        if authorId not in self.history:
+            self.history[authorId] = deque(maxlen=self.priorSize)
+        self.history[authorId].append(language)
+
+    def detectMany(self, texts: list[str], authorIds: list[int | None] | None,
+                   model: Callable[[list[str]], list[str]]) -> list[str]:
+        """
+        Detects the language of many texts, the ambiguous texts are given to the model in one call
+        :param texts: the texts
+        :param authorIds: the id of the author of every text, None if unknown
+        :param model: the function detecting the language of many texts with the transformer model
+        :return: the language of every text
+        """
+        if authorIds is None:
+            authorIds = [None] * len(texts)
+
+        languages = [None] * len(texts)
+        ambiguous = []
+        with self.lock:
+            for i, (text, authorId) in enumerate(zip(texts, authorIds)):
+                decision = self.cheapTier(text, authorId)
+                if decision is None:
+                    ambiguous.append(i)
+                    continue
+                tier, languages[i] = decision
+                self.counts[tier] += 1
+                if tier in ("charset", "stopwords"):
+                    self.observe(authorId, languages[i])
+
+        if ambiguous:
+            detected = model([texts[i] for i in ambiguous])
+            with self.lock:
+                for i, language in zip(ambiguous, detected):
+                    languages[i] = language
+                    self.counts["model"] += 1
+                    self.observe(authorIds[i], language)
+        return languages
+
+    def report(self) -> dict:
+        """
+        Gets the share of the texts resolved by every tier
+        :return: a dict with the number of texts, the share of every tier and the share of model calls saved
+        """
+        with self.lock:
+            total = sum(self.counts.values())
+            shares = {tier: count / total if total else 0.0 for tier, count in self.counts.items()}
+            return {"texts": total, **shares, "saved": 1 - shares["model"] if total else 0.0}
+
+
+languageDetector = LanguageDetector(getSetting("DEFAULT_LANGUAGE", "en"), getSetting("LANGUAGE_MIN_STOPWORDS", 2),
+                                    getSetting("LANGUAGE_PRIOR_SIZE", 20), getSetting("LANGUAGE_PRIOR_MIN_MESSAGES", 5),
+                                    getSetting("LANGUAGE_PRIOR_SHARE", 0.9))
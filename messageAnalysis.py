@@ -0,0 +1,334 @@
+import asyncio
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Awaitable, Callable
+
+import discord
+
+from inferenceService import inferenceService
+from languageDetector import languageDetector
+from utils import contentHash, getLanguages, getSetting, toEnglishMany
+
+
+def modelLanguages(texts: list[str]) -> list[str]:
+    """
+    Detects the language of many texts with the transformer model, in the micro-batches of the inference service
+    :param texts: the texts
+    :return: the language of every text
+    """
+    return inferenceService.inferMany("language", texts)
+
+
+def modelEnglish(texts: list[str], languages: list[str], wait: bool = False) -> list[str | None]:
+    """
+    Translates many texts to English, in the micro-batches of the inference service
+    Waiting for a model that is not loaded holds the service while it loads, only the tldr command waits and the
+    warm-up list (MODEL_WARMUP) loads the usual pairs at startup
+    :param texts: the texts
+    :param languages: the language of every text
+    :param wait: True to wait for the translation models that are not loaded, False to keep the texts untranslated
+    until they are loaded
+    :return: the English texts, None for the texts left untranslated because their model is loading
+    """
+    return inferenceService.inferMany("translation", [(text, language, wait)
+                                                      for text, language in zip(texts, languages)])
+
+
+def englishBatch(items: list[tuple[str, str, bool]]) -> list[str | None]:
+    """
+    Translates a batch of the inference service, the texts waiting for their model are translated together
+    :param items: the (text, language, wait) of every request
+    :return: the English texts, in order
+    """
+    english = [None] * len(items)
+    for wait in {item[2] for item in items}:
+        indexes = [i for i, item in enumerate(items) if item[2] == wait]
+        translations = toEnglishMany([items[i][0] for i in indexes], [items[i][1] for i in indexes], wait)
+        for i, translation in zip(indexes, translations):
+            english[i] = translation
+    return english
+
+
+# •====================•
+#    MESSAGE ANALYSIS
+# •====================•
+
+class MessageAnalysis:
+    """
+    What the models found about one version of a message
+    :messageId: the id of the message
+    :hashes: the content hashes of the texts standing for this version (the original text and its rewrites)
+    :language: the detected language of the original text
+    :english: the English text
+    :pending: True if the text was not translated because the translation model was loading, the message is analysed
+    again on its next use
+    :outputs: links the name of a model to its output on the English text
+    """
+
+    def __init__(self, messageId: int, text: str, language: str, english: str | None):
+        """
+        Constructor
+        :param messageId: the id of the message
+        :param text: the original text
+        :param language: the detected language of the text
+        :param english: the English text, None if the translation model was loading
+        """
+        self.messageId = messageId
+        self.pending = english is None
+        self.english = text if english is None else english
+        self.hashes = {contentHash(text), contentHash(self.english)}
+        self.language = language
+        self.outputs: dict[str, object] = {}
+
+
+# •==================•
+#    ANALYSIS CACHE
+# •==================•
+
+class AnalysisCache:
+    """
+    Bounded cache of the analysis of the recent messages, shared by every part of the bot
+    A record is found by message id and is only served for the texts of its version, an edited message is analysed again
+    :capacity: the maximum number of records kept, the least recently used ones are evicted first
+    :records: links every message id to its record, from the least to the most recently used
+    :hits: the number of records served from the cache
+    :misses: the number of messages that had to be analysed
+    """
+
+    def __init__(self, capacity: int = 20000):
+        """
+        Constructor
+        :param capacity: the maximum number of records kept
+        """
+        self.capacity = capacity
+        self.records: OrderedDict[int, MessageAnalysis] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, messageId: int, text: str) -> MessageAnalysis | None:
+        """
+        Gets the record of a message
+        :param messageId: the id of the message
+        :param text: the text of the message
+        :return: the record, None if the message was not analysed, was edited since or is waiting for its translation
+        """
+        with self.lock:
+            record = self.records.get(messageId)
+            if record is None or record.pending or contentHash(text) not in record.hashes:
+                self.misses += 1
+                return None
+            self.records.move_to_end(messageId)
+            self.hits += 1
+            return record
+
+    def insert(self, record: MessageAnalysis) -> MessageAnalysis:
+        """
+        Stores a record, replacing the record of a previous version of the message
+        :param record: the record
+        :return: the record
+        """
+        with self.lock:
+            self.records[record.messageId] = record
+            self.records.move_to_end(record.messageId)
+            while len(self.records) > self.capacity:
+                self.records.popitem(last=False)
+        return record
+
+    def clear(self) -> None:
+        """
+        Removes every record
+        :return: None
+        """
+        with self.lock:
+            self.records.clear()
+
+    def analyse(self, message: discord.Message, wait: bool = False) -> MessageAnalysis:
+        """
+        Gets the record of a message, detecting its language and translating it if it is not in the cache
+        :param message: the message
+        :param wait: True to wait for the translation model if it is not loaded, False to keep the text untranslated
+        until it is loaded
+        :return: the record
+        """
+        return self.analyseMany([message], wait)[0]
+
+    def analyseMany(self, messages: list[discord.Message], wait: bool = False) -> list[MessageAnalysis]:
+        """
+        Gets the records of many messages, the languages of the messages missing from the cache are detected together
+        :param messages: the messages
+        :param wait: True to wait for the translation models that are not loaded, False to keep the texts untranslated
+        until they are loaded
+        :return: the record of every message
+        """
+        texts = [message.clean_content for message in messages]
+        records = [self.lookup(message.id, text) for message, text in zip(messages, texts)]
+        missing = [i for i, record in enumerate(records) if record is None]
+        if not missing:
+            return records
+
+        # The messages waiting for their translation keep their detected language
+        with self.lock:
+            pending = [self.records.get(messages[i].id) for i in missing]
+        pending = [record if record is not None and record.pending and contentHash(texts[i]) in record.hashes else None
+                   for i, record in zip(missing, pending)]
+        detect = [i for i, record in zip(missing, pending) if record is None]
+        detected = dict(zip(detect, languageDetector.detectMany([texts[i] for i in detect],
+                                                                [messages[i].author.id for i in detect],
+                                                                modelLanguages)))
+        languages = [detected[i] if record is None else record.language for i, record in zip(missing, pending)]
+        english = modelEnglish([texts[i] for i in missing], languages, wait)
+        for i, language, text in zip(missing, languages, english):
+            records[i] = self.insert(MessageAnalysis(messages[i].id, texts[i], language, text))
+        return records
+
+    def english(self, message: discord.Message, wait: bool = False) -> str:
+        """
+        Gets the English text of a message
+        :param message: the message
+        :param wait: True to wait for the translation model if it is not loaded, False to get the original text until
+        it is loaded
+        :return: the English text
+        """
+        return self.analyse(message, wait).english
+
+    def rewrite(self, message: discord.Message, text: str) -> None:
+        """
+        Replaces the content of a message by a text derived from it (its translation...), the record of the message
+        is still served for the new content
+        :param message: the message
+        :param text: the new content
+        :return: None
+        """
+        record = self.analyse(message)
+        with self.lock:
+            record.hashes.add(contentHash(text))
+        message.content = text
+
+    def output(self, message: discord.Message, name: str, compute: Callable[[str], object]):
+        """
+        Gets the output of a model on a message, computed once per version of the message
+        :param message: the message
+        :param name: the name of the model
+        :param compute: the function computing the output from the English text
+        :return: the output
+        """
+        record = self.analyse(message)
+        if name not in record.outputs:
+            record.outputs[name] = compute(record.english)
+        return record.outputs[name]
+
+    async def outputAsync(self, message: discord.Message, name: str, compute: Callable[[str], Awaitable]):
+        """
+        Gets the output of a model on a message without blocking the running loop, computed once per version of the
+        message
+        The message must have been analysed already (see AnalysisPipeline.english)
+        :param message: the message
+        :param name: the name of the model
+        :param compute: the coroutine function computing the output from the English text
+        :return: the output
+        """
+        record = self.analyse(message)
+        if name not in record.outputs:
+            record.outputs[name] = await compute(record.english)
+        return record.outputs[name]
+
+
+# •=====================•
+#    ANALYSIS PIPELINE
+# •=====================•
+
+class AnalysisPipeline:
+    """
+    Analyses the new messages in background threads so that the bot's loop never waits for the language and translation
+    models, the consumers of a message (tldr, mood, social graph) await its English text
+    The messages waiting for a thread are analysed together: the messages sent while a batch is analysed form the next
+    batch, so a burst of messages reaches the models in a few batches
+    The consumers asking for the same version of a message while it is analysed share one analysis
+    :cache: the analysis cache the records are stored in
+    :workers: the maximum number of batches analysed at the same time
+    :batchSize: the maximum number of messages analysed together
+    :executor: the threads analysing the messages
+    :queue: the (key, message, future) of the messages waiting for a thread, in order
+    :running: the number of threads analysing batches
+    :pending: links the (message id, content hash) of every message being analysed to the future of its English text
+    """
+
+    def __init__(self, cache: AnalysisCache, workers: int = 1, batchSize: int = 32):
+        """
+        Constructor
+        :param cache: the analysis cache the records are stored in
+        :param workers: the number of threads analysing the messages
+        :param batchSize: the maximum number of messages analysed together
+        """
+        self.cache = cache
+        self.workers = workers
+        self.batchSize = batchSize
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="analysis")
+        self.queue: deque[tuple[tuple[int, str], discord.Message, Future]] = deque()
+        self.running = 0
+        self.pending: dict[tuple[int, str], Future] = {}
+        self.lock = threading.Lock()
+
+    def submit(self, message: discord.Message) -> Future:
+        """
+        Queues the analysis of a message, or joins the analysis of the same version of the message
+        :param message: the message
+        :return: the future of the English text of the message
+        """
+        key = (message.id, contentHash(message.clean_content))
+        with self.lock:
+            future = self.pending.get(key)
+            if future is None:
+                future = Future()
+                self.pending[key] = future
+                self.queue.append((key, message, future))
+                if self.running < self.workers:
+                    self.running += 1
+                    self.executor.submit(self.drain)
+            return future
+
+    def drain(self) -> None:
+        """
+        Analyses the queued messages batch by batch until the queue is empty, runs in a thread of the executor
+        :return: None
+        """
+        while True:
+            with self.lock:
+                if not self.queue:
+                    self.running -= 1
+                    return
+                batch = [self.queue.popleft() for _ in range(min(len(self.queue), self.batchSize))]
+
+            try:
+                records = self.cache.analyseMany([message for _, message, _ in batch])
+                results = [(future, record.english, None) for (_, _, future), record in zip(batch, records)]
+            except Exception as e:
+                results = [(future, None, e) for _, _, future in batch]
+
+            # Finished analyses are forgotten, the records are then read from the cache
+            with self.lock:
+                for key, _, _ in batch:
+                    self.pending.pop(key, None)
+            for future, english, error in results:
+                if error is None:
+                    future.set_result(english)
+                else:
+                    future.set_exception(error)
+
+    async def english(self, message: discord.Message) -> str:
+        """
+        Gets the English text of a message without blocking the running loop
+        :param message: the message
+        :return: the English text
+        """
+        return await asyncio.wrap_future(self.submit(message))
+
+
+# The module attribute is read on every batch so that the tests can replace it
+inferenceService.register("language", lambda texts: getLanguages(texts))
+inferenceService.register("translation", lambda items: englishBatch(items))
+analysisCache = AnalysisCache(getSetting("ANALYSIS_CACHE_SIZE", 20000))
+analysisPipeline = AnalysisPipeline(analysisCache, getSetting("ANALYSIS_WORKERS", 1),
+                                    getSetting("ANALYSIS_BATCH_SIZE", 32))
@@ -0,0 +1,143 @@
+import threading
+from collections import deque
+
+import discord
+
+from utils import printExceptions
+
+
+# •==================•
+#    MESSAGE BUFFER
+# •==================•
+
+class MessageBuffer:
+    """
+    Bounded buffer of the recent consented messages of every channel, filled as messages are sent
+    Every consented message sent since the oldest buffered one is in the buffer, so the tldr command only has to fetch
+    the history of a channel for the messages older than that
+    The messages sent while the gateway session is lost never reach the bot, so the buffer is reset when it is lost
+    :size: the maximum number of messages kept per channel
+    :order: links every channel id to the ids of its buffered messages, from the oldest to the most recent
+    :messages: links every channel id to its buffered messages, by id
+    :coverageStart: links every channel id to the id of the oldest message the buffer is complete from
+    """
+
+    def __init__(self, size: int = 500):
+        """
+        Constructor
+        :param size: the maximum number of messages kept per channel
+        """
+        self.size = size
+        self.order: dict[int, deque[int]] = {}
+        self.messages: dict[int, dict[int, discord.Message]] = {}
+        self.coverageStart: dict[int, int] = {}
+        self.lock = threading.Lock()
+
+    @printExceptions
+    def add(self, message: discord.Message, edited: bool = False) -> None:
+        """
+        Adds a new message to the buffer of its channel, or replaces it if it was edited
+        :param message: the message
+        :param edited: True if the message is an edited message, it is only replaced if the buffer holds it
+        :return: None
+        """
+        channelId = message.channel.id
+        with self.lock:
+            if edited:  # An edit of a message the buffer never held (older, deleted, or not consented) is not added
+                if message.id in self.messages.get(channelId, {}):
+                    self.messages[channelId][message.id] = message
+                return
+
+            if channelId not in self.order:
+                self.order[channelId] = deque()
+                self.messages[channelId] = {}
+                self.coverageStart[channelId] = message.id
+
+            messages = self.messages[channelId]
+            if message.id in messages:  # Already buffered
+                messages[message.id] = message
+                return
+            if message.id < self.coverageStart[channelId]:  # Older than the buffer
+                return
+
+            order = self.order[channelId]
+            order.append(message.id)
+            messages[message.id] = message
+            while len(order) > self.size:
+                messages.pop(order.popleft(), None)
+                self.coverageStart[channelId] = order[0]
+
+    @printExceptions
+    def remove(self, channelId: int, messageId: int) -> None:
+        """
+        Removes a deleted message from the buffer
+        :param channelId: the id of the channel of the message
+        :param messageId: the id of the message
+        :return: None
+        """
+        with self.lock:
+            if channelId in self.messages and self.messages[channelId].pop(messageId, None) is not None:
+                self.order[channelId].remove(messageId)
+
+    @printExceptions
+    def reset(self) -> None:
+        """
+        Forgets the messages of every channel, called when the gateway session is lost since the messages sent until it
+        is back are missing
+        :return: None
+        """
+        with self.lock:
+            self.order.clear()
+            self.messages.clear()
+            self.coverageStart.clear()
+
+    def covers(self, channelId: int, messageId: int) -> bool:
+        """
+        Checks if the buffer holds every consented message of a channel sent after a message
+        :param channelId: the id of the channel
+        :param messageId: the id of the message
+        :return: True if the messages after messageId can be read from the buffer
+        """
+        with self.lock:
+            return channelId in self.coverageStart and messageId >= self.coverageStart[channelId]
+
+    def before(self, channelId: int, messageId: int, limit: int) -> tuple[list[discord.Message], int | None]:
+        """
+        Gets the buffered messages sent before a message
+        :param channelId: the id of the channel
+        :param messageId: the id of the message
+        :param limit: the maximum number of messages
+        :return: the messages from the most recent to the oldest, and the id the buffer is complete from (None if the
+        buffer does not cover the message)
+        """
+        with self.lock:
+            if channelId not in self.coverageStart or messageId < self.coverageStart[channelId]:
+                return [], None
+            messages = self.messages[channelId]
+            result = []
+            for id in reversed(self.order[channelId]):
+                if len(result) >= limit:
+                    break
+                if id < messageId and id in messages:
+                    result.append(messages[id])
+            return result, self.coverageStart[channelId]
+
+    def after(self, channelId: int, messageId: int, limit: int) -> list[discord.Message]:
+        """
+        Gets the buffered messages sent after a message
+        :param channelId: the id of the channel
+        :param messageId: the id of the message
+        :param limit: the maximum number of messages
+        :return: the messages from the oldest to the most recent
+        """
+        with self.lock:
+            if channelId not in self.messages:
+                return []
+            messages = self.messages[channelId]
+            result = []
+            for id in self.order[channelId]:
+                if len(result) >= limit:
+                    break
+                if id > messageId and id in messages:
+                    result.append(messages[id])
+            return result
@@ -3,6 +3,7 @@ from os import getenv
 from dotenv import load_dotenv
 
 import socialGraph
+import tldr
 from commands import *
 
 
@@ -68,6 +69,12 @@ async def on_messageTldr(bot, message: discord.Message, guildData) -> None:
     if msgFirstTokenLower == "tldr":
         await tldrCommand(bot, message, guildData)
         return
+
+    if message.clean_content.startswith(guildData.prefix):  # Other commands are not part of the conversations
+        return
+
+    # Message is not a command -> assign it to a live conversation thread
+    asyncio.run_coroutine_threadsafe(tldr.ingestMessage(message, guildData), bot.tldrLoop)
     return
 
 
@@ -1,12 +1,12 @@
 import asyncio
-import datetime
-import json
-import os
 import re
+import time
 
 import discord
 
-from utils import printExceptions
+from infractionStore import infractionStore
+from utils import getSetting, printExceptions
+from wordMatcher import BannedWordMatcher
 
 
 class moderationInfo:
@@ -26,14 +26,38 @@ async def automod(message, guildData):
     :return: None
     """
     # print("yep")
-    bannedWords = guildData.badWords
-    if bannedWords is None:
-        bannedWords = []
-    for bad_word in bannedWords:
-        if bad_word in message.content:
-            addInfoInFile(message.mentions[0].id, message.guild.id, "tag", "Banned word detected")
-            await message.delete()
-            await message.channel.send(f"Banned word detected, {message.author.mention}")
+    if not guildData.badWords:
+        return
+    if matcher(guildData).find(message.content) is not None:
+        addInfoInFile(message.author.id, message.guild.id, "tag", "Banned word detected")
+        await message.delete()
+        await message.channel.send(f"Banned word detected, {message.author.mention}")
+
+
+# Compiled banned words of every guild, rebuilt when the list of the guild changes
+matchers: dict[int, BannedWordMatcher] = {}
+caseFoldBanwords = getSetting("BANWORD_CASE_FOLD", False)
+wholeWordBanwords = getSetting("BANWORD_MATCH_MODE", "substring") == "word"
+
+
+def matcher(guildData) -> BannedWordMatcher:
+    """
+    Gets the compiled banned words of a guild, compiling them the first time
+    :param guildData: the data associated to the guild
+    :return: the matcher
+    """
+    if guildData.id not in matchers:
+        rebuildMatcher(guildData)
+    return matchers[guildData.id]
+
+
+def rebuildMatcher(guildData) -> None:
+    """
+    Compiles the banned words of a guild again, called when the list changes
+    :param guildData: the data associated to the guild
+    :return: None
+    """
+    matchers[guildData.id] = BannedWordMatcher(guildData.badWords or [], caseFoldBanwords, wholeWordBanwords)
 
 
 @printExceptions
@@ -47,13 +71,14 @@ async def addBanword(bot, message, guildData):
     """
     # print('add')
     bannedWord = message.content.split(' ')[3]
-    listBannedWords = guildData.badWords
-    if listBannedWords is None:
-        listBadWords = []
+    if guildData.badWords is None:
+        guildData.badWords = []
+    listBadWords = guildData.badWords
     if bannedWord in listBadWords:
         asyncio.run_coroutine_threadsafe(message.channel.send('Bad word already in list'), bot.loop)
         return
     listBadWords.append(bannedWord)
+    rebuildMatcher(guildData)
     asyncio.run_coroutine_threadsafe(message.channel.send('Bad word added'), bot.loop)
     return
 
@@ -76,6 +101,7 @@ async def removeBanword(bot, message, guildData):
         asyncio.run_coroutine_threadsafe(message.channel.send('Bad word not in list'), bot.loop)
         return
     list_banned_words.remove(bannedWord)
+    rebuildMatcher(guildData)
     # message.channel.send('Bad word removed')
     asyncio.run_coroutine_threadsafe(message.channel.send('Bad word removed'), bot.loop)
     return
@@ -183,12 +209,12 @@ async def muteuser(bot, message, guildData):
     # if the time is 0, the user is unmuted
     # print(type(message.mentions[0]))
     if message.content.split(' ')[2] == '0':
-        if str(userID) in guildData.muted_users.keys():
+        if userID in guildData.muted_users:
             await unmuteUser1(bot, message, guildData)
             return
     # print('mute')
     # print(guildData.muted_users)
-    if str(userID) in guildData.muted_users.keys():
+    if userID in guildData.muted_users:
         # print('already muted')
         return
     # print('try to mute')
@@ -217,7 +243,10 @@ async def muteuser(bot, message, guildData):
 
         rolesids = [role.id for role in message.guild.get_member(userID).roles]
         # print(f"Taille : {len(rolesids)}")
-        guildData.muted_users[userID] = [time_minutes, rolesids]
+        # The expiry is an absolute timestamp, so the mute neither drifts nor is extended by restarts
+        expiry = time.time() + time_seconds
+        guildData.muted_users[userID] = [expiry, rolesids]
+        bot.muteScheduler.schedule(guildData.id, userID, expiry)
 
         # add the role called MUTED to the user
         roleM = discord.utils.get(message.guild.roles, name="MUTED")
@@ -264,47 +293,35 @@ async def unmuteUser1(bot, message, guildData) -> None:
 
 
 @printExceptions
-def unmuteUser(bot, guildId, userID) -> None:
+async def unmuteUser(bot, guildId, userID) -> bool:
     """
-    Unmutes a user
+    Unmutes a user whose mute expired, the role calls are awaited so the loop of the mute timer is never blocked
     :param bot: the bot
     :param guildId: the id of the guild the user is in
     :param userID: the id of the user to unmute
-    :return: None
+    :return: True if the mute was lifted, or dropped because the user or the guild is gone, None if it failed and has
+    to be retried
     """
     guildData = bot.guildsDict[guildId]
     thisGuild = bot.get_guild(guildId)
-    member = discord.utils.get(thisGuild.members, id=int(userID))
+    member = None if thisGuild is None else thisGuild.get_member(int(userID))
+    if member is None:  # The user left the guild (or the bot left it), there is no role to give back
+        del guildData.muted_users[userID]
+        bot.save()
+        return True
     # print(f"Unmuting {member}")
 
     mutedRole = discord.utils.get(thisGuild.roles, name="MUTED")
-    asyncio.run_coroutine_threadsafe(member.remove_roles(mutedRole), bot.loop)
-
-    rolesToAdd = [role for role in thisGuild.roles if role.id in guildData.muted_users[userID][1]]
-    for role in rolesToAdd:
-        if (role.name != "@everyone") and (role.name != "MUTED"):
-            # print(role)
-            asyncio.run_coroutine_threadsafe(member.add_roles(role), bot.loop).result()
-    del guildData.muted_users[userID]
+    if mutedRole is not None:
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(member.remove_roles(mutedRole), bot.loop))
+
+    rolesToAdd = [role for role in thisGuild.roles if role.id in guildData.muted_users[userID][1] and
+                  role.name != "@everyone" and role.name != "MUTED"]
+    if rolesToAdd:
+        await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(member.add_roles(*rolesToAdd), bot.loop))
+    guildData.muted_users.pop(userID, None)  # May have been unmuted by hand while the roles were given back
     bot.save()
-
-
-@printExceptions
-async def updateMuted(bot):
-    """
-    Decrements the time of all the muted users for every minute
-    :param bot: the bot to decrement the time for
-    :return: None
-    """
-    # print("------------------")
-    for guildID, guildData in bot.guildsDict.items():
-        for userID, valInMutedUser in guildData.muted_users.items():
-            valInMutedUser[0] -= 1
-            bot.save()
-            if valInMutedUser[0] <= 0:
-                # print("Here :D")
-                await unmuteUser(bot, guildID, userID)
-        bot.save()
+    return True
 
 
 @printExceptions
@@ -384,39 +401,16 @@ async def kickUser(bot, message, arguments):
 
 
 @printExceptions
-def addInfoInFile(userID, guild: discord.Guild, infractionInfo, reason) -> None:
+def addInfoInFile(userID, guild: int, infractionInfo, reason) -> None:
     """
-    Adds the guild to the bot's file
+    Adds an infraction of a user to the infraction store
     :param userID: int:the id of the user
-    :param guild: discord.Guild: the guild to add
+    :param guild: int: the id of the guild
     :param infractionInfo: str: the type of infraction
     :param reason: str:the reason of the infraction
     :return: None
     """
-    # Check if the file exists
-    if not os.path.exists("data/userInfo.json"):
-        with open('data/userInfo.json', 'w') as f:
-            json.dump({}, f, indent=4)
-
-    with open('data/userInfo.json', 'r') as f:
-        dataUser = {int(k): {int(kk): vv for (kk, vv) in v.items()} for (k, v) in json.load(f).items()}
-
-    current_time = datetime.datetime.now()
-    local_time = current_time.strftime("%d/%m/%Y %H:%M:%S")
-
-    if guild not in dataUser:
-        dataUser[guild] = {}
-
-    if userID not in dataUser[guild]:
-        dataUser[guild][userID] = {}
-
-    if infractionInfo not in dataUser[guild][userID]:
-        dataUser[guild][userID][infractionInfo] = {}
-
-    dataUser[guild][userID][infractionInfo][reason] = local_time
-
-    with open('data/userInfo.json', 'w') as f:
-        json.dump(dataUser, f, indent=4)
+    infractionStore.add(userID, guild, infractionInfo, reason)
 
 
 @printExceptions
@@ -427,12 +421,7 @@ def getInfractionInfo(userID, guildID):
     :param guildID: the guild ID
     :return: the infraction info
     """
-    try:
-        with open('data/userInfo.json', 'r') as f:
-            dataUser = json.load(f)
-    finally:
-        data = dataUser[str(guildID)][str(userID)]
-    return data
+    return infractionStore.infractions(userID, guildID)
 
 
 @printExceptions
@@ -442,12 +431,4 @@ def getUserInfoInEveryServer(userID):
     :param userID: the user ID
     :return: the info of the user in every server
     """
-    try:
-        with open('data/userInfo.json', 'r') as f:
-            dataUser = json.load(f)
-    finally:
-        data = []
-        for guild in dataUser:
-            if str(userID) in dataUser[guild]:
-                data.append(dataUser[guild][str(userID)])
-    return data
+    return infractionStore.infractionsEverywhere(userID)
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+import traceback
+from typing import Callable
+
+
+def residentMemory() -> int:
+    """
+    Gets the resident memory of the process
+    :return: the resident memory in bytes, 0 if it can not be read
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+# •==================•
+#    MODEL REGISTRY
+# •==================•
+
+class ModelRegistry:
+    """
+    Central registry of the models of the bot, a model is only loaded the first time it is used (or when warmed up)
+    :loaders: links the name of every model to the function loading it
+    :models: links the name of every loaded model to the model
+    :stats: links the name of every loaded model to its load time (seconds) and the resident memory it added (bytes)
+    :families: links the name prefix of every family of models kept outside the registry (like the translation pool)
+    to the function loading one of its models, only used by the warm-up
+    """
+
+    def __init__(self):
+        """
+        Constructor
+        """
+        self.loaders: dict[str, Callable[[], object]] = {}
+        self.models: dict[str, object] = {}
+        self.stats: dict[str, dict] = {}
+        self.families: dict[str, Callable[[str], object]] = {}
+        # Models are loaded one at a time so that the memory added by each one can be measured
+        self.loadLock = threading.RLock()
+
+    def register(self, name: str, loader: Callable[[], object]) -> None:
+        """
+        Registers a model, nothing is loaded
+        :param name: the name of the model
+        :param loader: the function loading the model
+        :return: None
+        """
+        self.loaders[name] = loader
+
+    def registerFamily(self, prefix: str, warmUp: Callable[[str], object]) -> None:
+        """
+        Registers a family of models kept outside the registry so that its models can be named in the warm-up list
+        :param prefix: the prefix of the names of the models of the family
+        :param warmUp: the function loading a model from its name
+        :return: None
+        """
+        self.families[prefix] = warmUp
+
+    def isRegistered(self, name: str) -> bool:
+        """
+        Checks if a model is registered
+        :param name: the name of the model
+        :return: True if the model is registered
+        """
+        return name in self.loaders
+
+    def isLoaded(self, name: str) -> bool:
+        """
+        Checks if a model is loaded
+        :param name: the name of the model
+        :return: True if the model is loaded
+        """
+        return name in self.models
+
+    def get(self, name: str):
+        """
+        Gets a model, loading it if it is the first time it is used
+        :param name: the name of the model
+        :return: the model
+        """
+        model = self.models.get(name)
+        if model is not None:
+            return model
+
+        with self.loadLock:
+            if name in self.models:  # Loaded by another thread meanwhile
+                return self.models[name]
+            memory = residentMemory()
+            start = time.perf_counter()
+            model = self.loaders[name]()
+            self.stats[name] = {"loadTime": time.perf_counter() - start,
+                                "memory": max(residentMemory() - memory, 0)}
+            self.models[name] = model
+            print(f"Loaded the {name} model in {self.stats[name]['loadTime']:.1f}s "
+                  f"(+{self.stats[name]['memory'] / 2 ** 20:.0f} MiB)")
+            return model
+
+    def set(self, name: str, model):
+        """
+        Replaces a loaded model, used by the tests and benchmarks to plug in another model
+        :param name: the name of the model
+        :param model: the new model, None to unload the model
+        :return: the previous model, None if it was not loaded
+        """
+        with self.loadLock:
+            previous = self.models.pop(name, None)
+            if model is not None:
+                self.models[name] = model
+            return previous
+
+    def unload(self, name: str) -> None:
+        """
+        Unloads a model, it will be loaded again on its next use
+        :param name: the name of the model
+        :return: None
+        """
+        with self.loadLock:
+            self.models.pop(name, None)
+            self.stats.pop(name, None)
+
+    def warmUp(self, names: list[str] | None = None) -> None:
+        """
+        Loads models before they are used
+        :param names: the names of the models, None for every registered model
+        :return: None
+        """
+        for name in (list(self.loaders) if names is None else names):
+            family = next((warmUp for prefix, warmUp in self.families.items() if name.startswith(prefix)), None)
+            if name not in self.loaders and family is None:
+                print(f"Unknown model {name} in the warm-up list")
+                continue
+            try:
+                if name in self.loaders:
+                    self.get(name)
+                else:
+                    family(name)
+            except:
+                traceback.print_exc()
+
+    def warmUpInBackground(self, names: list[str] | None = None) -> threading.Thread:
+        """
+        Loads models in a background thread
+        :param names: the names of the models, None for every registered model
+        :return: the thread
+        """
+        thread = threading.Thread(target=self.warmUp, args=(names,), daemon=True, name="modelWarmUp")
+        thread.start()
+        return thread
+
+    def report(self) -> dict:
+        """
+        Gets the state of every registered model
+        :return: a dict linking the name of every model to whether it is loaded, its load time and memory
+        """
+        return {name: {"loaded": name in self.models, **self.stats.get(name, {})} for name in self.loaders}
+
+
+registry = ModelRegistry()
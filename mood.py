@@ -2,11 +2,14 @@ import asyncio
 import csv
 import enum
 import os
+import re
 
 import discord
-from transformers import pipeline
 
-from utils import printExceptions
+from inferenceService import inferenceService
+from messageAnalysis import analysisPipeline
+from modelRegistry import registry
+from utils import loadPipeline, printExceptions
 
 # Login to huggingface to access custom model
 # load_dotenv()
@@ -16,7 +19,10 @@ from utils import printExceptions
 # classifier = pipeline("text-classification", model="Luc-Salvon/discord_mood_analysis", return_all_scores=True)
 
 # Stable model
-classifier = pipeline("text-classification", model="j-hartmann/emotion-english-distilroberta-base", return_all_scores=True)
+registry.register("emotion", lambda: loadPipeline("emotion", "text-classification",
+                                                  "j-hartmann/emotion-english-distilroberta-base",
+                                                  return_all_scores=True))
+inferenceService.register("emotion", lambda texts: registry.get("emotion")(texts))
 
 
 # •===================•
@@ -139,10 +145,11 @@ async def updateMoods(bot) -> None:
     :param bot: the bot
     """
     minute = bot.moodUpdateMinute
+    refreshes = []
     while len(bot.moodUpdates[minute]) > 0:  # For each required update
         update = bot.moodUpdates[minute].pop()
         if update[1]:  # Update is a mood refresh
-            refreshMoods(bot, update[0])  # Operates the refresh
+            refreshes.append(refreshMoods(bot, update[0]))  # Operates the refresh, with the other refreshes
             # Schedules next refresh
             nextUpdate = (minute + bot.guildsDict[update[0]].moodRefreshTime) % 181
             bot.moodUpdates[nextUpdate].append(update)
@@ -152,23 +159,28 @@ async def updateMoods(bot) -> None:
             nextUpdate = (minute + bot.guildsDict[update[0]].moodResetTime) % 181
             bot.moodUpdates[nextUpdate].append(update)
 
+    # The users of every refreshed guild are submitted to the emotion model together, in the same micro-batches
+    await asyncio.gather(*refreshes)
+
 
 # •================•
 #    MOOD UPDATES
 # •================•
 @printExceptions
-def refreshMoods(bot, guildID: int) -> None:
+async def refreshMoods(bot, guildID: int) -> None:
     """
-    Refreshes the mood of every active user from the specified guild
+    Refreshes the mood of every active user from the specified guild, the users are refreshed together
     :param bot: the bot
     :param guildID: the id of the guild to refresh the users' moods of
     """
     guildData = bot.guildsDict[guildID]
-    for userID in guildData.userActive.keys():
-        if len(guildData.userMessages[
-                   userID]) != 0:  # If a user has sent messages since last refresh we update their mood
-            refreshMood(bot, userID, guildID)
-            guildData.userMessages[userID].clear()
+    # If a user has sent messages since last refresh we update their mood
+    messages = {userID: list(guildData.userMessages[userID]) for userID in guildData.userActive.keys()
+                if len(guildData.userMessages[userID]) != 0}
+    await asyncio.gather(*(refreshMood(bot, userID, guildID, userMessages)
+                           for userID, userMessages in messages.items()))
+    for userID, userMessages in messages.items():  # The messages sent during the refresh are kept for the next one
+        del guildData.userMessages[userID][:len(userMessages)]
 
 
 @printExceptions
@@ -187,18 +199,19 @@ def resetMoods(bot, guildID: int) -> None:
 
 
 @printExceptions
-def refreshMood(bot, userID: int, guildID: int) -> None:
+async def refreshMood(bot, userID: int, guildID: int, messages: list[str] | None = None) -> None:
     """
     Refreshes the mood of a specific member of a specific guild
     :param bot: the bot
     :param userID: the id of the guild member
     :param guildID: the id of the guild
+    :param messages: the messages the mood is computed from, None for the last messages of the member
     """
 
     guildData = bot.guildsDict[guildID]
 
     # Mood computation
-    mood = getMood(guildData.userMessages[userID])
+    mood = await getMoodAsync(list(guildData.userMessages[userID]) if messages is None else messages)
 
     # Mood update
     oldMood = guildData.moods.get(userID, None)
@@ -247,6 +260,41 @@ def resetMood(bot, userID: int, guildID: int) -> None:
 #    MESSAGE PROCESSING
 # •======================•
 
+def splitEmotionRequest(messages: list[str]) -> tuple[list[str], list[str]] | None:
+    """
+    Splits the messages too long for the emotion model in two halves, whose emotions are averaged
+    :param messages: the list of messages
+    :return: the two halves, None if the messages are a single sentence (its emotion is neutral)
+    """
+    if len(messages) == 1:  # If there is only one message, we split it into sentences
+        messages = re.split(r'(?<=[.!?]) +', messages[0])
+
+        if len(messages) == 1:  # If there is only one sentence, its emotion is neutral
+            return None
+
+    # If there are multiple messages/sentences, we split the list in half
+    return messages[:len(messages) // 2], messages[len(messages) // 2:]
+
+
+def neutralEmotions() -> list[dict[str: float]]:
+    """
+    Gets the emotions of a neutral text
+    :return: a list of dictionaries, each containing a "label" (emotion name) and "score" (probability of the emotion)
+    """
+    return [{"label": mood.emotionName, "score": 1 if mood.emotionName == "neutral" else 0} for mood in Mood]
+
+
+def averageEmotions(emotions1: list[dict[str: float]], emotions2: list[dict[str: float]]) -> list[dict[str: float]]:
+    """
+    Averages the emotions of the two halves of the messages
+    :param emotions1: the emotions of the first half
+    :param emotions2: the emotions of the second half
+    :return: a list of dictionaries, each containing a "label" (emotion name) and "score" (probability of the emotion)
+    """
+    return [{"label": emotions1[i]["label"], "score": (emotions1[i]["score"] + emotions2[i]["score"]) / 2} for i in
+            range(len(Mood) - 1)]
+
+
 def getEmotions(messages: list[str]) -> list[dict[str: float]]:
     """
     Gets the emotions associated to a list of messages via a transformer
@@ -254,21 +302,28 @@ def getEmotions(messages: list[str]) -> list[dict[str: float]]:
     :return: a list of dictionaries, each containing a "label" (emotion name) and "score" (probability of the emotion)
     """
     try:
-        return classifier(". ".join(messages))[0]  # Join messages together with a full stop in between to create sentences (almost no discord message ends with a full stop)
+        return inferenceService.infer("emotion", ". ".join(messages))  # Join messages together with a full stop in between to create sentences (almost no discord message ends with a full stop)
     except:  # Message is too long, we split it up and average the results
-        if len(messages) == 1:  # If there is only one message, we split it into sentences
-            messages = messages[0].split(r'(?<=[.!?]) +')
+        halves = splitEmotionRequest(messages)
+        if halves is None:
+            return neutralEmotions()
+        return averageEmotions(getEmotions(halves[0]), getEmotions(halves[1]))
 
-            if len(messages) == 1:  # If there is only one sentence, we return a neutral emotion
-                emotionNames = [mood.emotionName for mood in Mood]
-                return [{"label": label, "score": 0} if label != "neutral" else {"label": "neutral", "score": 1} for label in emotionNames]
 
-        # If there are multiple messages/sentences, we split the list in half and average the results
-        emotions1 = getEmotions(messages[:len(messages) // 2])
-        emotions2 = getEmotions(messages[len(messages) // 2:])
-
-        return [{"label": emotions1[i]["label"], "score": (emotions1[i]["score"] + emotions2[i]["score"]) / 2} for i in
-                range(len(Mood) - 1)]
+async def getEmotionsAsync(messages: list[str]) -> list[dict[str: float]]:
+    """
+    Gets the emotions associated to a list of messages via a transformer without blocking the running loop, the
+    requests of the concurrent callers are batched together by the inference service
+    :param messages: the list of messages to extract the emotions from
+    :return: a list of dictionaries, each containing a "label" (emotion name) and "score" (probability of the emotion)
+    """
+    try:
+        return await inferenceService.inferAsync("emotion", ". ".join(messages))
+    except:  # Message is too long, we split it up and average the results
+        halves = splitEmotionRequest(messages)
+        if halves is None:
+            return neutralEmotions()
+        return averageEmotions(*await asyncio.gather(getEmotionsAsync(halves[0]), getEmotionsAsync(halves[1])))
 
 
 @printExceptions
@@ -278,7 +333,25 @@ def getMood(messages: list[str]) -> Mood:
     :param messages: the list of messages
     :return: the mood associated to the list of messages
     """
-    emotions = getEmotions(messages)
+    return emotionsMood(getEmotions(messages))
+
+
+@printExceptions
+async def getMoodAsync(messages: list[str]) -> Mood:
+    """
+    Gets the mood associated to a list of messages without blocking the running loop
+    :param messages: the list of messages
+    :return: the mood associated to the list of messages
+    """
+    return emotionsMood(await getEmotionsAsync(messages))
+
+
+def emotionsMood(emotions: list[dict[str: float]]) -> Mood:
+    """
+    Gets the mood associated to the emotions of a list of messages
+    :param emotions: the emotions, as given by getEmotions
+    :return: the mood associated to the emotions
+    """
     maxScore = 0
     maxEmotion = ""
 
@@ -299,22 +372,24 @@ async def processMessage(bot, message: discord.Message):
     :param message: the message to be processed
     """
     guildData = bot.guildsDict[message.guild.id]
+    english = await analysisPipeline.english(message)  # The emotions are computed on the English text
     if guildData.timedMoodRefreshes:
-        timeProcessing(bot, message)
+        timeProcessing(bot, message, english)
     else:
-        messageProcessing(bot, message)
+        await messageProcessing(bot, message, english)
 
     # Process the message for the dataset gathering
     if guildData.moodTraining[message.author.id]:
-        setDatasetCollectionMessage(bot, message)
+        await setDatasetCollectionMessage(bot, message, english)
 
 
 @printExceptions
-def timeProcessing(bot, message: discord.Message) -> None:
+def timeProcessing(bot, message: discord.Message, english: str) -> None:
     """
     Processes a message when guild mood refreshes are based on time
     :param bot: the bot
     :param message: the message to process
+    :param english: the English text of the message
     """
     guildData = bot.guildsDict[message.guild.id]
 
@@ -323,16 +398,17 @@ def timeProcessing(bot, message: discord.Message) -> None:
     if userID not in guildData.userMessages:
         guildData.userMessages[userID] = []
 
-    guildData.userMessages[userID].append(message.content)  # Adds the message to the user's list of messages
+    guildData.userMessages[userID].append(english)  # Adds the message to the user's list of messages
     guildData.userActive[userID] = True  # Sets the user as active
 
 
 @printExceptions
-def messageProcessing(bot, message: discord.Message) -> None:
+async def messageProcessing(bot, message: discord.Message, english: str) -> None:
     """
     Processes a message when guild mood refreshes based on messages
     :param bot: the bot
     :param message: the message to process
+    :param english: the English text of the message
     """
     guildData = bot.guildsDict[message.guild.id]
 
@@ -342,14 +418,14 @@ def messageProcessing(bot, message: discord.Message) -> None:
         guildData.userMessages[userID] = []
 
     messages = guildData.userMessages[userID]
-    messages.append(message.content)  # Adds the message to the user's list of messages
+    messages.append(english)  # Adds the message to the user's list of messages
     guildData.userActive[userID] = True  # Sets the user as active
 
     while len(messages) > guildData.moodMessageDepth:  # Gets rid of messages too old
         messages.pop(0)
 
     if len(messages) >= guildData.moodMessageThreshold:  # Message-based refresh -> need to refresh if message threshold exceeded
-        refreshMood(bot, userID, message.guild.id)
+        await refreshMood(bot, userID, message.guild.id)
 
 
 # •===================•
@@ -375,15 +451,16 @@ def addCSV(messageContent: str, emotion: str) -> None:
 
 
 @printExceptions
-def setDatasetCollectionMessage(bot, message: discord.Message):
+async def setDatasetCollectionMessage(bot, message: discord.Message, english: str):
     """
     Sends the message to collect the user's message and emotion for the dataset
     :param bot: the bot
     :param message: the message
+    :param english: the English text of the message
     """
     guildData = bot.guildsDict[message.guild.id]
 
-    mood = getMood([message.content])
+    mood = await getMoodAsync([english])
     messageContent = f"I believe this message's emotion is **{mood.emotionName} {mood.emoji}**.\n• **If I'm right**, please check the __checkmark__.\n• **if I'm wrong**, click the __right arrow__ then react with the __according emotion__.\n• **If you don't want this specific message to be processed**, please click the __red cross__.\n• **If you don't want me to process your messages at all**, type `{guildData.prefix}moodtraining toggle`\n\n*Note that the reactions can take a while to appear.\nAlso note that messages are stored anonymously, your stored messages can't be traced back to you.*\n**Thanks for helping me learn! :D**\n"
     sentMessage = asyncio.run_coroutine_threadsafe(message.channel.send(messageContent, reference=message),
                                                    bot.loop).result()
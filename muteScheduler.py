@@ -0,0 +1,158 @@
+import asyncio
+import heapq
+import threading
+import time
+
+import mod
+from utils import printExceptions
+
+# A muted_users value below this is a legacy number of remaining minutes, not an expiry timestamp
+LEGACY_MINUTES_LIMIT = 10 ** 9
+# Seconds before the first retry of a mute that failed to lift, doubled at every failure up to the maximum
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 3600
+
+
+def expiryTimestamp(value: float, now: float | None = None) -> float:
+    """
+    Converts the first value of a muted_users entry to an expiry timestamp
+    :param value: the expiry timestamp, or the number of remaining minutes of a mute saved by an older version
+    :param now: the current time, None for time.time()
+    :return: the expiry timestamp (seconds since the epoch)
+    """
+    if value >= LEGACY_MINUTES_LIMIT:
+        return value
+    return (time.time() if now is None else now) + value * 60
+
+
+# •==================•
+#    MUTE SCHEDULER
+# •==================•
+
+class MuteScheduler:
+    """
+    Unmutes the muted users when their mute expires, with one timer sleeping until the earliest expiry
+    The mutes are kept in a min-heap of due timestamps, an entry whose mute was lifted or replaced since it was pushed
+    is skipped when it is popped, and a mute that failed to lift is pushed back with an exponential backoff
+    :bot: the bot
+    :retryDelay: the number of seconds before the first retry of a mute that failed to lift
+    :heap: the (due timestamp, guild id, user id, expiry timestamp) of the mutes, the earliest first
+    :failures: links the (guild id, user id) of every mute that failed to lift to its number of failures
+    :loop: the loop the timer runs on, None until it is started
+    :wakeUp: the event waking the timer up when an earlier mute is scheduled
+    :unmutes: the number of users unmuted since the bot started
+    :retries: the number of failed unmutes scheduled again since the bot started
+    """
+
+    def __init__(self, bot, retryDelay: float = RETRY_DELAY):
+        """
+        Constructor
+        :param bot: the bot
+        :param retryDelay: the number of seconds before the first retry of a mute that failed to lift
+        """
+        self.bot = bot
+        self.retryDelay = retryDelay
+        self.heap: list[tuple[float, int, int, float]] = []
+        self.failures: dict[tuple[int, int], int] = {}
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.wakeUp: asyncio.Event | None = None
+        self.unmutes = 0
+        self.retries = 0
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Schedules every mute of every guild, the mutes expired while the bot was offline are lifted as soon as the
+        timer starts
+        :return: None
+        """
+        for guildId, guildData in self.bot.guildsDict.items():
+            for userId, (expiry, _) in guildData.muted_users.items():
+                self.schedule(guildId, userId, expiry)
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        """
+        Starts the timer on a loop, once
+        :param loop: the loop
+        :return: None
+        """
+        if self.loop is None:
+            self.loop = loop
+            asyncio.run_coroutine_threadsafe(self.run(), loop)
+
+    def schedule(self, guildId: int, userId: int, expiry: float, due: float | None = None) -> None:
+        """
+        Schedules the end of a mute
+        :param guildId: the id of the guild
+        :param userId: the id of the muted user
+        :param expiry: the expiry timestamp of the mute
+        :param due: the timestamp of the attempt to lift the mute, None for the expiry
+        :return: None
+        """
+        due = expiry if due is None else due
+        with self.lock:
+            heapq.heappush(self.heap, (due, guildId, userId, expiry))
+            earliest = self.heap[0][0] == due
+        if earliest and self.loop is not None and self.wakeUp is not None:
+            self.loop.call_soon_threadsafe(self.wakeUp.set)
+
+    def popExpired(self, now: float) -> list[tuple[int, int, float]]:
+        """
+        Pops the mutes due at a time that are still in place
+        :param now: the time
+        :return: the (guild id, user id, expiry timestamp) of the mutes to lift
+        """
+        expired = []
+        with self.lock:
+            while self.heap and self.heap[0][0] <= now:
+                _, guildId, userId, expiry = heapq.heappop(self.heap)
+                guildData = self.bot.guildsDict.get(guildId)
+                if guildData is not None and guildData.muted_users.get(userId, [None])[0] == expiry:
+                    expired.append((guildId, userId, expiry))
+                else:
+                    self.failures.pop((guildId, userId), None)
+        return expired
+
+    def retry(self, guildId: int, userId: int, expiry: float) -> None:
+        """
+        Schedules a mute that failed to lift again, after a delay doubled at every failure
+        :param guildId: the id of the guild
+        :param userId: the id of the muted user
+        :param expiry: the expiry timestamp of the mute
+        :return: None
+        """
+        failures = self.failures.get((guildId, userId), 0)
+        self.failures[(guildId, userId)] = failures + 1
+        self.retries += 1
+        self.schedule(guildId, userId, expiry, time.time() + min(self.retryDelay * 2 ** failures, MAX_RETRY_DELAY))
+
+    def nextExpiry(self) -> float | None:
+        """
+        Gets the earliest scheduled attempt to lift a mute
+        :return: the due timestamp, None if no mute is scheduled
+        """
+        with self.lock:
+            return self.heap[0][0] if self.heap else None
+
+    @printExceptions
+    async def run(self) -> None:
+        """
+        Sleeps until the earliest expiry (or until an earlier mute is scheduled) and lifts the expired mutes, forever
+        :return: None
+        """
+        self.wakeUp = asyncio.Event()
+        while True:
+            self.wakeUp.clear()
+            for guildId, userId, expiry in self.popExpired(time.time()):
+                if await mod.unmuteUser(self.bot, guildId, userId):
+                    self.failures.pop((guildId, userId), None)
+                    self.unmutes += 1
+                else:  # Failed (and printed), the mute is kept and lifted later
+                    self.retry(guildId, userId, expiry)
+
+            expiry = self.nextExpiry()
+            timeout = None if expiry is None else max(expiry - time.time(), 0)
+            try:
+                await asyncio.wait_for(self.wakeUp.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
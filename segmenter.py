@@ -0,0 +1,229 @@
+import threading
+from collections import deque
+from datetime import timedelta
+
+import discord
+import numpy as np
+
+from utils import printExceptions
+
+
+# •=====================•
+#    CHANNEL SEGMENTER
+# •=====================•
+
+class ChannelSegmenter:
+    """
+    Splits the messages of a channel into conversation threads as they are sent
+    Threads are the sets of a union-find structure: a message joins the thread of the message it replies to or, if it
+    is close enough, of the most similar recent message still chained to it by the time gap rule
+    :parent: links every message id to its parent in the union-find structure
+    :members: links every thread root to the ids of its messages, in chronological order
+    :messages: links every message id to the message
+    :embeddings: links every message id to its normalized embedding
+    :texts: links every message id to its cleaned English text, the text summarized for the thread
+    :recent: the ids of the last messages of the channel, candidates for the next message
+    :order: the ids of the messages in the order they were added, used to evict the oldest threads
+    """
+
+    def __init__(self, maxMessages: int = 500, lookBack: int = 10, threshold: float = 1.0):
+        """
+        Constructor
+        :param maxMessages: the maximum number of messages kept for the channel
+        :param lookBack: the number of previous messages a new message is compared to
+        :param threshold: the maximum euclidean distance between the embeddings of two messages of the same thread
+        """
+        self.maxMessages = maxMessages
+        self.threshold = threshold
+        self.parent: dict[int, int] = {}
+        self.members: dict[int, list[int]] = {}
+        self.messages: dict[int, discord.Message] = {}
+        self.embeddings: dict[int, np.ndarray] = {}
+        self.texts: dict[int, str] = {}
+        self.recent: deque[int] = deque(maxlen=lookBack)
+        self.order: deque[int] = deque()
+
+    # •======================•
+    #    UNION-FIND
+    # •======================•
+
+    def find(self, messageId: int) -> int:
+        """
+        Finds the root of the thread of a message (with path halving)
+        :param messageId: the id of the message
+        :return: the id of the root of the thread
+        """
+        while self.parent[messageId] != messageId:
+            self.parent[messageId] = self.parent[self.parent[messageId]]
+            messageId = self.parent[messageId]
+        return messageId
+
+    def union(self, messageId1: int, messageId2: int) -> None:
+        """
+        Merges the threads of two messages, the smaller thread joins the bigger one
+        :param messageId1: the id of the first message
+        :param messageId2: the id of the second message
+        :return: None
+        """
+        root1, root2 = self.find(messageId1), self.find(messageId2)
+        if root1 == root2:
+            return
+        if len(self.members[root1]) < len(self.members[root2]):
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        # Discord ids grow with time, sorting two sorted runs is linear
+        self.members[root1] = sorted(self.members[root1] + self.members.pop(root2))
+
+    # •======================•
+    #    MESSAGES
+    # •======================•
+
+    def chainedRecent(self, message: discord.Message, timeGap: int) -> list[int]:
+        """
+        Gets the recent messages chained to a message by the time gap rule (as in tldr.getChatByTime)
+        :param message: the new message
+        :param timeGap: the time gap in minutes
+        :return: the ids of the chained messages, the most recent first
+        """
+        chained = []
+        date = message.created_at
+        for messageId in reversed(self.recent):
+            if messageId not in self.messages:  # Evicted
+                break
+            previous = self.messages[messageId]
+            if previous.created_at < date + timedelta(minutes=-timeGap):
+                break
+            chained.append(messageId)
+            date = previous.created_at
+        return chained
+
+    def add(self, message: discord.Message, embedding: np.ndarray, timeGap: int, text: str = "") -> None:
+        """
+        Assigns a new message to a thread, an edited message keeps its thread
+        :param message: the message
+        :param embedding: the normalized embedding of the message
+        :param timeGap: the time gap in minutes
+        :param text: the cleaned English text of the message
+        :return: None
+        """
+        if message.id in self.messages:
+            self.messages[message.id] = message
+            self.embeddings[message.id] = embedding
+            self.texts[message.id] = text
+            return
+
+        candidates = self.chainedRecent(message, timeGap)
+
+        self.parent[message.id] = message.id
+        self.members[message.id] = [message.id]
+        self.messages[message.id] = message
+        self.embeddings[message.id] = embedding
+        self.texts[message.id] = text
+        self.recent.append(message.id)
+        self.order.append(message.id)
+
+        repliedId = message.reference.message_id if message.type == discord.MessageType.reply else None
+        if repliedId in self.parent:
+            self.union(message.id, repliedId)
+        elif candidates:
+            distances = np.linalg.norm(np.array([self.embeddings[i] for i in candidates]) - embedding, axis=1)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= self.threshold:
+                self.union(message.id, candidates[nearest])
+
+        while len(self.messages) > self.maxMessages:
+            self.evictOldest()
+
+    def evictOldest(self) -> None:
+        """
+        Forgets the thread of the oldest message
+        :return: None
+        """
+        oldest = self.order.popleft()
+        if oldest not in self.messages:  # Already evicted with its thread
+            return
+        for messageId in self.members.pop(self.find(oldest)):
+            del self.parent[messageId]
+            del self.messages[messageId]
+            del self.embeddings[messageId]
+            del self.texts[messageId]
+
+    def thread(self, messageId: int) -> list[discord.Message] | None:
+        """
+        Gets the thread of a message
+        :param messageId: the id of the message
+        :return: the messages of the thread in chronological order, None if the message is unknown
+        """
+        if messageId not in self.parent:
+            return None
+        return [self.messages[i] for i in self.members[self.find(messageId)]]
+
+
+# •==========================•
+#    CONVERSATION SEGMENTER
+# •==========================•
+
+class ConversationSegmenter:
+    """
+    Keeps the live conversation threads of every channel
+    :channels: links every channel id to its ChannelSegmenter
+    """
+
+    def __init__(self, maxMessages: int = 500, lookBack: int = 10, threshold: float = 1.0):
+        """
+        Constructor
+        :param maxMessages: the maximum number of messages kept per channel
+        :param lookBack: the number of previous messages a new message is compared to
+        :param threshold: the maximum euclidean distance between the embeddings of two messages of the same thread
+        """
+        self.maxMessages = maxMessages
+        self.lookBack = lookBack
+        self.threshold = threshold
+        self.channels: dict[int, ChannelSegmenter] = {}
+        self.lock = threading.Lock()
+
+    @printExceptions
+    def add(self, message: discord.Message, embedding: np.ndarray, timeGap: int, text: str = "") -> None:
+        """
+        Assigns a new message to a thread of its channel
+        :param message: the message
+        :param embedding: the normalized embedding of the message
+        :param timeGap: the time gap of the guild in minutes
+        :param text: the cleaned English text of the message
+        :return: None
+        """
+        with self.lock:
+            channelId = message.channel.id
+            if channelId not in self.channels:
+                self.channels[channelId] = ChannelSegmenter(self.maxMessages, self.lookBack, self.threshold)
+            self.channels[channelId].add(message, embedding, timeGap, text)
+
+    @printExceptions
+    def thread(self, channelId: int, messageId: int) -> list[discord.Message] | None:
+        """
+        Gets the thread containing a message
+        :param channelId: the id of the channel of the message
+        :param messageId: the id of the message
+        :return: the messages of the thread in chronological order, None if the message is unknown
+        """
+        with self.lock:
+            if channelId not in self.channels:
+                return None
+            return self.channels[channelId].thread(messageId)
+
+    @printExceptions
+    def threadTexts(self, channelId: int, messageId: int) -> tuple[list[discord.Message], dict[int, str]] | None:
+        """
+        Gets the thread containing a message with the cleaned English texts of its messages
+        :param channelId: the id of the channel of the message
+        :param messageId: the id of the message
+        :return: the messages of the thread in chronological order and the dict linking the id of every message to its
+        text, None if the message is unknown
+        """
+        with self.lock:
+            if channelId not in self.channels:
+                return None
+            thread = self.channels[channelId].thread(messageId)
+            if thread is None:
+                return None
+            return thread, {m.id: self.channels[channelId].texts[m.id] for m in thread}
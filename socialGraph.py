@@ -5,18 +5,23 @@ import discord
 import matplotlib.pyplot as plt
 import networkx as nx
 import numpy as np
-from transformers import pipeline
 
 import mood
 import utils
-from utils import printExceptions
+from inferenceService import inferenceService
+from messageAnalysis import analysisCache, analysisPipeline
+from modelRegistry import registry
+from utils import loadPipeline, printExceptions
 
 """
 Models import
 """
 
 model_path = "cardiffnlp/twitter-xlm-roberta-base-sentiment"
-sentiment_task = pipeline("sentiment-analysis", model=model_path, tokenizer=model_path)
+registry.register("sentiment",
+                  lambda: loadPipeline("sentiment", "sentiment-analysis", model_path, tokenizer=model_path))
+inferenceService.register("sentiment",
+                          lambda texts: [result["label"] for result in registry.get("sentiment")(texts)])
 
 
 # •======================•
@@ -390,7 +395,7 @@ class SocialGraph:
         :return: 1 if positive, -1 if negative, 0 if neutral
         """
         try:
-            agreement = sentiment_task(message_content)[0]["label"]
+            agreement = inferenceService.infer("sentiment", message_content)
         except:  # If the message is too long, we return the value of the first half of the message (should be the same as the overall message)
             return self.evaluate_agreement(message_content[:len(message_content) // 2])
 
@@ -403,17 +408,41 @@ class SocialGraph:
                 return 0
 
     @printExceptions
-    def update_agreement(self, message, taggedMembersValues: dict[int, float]) -> None:
+    async def evaluate_agreement_async(self, message_content) -> int:
+        """
+        Evaluate the agreement of the message without blocking the running loop, the messages evaluated at the same time
+        are batched together by the inference service
+        :param message_content: the content of message
+        :return: 1 if positive, -1 if negative, 0 if neutral
+        """
+        try:
+            agreement = await inferenceService.inferAsync("sentiment", message_content)
+        except:  # If the message is too long, we return the value of the first half of the message
+            return await self.evaluate_agreement_async(message_content[:len(message_content) // 2])
+
+        match agreement:
+            case "positive":
+                return 1
+            case "negative":
+                return -1
+            case "neutral":
+                return 0
+
+    @printExceptions
+    def update_agreement(self, message, taggedMembersValues: dict[int, float], agreement: int | None = None) -> None:
         """
         Update the agreement of the people the author talked to
         :param message: the message
         :param taggedMembersValues: the dict of the tagged members
+        :param agreement: the agreement of the message, None to evaluate it now
         :return: None
         """
         # we update the agreement of the people the author talked to
         if message.author.id not in self.agreementDict:
             self.agreementDict[message.author.id] = [0] * 2
-        self.agreementDict[message.author.id][0] += self.evaluate_agreement(message.content)
+        if agreement is None:
+            agreement = analysisCache.output(message, "sentiment", self.evaluate_agreement)
+        self.agreementDict[message.author.id][0] += agreement
         self.agreementDict[message.author.id][1] += 1
 
     # •==========================•
@@ -659,11 +688,12 @@ class SocialGraph:
     # •======================•
 
     # On every new message, we determine who the author is talking to and update (the people they talk to) importance's
-    def on_message(self, message: discord.Message, repliedMessage) -> None:
+    def on_message(self, message: discord.Message, repliedMessage, agreement: int | None = None) -> None:
         """
         On every new message, we determine who the author is talking to and update (the people they talk to) importance's
         :param message: the message
         :param repliedMessage: the message replied to
+        :param agreement: the agreement of the message, None to evaluate it now
         :return: None
         """
 
@@ -700,7 +730,7 @@ class SocialGraph:
                 self.interactions[message.author.id][member] = 0
             self.interactions[message.author.id][member] += 1
 
-        self.update_agreement(message, taggedMembersValues)
+        self.update_agreement(message, taggedMembersValues, agreement)
 
     # •======================•
     #   UTILS METHODS
@@ -945,7 +975,10 @@ class SocialGraphWorker:
         :param repliedMessage: the message that was replied to
         :return: None
         """
-        self.social_graphs[str(message.guild.id)].on_message(message, repliedMessage)
+        await analysisPipeline.english(message)  # The agreement is evaluated on the English text of the message
+        graph = self.social_graphs[str(message.guild.id)]
+        agreement = await analysisCache.outputAsync(message, "sentiment", graph.evaluate_agreement_async)
+        graph.on_message(message, repliedMessage, agreement)
 
     # •======================•
     #       UTILS
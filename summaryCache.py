@@ -0,0 +1,96 @@
+import threading
+import time
+from collections import OrderedDict
+
+from utils import contentHash
+
+
+# •=================•
+#    SUMMARY CACHE
+# •=================•
+
+class SummaryCache:
+    """
+    Bounded cache of the summaries of the clusters, keyed by the exact content of the cluster
+    The key holds the ordered ids of the messages, the hash of the text given to the summarizer and the generation
+    parameters, so an edited message or a different cluster never gets a stale summary
+    :capacity: the maximum number of summaries kept, the least recently used ones are evicted first
+    :ttl: the number of seconds a summary is kept
+    :entries: links every key to its (expiry time, summary), from the least to the most recently used
+    :hits: the number of summaries served from the cache
+    :misses: the number of summaries that had to be generated
+    """
+
+    def __init__(self, capacity: int = 1000, ttl: float = 3600):
+        """
+        Constructor
+        :param capacity: the maximum number of summaries kept
+        :param ttl: the number of seconds a summary is kept
+        """
+        self.capacity = capacity
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(messageIds: list[int], text: str, maxLength: int, minLength: int) -> str:
+        """
+        Computes the key of a cluster
+        :param messageIds: the ids of the messages of the cluster, in order
+        :param text: the text given to the summarizer
+        :param maxLength: the max_length given to the summarizer
+        :param minLength: the min_length given to the summarizer
+        :return: the key
+        """
+        return f"{','.join(map(str, messageIds))}:{contentHash(text)}:{maxLength}:{minLength}"
+
+    def get(self, key: str) -> str | None:
+        """
+        Gets a summary
+        :param key: the key of the cluster
+        :return: the summary, None if it is not in the cache or expired
+        """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, summary: str) -> None:
+        """
+        Stores a summary, evicting the expired and least recently used summaries if the cache is full
+        :param key: the key of the cluster
+        :param summary: the summary
+        :return: None
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.entries[key] = (now + self.ttl, summary)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.capacity:
+                for expiredKey in [k for k, (expiry, _) in self.entries.items() if expiry < now]:
+                    del self.entries[expiredKey]
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Removes every summary
+        :return: None
+        """
+        with self.lock:
+            self.entries.clear()
+
+    def __len__(self) -> int:
+        """
+        Gets the number of summaries in the cache
+        :return: the number of summaries
+        """
+        return len(self.entries)
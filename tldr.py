@@ -1,18 +1,81 @@
 import asyncio
+import heapq
 import re
 from datetime import timedelta
+from typing import Callable
 
 import discord
 from sentence_transformers import SentenceTransformer
 
+from embeddingStore import EmbeddingStore
+from inferenceService import inferenceService
+from messageAnalysis import analysisCache, analysisPipeline
+from segmenter import ConversationSegmenter
+from summaryCache import SummaryCache
+from modelRegistry import registry
 from utils import *
 
-sentenceModel = SentenceTransformer('sentence-transformers/all-MiniLM-L6-v2')
-# sentenceModel = SentenceTransformer('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
 
-
-# sentenceModel = SentenceTransformer('sentence-transformers/all-mpnet-base-v2')
-summarizer = pipeline("summarization", model="knkarthick/MEETING_SUMMARY")
+def loadSentenceModel(model: str, backend: str | None = None) -> SentenceTransformer:
+    """
+    Loads the sentence embedding model with the backend chosen in the settings
+    sentence-transformers has no ONNX Runtime export, the onnx backend falls back to int8 for this model
+    :param model: the name of the model on the Hugging Face hub
+    :param backend: the backend, None for the one in the settings
+    :return: the model
+    """
+    if backend is None:
+        backend = modelBackend("embedding")
+    loaded = SentenceTransformer(model)
+    if backend == "onnx":
+        print("The embedding model has no ONNX Runtime export, it is quantized to int8 instead")
+    if backend in ("int8", "onnx"):
+        loaded = quantize(loaded)
+    return loaded
+
+
+# The models are loaded on first use (or warmed up) by the model registry
+sentenceModelName = 'sentence-transformers/all-MiniLM-L6-v2'
+# sentenceModelName = 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2'
+# sentenceModelName = 'sentence-transformers/all-mpnet-base-v2'
+# Size of the embeddings of the sentence model, known without loading it
+embeddingDimension = 384
+registry.register("embedding", lambda: loadSentenceModel(sentenceModelName))
+registry.register("summary", lambda: loadPipeline("summary", "summarization", "knkarthick/MEETING_SUMMARY"))
+# The embeddings share the thread and the micro-batches of the other models, the summaries are too long to run there
+# and stay on the tldr executor
+inferenceService.register("embedding", lambda texts: list(registry.get("embedding").encode(texts)))
+
+# Maximum number of texts summarized in one call of the summarizer
+summaryBatchSize = getSetting("SUMMARY_BATCH_SIZE", 8)
+# The maximum lengths of the summaries are rounded up to these values, so that texts of close lengths share their
+# generation parameters and are summarized in one batch
+summaryLengths = (11, 16, 24, 32, 48, 64, 96, 128, 192, 256, 384, 512)
+
+# Maximum number of messages read on each side of the message, the walk stops earlier when the time gap rule breaks
+historyLimit = getSetting("TLDR_HISTORY_LIMIT", 5000)
+# Number of messages translated and embedded together while the rest of the history is fetched (a Discord page)
+streamBatchSize = getSetting("TLDR_STREAM_BATCH", 100)
+
+# Long clusters are summarized chunk by chunk (map), then the partial summaries are summarized together (reduce)
+summaryMapReduce = getSetting("SUMMARY_MAP_REDUCE", True)
+# Maximum number of tokens of a chunk, the summarizer's context is 1024 tokens
+summaryChunkTokens = getSetting("SUMMARY_CHUNK_TOKENS", 512)
+# Maximum number of map-reduce levels, the last level is summarized whatever its length
+summaryMaxDepth = getSetting("SUMMARY_MAX_DEPTH", 4)
+
+# Embeddings of the messages already seen, memory-mapped in data/ so they survive restarts
+embeddingStore = EmbeddingStore(embeddingDimension,
+                                capacity=getSetting("EMBEDDING_STORE_SIZE", 20000),
+                                half=getSetting("EMBEDDING_STORE_HALF", False),
+                                path="data/embeddings" if getSetting("EMBEDDING_STORE_DISK", True) else None)
+
+# Summaries of the clusters already summarized, for repeated and overlapping tldr requests
+summaryCache = SummaryCache(capacity=getSetting("SUMMARY_CACHE_SIZE", 1000), ttl=getSetting("SUMMARY_CACHE_TTL", 3600))
+
+# Live conversation threads of every channel, built as messages are sent
+segmenter = ConversationSegmenter(maxMessages=getSetting("SEGMENT_MAX_MESSAGES", 500),
+                                  threshold=getSetting("SEGMENT_THRESHOLD", 1.0))
 
 
 @printExceptions
@@ -28,33 +91,113 @@ async def doTldr(bot: discord.Client, message: discord.Message, messageToEdit: d
     :param timeGap: The time gap between the summary
     :return: None
     """
-    # print("Starting tldr")
+    summarises = await computeTldr(bot, message, quantity, position, timeGap)
+    await sendSummarises(bot, [messageToEdit], summarises or [])
 
-    messages, indexMessageInit = getChatByTime(bot, message, timeGap, positionParameter=position)
-    # print("Got messages", len(messages))
 
-    translatedMessages = getTranslatedMessage(messages)
+@printExceptions
+async def computeTldr(bot: discord.Client, message: discord.Message, quantity: str = "one", position: str = "around",
+                      timeGap: int = 5) -> list[tuple[str, discord.Message]]:
+    """
+    Call every function needed to summarize the chat around a message
+    :param bot: The bot
+    :param message: The message to summarize
+    :param quantity: The quantity of summary to send
+    :param position: The position of the summary
+    :param timeGap: The time gap between the summary
+    :return: list of tuple of, Summary For one cluster and the first message of the cluster
+    """
+    # print("Starting tldr")
+    loop = asyncio.get_running_loop()
+
+    segmented = segmentedThread(message, quantity, position)
+    if segmented is not None:
+        # The conversation was already segmented when its messages were sent
+        thread, texts = segmented
+        return await loop.run_in_executor(bot.tldrExecutor, lambda: summarize([thread], texts=texts))
+
+    # Discord requests are awaited on the bot's loop, model stages run in the tldr executor
+    # The messages are translated and embedded batch by batch while the next pages of the history are fetched
+    batches, prepared = [], []
+
+    def prepare(batch: list[discord.Message]) -> None:
+        batches.append(batch)
+        prepared.append(loop.run_in_executor(bot.tldrExecutor, prepareMessages, batch))
+
+    messages, indexMessageInit = await getChatByTime(bot, message, timeGap, positionParameter=position,
+                                                     onMessages=prepare)
+    texts = {}
+    for batch, translated in zip(batches, await asyncio.gather(*prepared)):
+        if translated is None:  # The error was printed by prepareMessages
+            print("tldr: some messages could not be translated, the tldr is cancelled")
+            return []
+        texts.update(zip((m.id for m in batch), translated))
+    translatedMessages = [texts[m.id] for m in messages]
+    # print("Got messages", len(messages))
     # print("Got Translated messages")  # , translatedMessages)
 
     # similarityMatrix = similarityAll(translatedMessages, messages)
-    similarityMatrix = similarity(translatedMessages, messages)
+    similarityMatrix = await loop.run_in_executor(bot.tldrExecutor, similarity, translatedMessages, messages)
     # print("Got similarity matrix")
     # dumpjsonMatrix(similarityMatrix)
     # printSimilarityMatrix(similarityMatrix)
 
     # print(np.min(similarityMatrix), np.max(similarityMatrix))
-    clusters = clustering(messages, similarityMatrix, quantity, indexMessageInit)
+    clusters = await loop.run_in_executor(bot.tldrExecutor, clustering, messages, similarityMatrix, quantity,
+                                          indexMessageInit)
     # print("Got clusters")
     # printCluster(clusters)
 
-    summarises = summarize(clusters)
+    summarises = await loop.run_in_executor(bot.tldrExecutor, lambda: summarize(clusters, texts=texts))
     # print("Got summarises")
 
-    sendSummarises(bot, messageToEdit, summarises)
+    return summarises
 
     # cheated(translatedMessages)
 
 
+@printExceptions
+async def ingestMessage(message: discord.Message, guildData) -> None:
+    """
+    Embed a new message and assign it to a live conversation thread of its channel
+    :param message: The message, its English text is awaited from the analysis pipeline
+    :param guildData: The data of the guild of the message
+    :return: None
+    """
+    text = remove_non_alphanumeric(await analysisPipeline.english(message))
+    messageEmbedding = storedEmbeddings([text], [message])[0]
+    segmenter.add(message, messageEmbedding, guildData.tldrTimeGap, text)
+
+
+@printExceptions
+def segmentedThread(message: discord.Message, quantity: str, position: str) \
+        -> tuple[list[discord.Message], dict[int, str]] | None:
+    """
+    Get the live conversation thread of a message, restricted to the position parameter
+    The messages are shared with the message buffer and the segmenter, their content is left untouched and their
+    English texts are the ones stored by ingestMessage
+    :param message: The message around which the chat is summarized
+    :param quantity: The quantity of summary to send
+    :param position: The position of the summary
+    :return: The messages of the thread and the dict linking the id of every message to its cleaned English text, None
+    if the whole chat has to be fetched and clustered
+    """
+    if quantityParameter(quantity):  # Every conversation of the chat is summarized
+        return None
+
+    segmented = segmenter.threadTexts(message.channel.id, message.id)
+    if segmented is None:
+        return None
+    thread, texts = segmented
+
+    above, below = postionParameter(position)
+    thread = [m for m in thread if (above and m.id <= message.id) or (below and m.id >= message.id)]
+    if len(thread) < 2:
+        return None
+
+    return thread, {m.id: texts[m.id] for m in thread}
+
+
 @printExceptions
 def printSimilarityMatrix(similarityMatrix: np.array) -> None:
     """
@@ -141,7 +284,8 @@ def quantityParameter(quantity: str) -> bool:
 
 
 @printExceptions
-async def getMessagesAfter(channel: discord.TextChannel, message: discord.Message, limit: int) -> list[discord.Message]:
+async def getMessagesAfter(channel: discord.TextChannel, message: discord.abc.Snowflake, limit: int) \
+        -> list[discord.Message]:
     """
     Coroutines to get messages after a message
     :param channel: Channel to get the messages
@@ -153,7 +297,7 @@ async def getMessagesAfter(channel: discord.TextChannel, message: discord.Messag
 
 
 @printExceptions
-async def getMessagesBefore(channel: discord.TextChannel, message: discord.Message, limit: int) -> \
+async def getMessagesBefore(channel: discord.TextChannel, message: discord.abc.Snowflake, limit: int) -> \
         list[discord.Message]:
     """
     Coroutines to get messages before a message
@@ -165,6 +309,49 @@ async def getMessagesBefore(channel: discord.TextChannel, message: discord.Messa
     return [message async for message in channel.history(limit=limit, before=message)]
 
 
+async def messagesBefore(bot: discord.Client, channel: discord.TextChannel, messageInit: discord.Message, limit: int):
+    """
+    Asynchronous generator of the messages sent before a message, from the most recent to the oldest
+    Messages are read from the bot's message buffer, the channel history is only fetched (page by page) for the
+    messages older than the buffer, and only if the caller keeps iterating
+    :param bot: Discord bot
+    :param channel: Channel of the message
+    :param messageInit: Message before which we want to get the messages
+    :param limit: Limit of messages to get
+    :return: Asynchronous generator of messages
+    """
+    buffered, coverageStart = bot.messageBuffer.before(channel.id, messageInit.id, limit)
+    for message in buffered:
+        yield message
+
+    limit -= len(buffered)
+    if limit <= 0:
+        return
+    before = messageInit if coverageStart is None else discord.Object(id=coverageStart)
+    async for message in channel.history(limit=limit, before=before):
+        yield message
+
+
+async def messagesAfter(bot: discord.Client, channel: discord.TextChannel, messageInit: discord.Message, limit: int):
+    """
+    Asynchronous generator of the messages sent after a message, from the oldest to the most recent
+    Messages are read from the bot's message buffer when it covers the message, otherwise the channel history is
+    fetched page by page, and only if the caller keeps iterating
+    :param bot: Discord bot
+    :param channel: Channel of the message
+    :param messageInit: Message after which we want to get the messages
+    :param limit: Limit of messages to get
+    :return: Asynchronous generator of messages
+    """
+    if bot.messageBuffer.covers(channel.id, messageInit.id):
+        for message in bot.messageBuffer.after(channel.id, messageInit.id, limit):
+            yield message
+        return
+
+    async for message in channel.history(limit=limit, after=messageInit):
+        yield message
+
+
 @printExceptions
 def remove_non_alphanumeric(text) -> str:
     """
@@ -177,90 +364,109 @@ def remove_non_alphanumeric(text) -> str:
 
 
 @printExceptions
-def getChatByTime(bot: discord.Client, messageInit: discord.Message, timeGap: int, positionParameter="around") \
+async def getChatByTime(bot: discord.Client, messageInit: discord.Message, timeGap: int, positionParameter="around",
+                        limit: int | None = None, onMessages: Callable[[list], None] | None = None) \
         -> tuple[list, int]:
     """
     Get messages from a channel around, after or before a message depending on the position parameter
+    The history is read as a stream and stops as soon as the time gap rule breaks
     :param bot: Discord bot
     :param messageInit: Message around which we want to get the messages
     :param timeGap: Time gap in minutes
     :param positionParameter: Position parameter
+    :param limit: Maximum number of messages read on each side of messageInit, None for the TLDR_HISTORY_LIMIT setting
+    :param onMessages: Called with every batch of streamBatchSize kept messages as soon as they are read
     :return: List of messages, index of the messageInit in the list
     """
     above, below = postionParameter(positionParameter)
     channel = messageInit.channel
     messageCreatedTime = messageInit.created_at
     chat = []
+    batch = []
 
-    if above and below:
-        limit = 200
-    else:
-        limit = 100
+    if limit is None:
+        limit = historyLimit
+
+    def keep(message: discord.Message) -> None:
+        chat.append(message)
+        if onMessages is not None:
+            batch.append(message)
+            if len(batch) >= streamBatchSize:
+                onMessages(batch.copy())
+                batch.clear()
 
     if above:
 
-        messagesAbove = asyncio.run_coroutine_threadsafe(getMessagesBefore(channel, messageInit, limit),
-                                                         bot.loop).result()
-        messagesAbove.insert(0, messageInit)
+        keep(messageInit)
         date = messageCreatedTime
-        cpt = 0
-        for actualMessage in messagesAbove:
+        read = 0
+        async for actualMessage in messagesBefore(bot, channel, messageInit, limit):
+            read += 1
 
-            if actualMessage.author.bot and cpt > 0:
+            if actualMessage.author.bot:
                 continue
 
             if actualMessage.created_at >= date + timedelta(minutes=-timeGap):
-                chat.append(actualMessage)
+                keep(actualMessage)
                 date = actualMessage.created_at
             else:
                 break
-
-            cpt += 1
+        else:
+            if read >= limit:
+                print(f"tldr: history limit of {limit} messages reached before the conversation started")
 
         chat.reverse()
 
     if below:
 
-        messagesBelow = asyncio.run_coroutine_threadsafe(getMessagesAfter(channel, messageInit, limit),
-                                                         bot.loop).result()
-
-        if not above:
-            messagesBelow.insert(0, messageInit)
+        if not above and not messageInit.author.bot:
+            keep(messageInit)
 
         date = messageCreatedTime
-
-        for actualMessage in messagesBelow:
+        read = 0
+        async for actualMessage in messagesAfter(bot, channel, messageInit, limit):
+            read += 1
 
             if actualMessage.author.bot:
                 continue
 
             if actualMessage.created_at <= date + timedelta(minutes=timeGap):
-                chat.append(actualMessage)
+                keep(actualMessage)
                 date = actualMessage.created_at
             else:
                 break
+        else:
+            if read >= limit:
+                print(f"tldr: history limit of {limit} messages reached before the conversation ended")
 
-    for message in chat:
-        message.content = remove_non_alphanumeric(message.content)
+    if batch:
+        onMessages(batch)
 
     return chat, chat.index(messageInit)
 
 
 @printExceptions
-def getTranslatedMessage(messages: list[discord.Message]) -> list[str]:
+def prepareMessages(messages: list[discord.Message]) -> list[str] | None:
     """
-    create a list of translted messages
+    Translate a batch of messages and store their embeddings, called while the rest of the history is fetched
     :param messages: List of discord.Message
-    :return: List of string
+    :return: List of the translated messages, None if they could not be translated
     """
+    translatedMessages = getTranslatedMessage(messages)
+    if translatedMessages is not None:
+        storedEmbeddings(translatedMessages, messages)
+    return translatedMessages
 
-    translatedMessages = []
-    for message in messages:
-        translation = toEnglish(message.clean_content)
-        translatedMessages.append(translation)
-        message.content = translation
 
-    return translatedMessages
+@printExceptions
+def getTranslatedMessage(messages: list[discord.Message]) -> list[str]:
+    """
+    create a list of translted messages, the messages already translated are read from the analysis cache
+    The messages are shared with the message buffer, their content is left untouched
+    :param messages: List of discord.Message
+    :return: List of string
+    """
+    return [remove_non_alphanumeric(record.english) for record in analysisCache.analyseMany(messages, wait=True)]
 
 
 # def hausdorff_distance(list1:list[float], list2:list[float])->float:
@@ -319,56 +525,101 @@ def distance(embeddingMessage1: np.ndarray, embeddingMessage2: np.ndarray):
 
 
 @printExceptions
-def similarity(tokenMessages: list[str],
-               messages: list[discord.Message]) -> np.ndarray:
+def replyTargets(messages: list[discord.Message]) -> np.ndarray:
     """
-    More like a distance matrix, 0 = same message, 1 = totally different, -1 = not computed
-    :param tokenMessages: list of list of string
+    Compute, for every message, the index of the message it replies to inside the list
     :param messages: list of discord.Message
-    :return: np.matrix of size len(messages) x len(messages) and embedding of messages
+    :return: np.ndarray of int, -1 when the message is not a reply to a message of the list
     """
-    nbMessages = len(tokenMessages)
+    messagesIndex = {}
+    for index, message in enumerate(messages):
+        messagesIndex.setdefault(message.id, index)
 
-    similarityMatrix = np.full((nbMessages, nbMessages), -1.0)
-    messagesId = [message.id for message in messages]
+    targets = np.full(len(messages), -1, dtype=np.int64)
+    for i, message in enumerate(messages):
+        if message.type == discord.MessageType.reply:
+            targets[i] = messagesIndex.get(message.reference.message_id, -1)
+    return targets
 
-    # preprocess embeddings
 
-    messageEmbeddings = sentenceModel.encode(tokenMessages)
-    messageEmbeddings = messageEmbeddings / np.linalg.norm(messageEmbeddings, axis=1, keepdims=True)
+@printExceptions
+def distanceMatrix(messageEmbeddings: np.ndarray,
+                   tokenMessages: list[str],
+                   messages: list[discord.Message],
+                   band: int | None = 10) -> np.ndarray:
+    """
+    Compute the banded distance matrix of the messages with array operations
+    Every message is compared to the band previous messages (every previous message if band is None),
+    replies are linked to the message they reply to with a distance of 0 and are not compared to anything else
+    :param messageEmbeddings: np.ndarray of the normalized embeddings, one row per message
+    :param tokenMessages: list of string
+    :param messages: list of discord.Message
+    :param band: number of previous messages each message is compared to, None for all of them
+    :return: np.matrix of size len(messages) x len(messages), -1 = not computed
+    """
+    nbMessages = len(tokenMessages)
+    similarityMatrix = np.full((nbMessages, nbMessages), -1.0)
+    if nbMessages == 0:
+        return similarityMatrix
+
+    if band is None or band > nbMessages - 1:
+        band = nbMessages - 1
+
+    targets = replyTargets(messages)
+    notEmpty = np.array([bool(message) for message in tokenMessages])
+    # a reply linked to its message is not compared to the previous messages
+    compared = notEmpty & (targets == -1)
+
+    # the k-th diagonal holds the distances between each message and the k-th previous one
+    for k in range(1, band + 1):
+        rows = np.arange(k, nbMessages)
+        columns = rows - k
+        keep = compared[rows] & notEmpty[columns]
+        rows, columns = rows[keep], columns[keep]
+        dist = np.linalg.norm(messageEmbeddings[rows] - messageEmbeddings[columns], axis=1)
+        similarityMatrix[rows, columns] = dist
+        similarityMatrix[columns, rows] = dist
+
+    replies = np.nonzero(targets != -1)[0]
+    similarityMatrix[replies, targets[replies]] = 0.
+    similarityMatrix[targets[replies], replies] = 0.
 
-    for i in range(nbMessages - 1, -1, -1):
+    return similarityMatrix
 
-        # print("msg ", i+1, " / ", nbMessages)
-        actualMessage = tokenMessages[i]
-        actualDiscordMessage = messages[i]
-        # print(actualMessage)
-        if actualDiscordMessage.type == discord.MessageType.reply:
 
-            repliedMessageId = actualDiscordMessage.reference.message_id
+@printExceptions
+def encodeMessages(tokenMessages: list[str]) -> np.ndarray:
+    """
+    Compute the normalized embeddings of the messages, in the micro-batches of the inference service
+    :param tokenMessages: list of string
+    :return: np.ndarray of size len(tokenMessages) x embedding size
+    """
+    messageEmbeddings = np.array(inferenceService.inferMany("embedding", tokenMessages))
+    return messageEmbeddings / np.linalg.norm(messageEmbeddings, axis=1, keepdims=True)
 
-            if repliedMessageId in messagesId:
-                index = messagesId.index(repliedMessageId)
-                similarityMatrix[i][index] = 0.
-                similarityMatrix[index][i] = 0.
-                continue
-        if not actualMessage:
-            continue
-        # previous 10 messages
-        for j in range(i - 1, i - 11, -1):
-            if j < 0:
-                break
-            previousMessage: str = tokenMessages[j]
-            if not previousMessage:
-                continue
-            # print(previousMessage)
-            dist = distance(messageEmbeddings[i], messageEmbeddings[j])
 
-            similarityMatrix[i][j] = dist
-            similarityMatrix[j][i] = dist
+@printExceptions
+def storedEmbeddings(tokenMessages: list[str], messages: list[discord.Message]) -> np.ndarray:
+    """
+    Get the normalized embeddings of the messages from the embedding store, only the missing messages are encoded
+    :param tokenMessages: list of string
+    :param messages: list of discord.Message
+    :return: np.ndarray of size len(tokenMessages) x embedding size
+    """
+    return embeddingStore.getEmbeddings([message.id for message in messages], tokenMessages, encodeMessages)
 
-    # print(type(similarityMatrix))
-    return similarityMatrix
+
+@printExceptions
+def similarity(tokenMessages: list[str],
+               messages: list[discord.Message]) -> np.ndarray:
+    """
+    More like a distance matrix, 0 = same message, 1 = totally different, -1 = not computed
+    Each message is compared to its 10 previous messages
+    :param tokenMessages: list of list of string
+    :param messages: list of discord.Message
+    :return: np.matrix of size len(messages) x len(messages) and embedding of messages
+    """
+    return distanceMatrix(storedEmbeddings(tokenMessages, messages), tokenMessages, messages, band=10)
 
 
 @printExceptions
@@ -376,57 +627,12 @@ def similarityAll(tokenMessages: list[str],
                   messages: list[discord.Message]) -> np.ndarray:
     """
     More like a distance matrix, 0 = same message, 1 = totally different, -1 = not computed
+    Each message is compared to every previous message
     :param tokenMessages: list of list of string
     :param messages: list of discord.Message
     :return: np.matrix of size len(messages) x len(messages) and embedding of messages
     """
-    nbMessages = len(tokenMessages)
-
-    similarityMatrix = np.full((nbMessages, nbMessages), -1.0)
-    messagesId = [message.id for message in messages]
-    # preprocess embeddings
-
-    messageEmbeddings = sentenceModel.encode(tokenMessages)
-
-    messageEmbeddings = messageEmbeddings / np.linalg.norm(messageEmbeddings, axis=1, keepdims=True)
-
-    for i in range(nbMessages - 1, -1, -1):
-
-        # print("msg ", i+1, " / ", nbMessages)
-        actualMessage: str = tokenMessages[i]
-        actualDiscordMessage = messages[i]
-        # print(actualMessage)
-        if actualDiscordMessage.type == discord.MessageType.reply:
-
-            repliedMessageId = actualDiscordMessage.reference.message_id
-
-            if repliedMessageId in messagesId:
-                index = messagesId.index(repliedMessageId)
-                similarityMatrix[i][index] = 0.
-                similarityMatrix[index][i] = 0.
-                continue
-
-        if not actualMessage:
-            continue
-
-        # previous messages
-        for j in range(i - 1, -1, -1):
-
-            if j < 0:
-                break
-            previousMessage: str = tokenMessages[j]
-
-            if not previousMessage:
-                continue
-
-            # print(previousMessage)
-            dist = distance(messageEmbeddings[i], messageEmbeddings[j])
-
-            similarityMatrix[i][j] = dist
-            similarityMatrix[j][i] = dist
-
-    # print(np.max(similarityMatrix), np.min(similarityMatrix))
-    return similarityMatrix
+    return distanceMatrix(storedEmbeddings(tokenMessages, messages), tokenMessages, messages, band=None)
 
 
 @printExceptions
@@ -514,6 +720,58 @@ def clusterSimilarity(similarityMatrix: np.ndarray,
     return clusterSimilarityMatrix
 
 
+@printExceptions
+def wardClustering(similarityMatrix: np.ndarray) -> list[list[int]]:
+    """
+    Hierarchical ascending classification with the Ward distance, updated incrementally
+    The sum of the similarity between two clusters is additive, so when two clusters are merged (Lance-Williams update)
+    the sums with every other cluster are added row by row and only the new distances are pushed in a priority queue
+    :param similarityMatrix: np.matrix
+    :return: list of clusters, each cluster being the list of the index of its messages
+    """
+    nbMessages = len(similarityMatrix)
+    sums = np.array(similarityMatrix, dtype=np.float64)
+    sizes = np.ones(nbMessages)
+    members = [[i] for i in range(nbMessages)]
+    alive = np.ones(nbMessages, dtype=bool)
+    nbClusters = nbMessages
+
+    # clusters keep the position of their first member, ties are broken like findMinMatrix (first row, then column)
+    n = (sizes[:, None] + sizes[None, :]) ** 2
+    wardMatrix = 2 * sums / n - (sizes[:, None] / n) - (sizes[None, :] / n)
+    rows, columns = np.triu_indices(nbMessages, k=1)
+    heap = list(zip(wardMatrix[rows, columns].tolist(), rows.tolist(), columns.tolist()))
+    heapq.heapify(heap)
+
+    while nbClusters > 1:
+        minDist, minI, minJ = heapq.heappop(heap)
+        # entries of merged clusters or with an outdated distance are skipped
+        if not (alive[minI] and alive[minJ]) or wardMatrix[minI][minJ] != minDist:
+            continue
+        if minDist > -0.1 and nbClusters <= 3:  # TODO: change this value
+            break
+
+        members[minI] = members[minI] + members[minJ]
+        members[minJ] = []
+        alive[minJ] = False
+        nbClusters -= 1
+
+        sums[minI] += sums[minJ]
+        sums[:, minI] = sums[minI]
+        sizes[minI] += sizes[minJ]
+
+        others = np.nonzero(alive)[0]
+        others = others[others != minI]
+        n = (sizes[minI] + sizes[others]) ** 2
+        distances = 2 * sums[minI, others] / n - (sizes[minI] / n) - (sizes[others] / n)
+        wardMatrix[minI, others] = distances
+        wardMatrix[others, minI] = distances
+        for other, dist in zip(others.tolist(), distances.tolist()):
+            heapq.heappush(heap, (dist, min(minI, other), max(minI, other)))
+
+    return [members[i] for i in range(nbMessages) if alive[i]]
+
+
 @printExceptions
 def clustering(messages: list[discord.Message],
                similarityMatrix: np.ndarray,
@@ -531,19 +789,7 @@ def clustering(messages: list[discord.Message],
     # print("Clustering")
     all = quantityParameter(quantity)
 
-    cluster = []
-    for i in range(len(messages)):
-        cluster.append([i])
-    # print(len(cluster), " clusters")
-    while len(cluster) > 1:
-        clusterSimi = clusterSimilarity(similarityMatrix, cluster)
-        minI, minJ, min = findMinMatrix(clusterSimi)
-        if min > -0.1 and len(cluster) <= 3:  # TODO: change this value
-            break
-        cluster[minI] = cluster[minI] + cluster[minJ]
-        cluster.pop(minJ)
-
-        # print(len(cluster), "min", min, )
+    cluster = wardClustering(similarityMatrix)
 
     # print(len(cluster), " clusters")
 
@@ -559,72 +805,257 @@ def clustering(messages: list[discord.Message],
 
 
 @printExceptions
-def summarize(messagesCluster: list[list[discord.Message]]) -> list[tuple[str, discord.Message]]:
+def clusterLines(cluster: list[discord.Message], texts: dict[int, str] | None = None) -> list[str]:
     """
-    Summarize Every cluster of messages
-    :param messagesCluster: list of list of discord.Message
-    :return: list of tuple of, Summary For one cluster and the first message of the cluster
+    Build the lines given to the summarizer for a cluster of messages
+    :param cluster: list of discord.Message
+    :param texts: dict linking the id of every message to the text to summarize, None to use the content of the messages
+    :return: the messages of the cluster prefixed by their author's name, one line per non-empty message
+    """
+    lines = []
+    for m in cluster:
+        content = m.content if texts is None else texts[m.id]
+        if content == "":
+            continue
+        if m.author.nick is None:
+            name = m.author.name
+        else:
+            name = m.author.nick
+        lines.append(name + ": " + content)
+    return lines
+
+
+def joinLines(lines: list[str]) -> str:
+    """
+    Join lines into the text given to the summarizer
+    :param lines: list of string
+    :return: the text, one line per line
+    """
+    return "".join(line + " \n" for line in lines)
+
+
+@printExceptions
+def clusterText(cluster: list[discord.Message], texts: dict[int, str] | None = None) -> str:
     """
-    summarises = []
+    Build the text given to the summarizer for a cluster of messages
+    :param cluster: list of discord.Message
+    :param texts: dict linking the id of every message to the text to summarize, None to use the content of the messages
+    :return: the messages of the cluster, one per line and prefixed by their author's name
+    """
+    text = joinLines(clusterLines(cluster, texts))
+
+    if len(text) > 1024:
+        text = text[:1023]
+    return text
+
+
+@printExceptions
+def summaryLength(text: str) -> int:
+    """
+    Compute the maximum length of the summary of a text
+    :param text: the text to summarize
+    :return: the maximum length of the summary
+    """
+    size = len(text) // 3
+    if size > 512:
+        size = 512
+    elif size < 11:
+        size = 11
+    return size
+
+
+@printExceptions
+def generationParameters(text: str, maxLength: int = 512) -> tuple[int, int]:
+    """
+    Compute the generation parameters of the summary of a text, the texts of a batch all have the same parameters
+    :param text: the text to summarize
+    :param maxLength: the maximum length of the summary
+    :return: the max_length and min_length given to the summarizer
+    """
+    size = min(next(length for length in summaryLengths if length >= summaryLength(text)), maxLength)
+    return size, size // 4
+
+
+@printExceptions
+def lengthBatches(texts: list[str], batchSize: int, ratio: float = 1.5,
+                  parameters: list | None = None) -> list[list[int]]:
+    """
+    Group texts of similar length together so that batches are padded as little as possible
+    :param texts: list of string
+    :param batchSize: the maximum number of texts in a batch
+    :param ratio: the maximum ratio between the longest and the shortest text of a batch
+    :param parameters: the generation parameters of every text, texts with different parameters are never batched
+    together, None to only group by length
+    :return: list of batches, each batch being the list of the index of its texts
+    """
+    batches = []
+    for i in sorted(range(len(texts)), key=lambda index: len(texts[index])):
+        if batches and len(batches[-1]) < batchSize and \
+                (parameters is None or parameters[i] == parameters[batches[-1][0]]) and \
+                len(texts[i]) <= ratio * max(len(texts[batches[-1][0]]), 1):
+            batches[-1].append(i)
+        else:
+            batches.append([i])
+    return batches
+
+
+@printExceptions
+def summarizeTexts(texts: list[str], batchSize: int, maxLength: int = 512) -> list[str | None]:
+    """
+    Summarize texts in padded batches of texts of similar length and with the same generation parameters
+    :param texts: list of string
+    :param batchSize: the maximum number of texts summarized in one call of the summarizer
+    :param maxLength: the maximum length of a summary
+    :return: the summary of every text, None if it could not be summarized
+    """
+    summaries = [None] * len(texts)
     try:
-        for cluster in messagesCluster:
-            text = ""
-            for m in cluster:
-                if m.content == "":
-                    continue
-                if m.author.nick is None:
-                    name = m.author.name
-                else:
-                    name = m.author.nick
-                text += name + ": " + m.content + " \n"
-
-            if len(text) > 1024:
-                text = text[:1023]
-
-            size = len(text) // 3
-            if size > 512:
-                size = 512
-            elif size < 11:
-                size = 11
-            # print(size, len(text))
-            sum = summarizer(text, max_length=size, min_length=size // 4, do_sample=False)
-            summarises.append((sum[0]["summary_text"], cluster[0]))
+        summarizer = registry.get("summary")
+        parameters = [generationParameters(text, maxLength) for text in texts]
+        for batch in lengthBatches(texts, batchSize, parameters=parameters):
+            maxSize, minSize = parameters[batch[0]]
+            sums = summarizer([texts[i] for i in batch], max_length=maxSize, min_length=minSize,
+                              do_sample=False, truncation=True, batch_size=len(batch))
+            for i, sum in zip(batch, sums):
+                summaries[i] = sum["summary_text"]
 
     except Exception as e:
         print(e)
 
-    return summarises
+    return summaries
 
 
 @printExceptions
-def sendSummarises(bot: discord.Client,
-                   messageToEdit: discord.Message,
-                   listSummarise: list[tuple[str, discord.Message]]
-                   ) -> None:
+def chunkLines(lines: list[str], budget: int) -> list[list[str]]:
+    """
+    Split lines into consecutive chunks of at most budget tokens of the summarizer
+    A line longer than the budget is a chunk on its own, the summarizer truncates it
+    :param lines: list of string
+    :param budget: the maximum number of tokens of a chunk
+    :return: list of chunks, each chunk being a list of lines
     """
-    Send the summarises
+    if len(joinLines(lines).encode("utf-8")) <= budget:  # A token is at least one byte, no need to tokenize
+        return [lines]
+    tokenizer = registry.get("summary").tokenizer
+    lengths = [len(ids) for ids in tokenizer(lines, add_special_tokens=False)["input_ids"]]
+
+    chunks = [[]]
+    tokens = 0
+    for line, length in zip(lines, lengths):
+        if chunks[-1] and tokens + length > budget:
+            chunks.append([])
+            tokens = 0
+        chunks[-1].append(line)
+        tokens += length
+    return chunks
+
+
+@printExceptions
+def mapReduceSummarize(documents: list[list[str]], batchSize: int, budget: int, maxDepth: int) -> list[str | None]:
+    """
+    Summarize long documents level by level: every document longer than the budget is split in chunks, the chunks of
+    every document are summarized together in batches and the summaries become the lines of the document for the next
+    level, until every document fits in one chunk and is summarized a last time
+    A partial summary is at most a quarter of the budget long, so every level divides the length of a document by 4
+    :param documents: list of documents, each document being a list of lines
+    :param batchSize: the maximum number of texts summarized in one call of the summarizer
+    :param budget: the maximum number of tokens of a chunk
+    :param maxDepth: the maximum number of levels before the last summarization
+    :return: the summary of every document, None if it could not be summarized
+    """
+    documents = list(documents)
+    for _ in range(maxDepth):
+        chunks = [chunkLines(lines, budget) for lines in documents]
+        long = [i for i in range(len(documents)) if len(chunks[i]) > 1]
+        if not long:
+            break
+
+        texts = [joinLines(chunk) for i in long for chunk in chunks[i]]
+        partials = summarizeTexts(texts, batchSize, maxLength=max(budget // 4, 11))
+        start = 0
+        for i in long:
+            documents[i] = [partial for partial in partials[start:start + len(chunks[i])] if partial is not None]
+            start += len(chunks[i])
+
+    return summarizeTexts([joinLines(lines) for lines in documents], batchSize)
+
+
+@printExceptions
+def summarize(messagesCluster: list[list[discord.Message]],
+              batchSize: int | None = None, useCache: bool = True,
+              texts: dict[int, str] | None = None) -> list[tuple[str, discord.Message]]:
+    """
+    Summarize Every cluster of messages
+    The texts of every cluster are built first, the clusters already in the summary cache are served from it and the
+    others are summarized in padded batches of texts of similar length
+    Clusters longer than a chunk are summarized with map-reduce (see mapReduceSummarize) unless SUMMARY_MAP_REDUCE is
+    off, in which case their text is cut to 1023 characters
+    :param messagesCluster: list of list of discord.Message
+    :param batchSize: the maximum number of texts summarized in one call of the summarizer, 1 to summarize them one by
+    one, None for the SUMMARY_BATCH_SIZE setting
+    :param useCache: False to summarize every cluster without reading nor filling the summary cache
+    :param texts: dict linking the id of every message to the text to summarize, None to use the content of the messages
+    :return: list of tuple of, Summary For one cluster and the first message of the cluster
+    """
+    if batchSize is None:
+        batchSize = summaryBatchSize
+
+    lines = [clusterLines(cluster, texts) for cluster in messagesCluster]
+    texts = [joinLines(clusterLine) for clusterLine in lines]
+    summaries = [None] * len(texts)
+    keys = [None] * len(texts)
+    if useCache:
+        for i, (cluster, text) in enumerate(zip(messagesCluster, texts)):
+            keys[i] = summaryCache.key([m.id for m in cluster], text, *generationParameters(text))
+            summaries[i] = summaryCache.get(keys[i])
+
+    pending = [i for i in range(len(texts)) if summaries[i] is None]
+    if summaryMapReduce:
+        sums = mapReduceSummarize([lines[i] for i in pending], batchSize, summaryChunkTokens, summaryMaxDepth)
+    else:
+        sums = summarizeTexts([texts[i][:1023] for i in pending], batchSize)
+
+    for i, sum in zip(pending, sums):
+        summaries[i] = sum
+        if useCache and sum is not None:
+            summaryCache.put(keys[i], sum)
+
+    return [(summaries[i], messagesCluster[i][0]) for i in range(len(texts)) if summaries[i] is not None]
+
+
+@printExceptions
+async def sendSummarises(bot: discord.Client,
+                         messagesToEdit: list[discord.Message],
+                         listSummarise: list[tuple[str, discord.Message]]
+                         ) -> None:
+    """
+    Send the summarises once, for every tldr command asking for them
     :param bot: discord.Client
-    :param messageToEdit: discord.Message
+    :param messagesToEdit: list of discord.Message, the "Summarizing..." message of every command
     :param listSummarise: list of tuple of str and discord.Message
     :return: None
     """
 
     try:
-        channel = messageToEdit.channel
+        channel = messagesToEdit[0].channel
         if channel is None:
             return
-        messageRef = messageToEdit.reference
-        if messageRef is None:
-            return
 
-        message = messageRef.resolved
-        if message is None:
+        mentions = []
+        for messageToEdit in messagesToEdit:
+            messageRef = messageToEdit.reference
+            if messageRef is None or messageRef.resolved is None:
+                continue
+            mention = messageRef.resolved.author.mention
+            if mention not in mentions:
+                mentions.append(mention)
+            # delete message to edit
+            await messageToEdit.delete()
+        if not mentions:
             return
-        # delete message to edit
-        asyncio.run_coroutine_threadsafe(messageToEdit.delete(), bot.loop)
 
-        # Send a message tagging the message.author to notify them
-        asyncio.run_coroutine_threadsafe(channel.send(message.author.mention + ' your TL;DR(s):'), bot.loop).result()
+        # Send a message tagging the authors of the commands to notify them
+        await channel.send(" ".join(mentions) + ' your TL;DR(s):')
 
         # send summarises
         for i in range(len(listSummarise)):
@@ -632,7 +1063,7 @@ def sendSummarises(bot: discord.Client,
             msgtoReply = listSummarise[i][1]
             if len(sum) > 2000:
                 sum = sum[:2000]
-            asyncio.run_coroutine_threadsafe(msgtoReply.reply(sum, mention_author=False), bot.loop)
+            await msgtoReply.reply(sum, mention_author=False)
 
     except Exception as e:
         print(e)
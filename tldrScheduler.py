@@ -0,0 +1,163 @@
+import asyncio
+from collections import deque
+
+import discord
+
+import tldr
+from utils import printExceptions
+
+
+# •============•
+#    TLDR JOB
+# •============•
+
+class TldrJob:
+    """
+    A summary asked by one or several tldr commands
+    :key: (channel id, target message id, position, quantity), the commands with the same key share the job
+    :message: the message to summarize
+    :quantity: the quantity parameter of the command
+    :position: the position parameter of the command
+    :timeGap: the time gap of the guild in minutes
+    :messagesToEdit: the "Summarizing..." message of every command waiting for the job
+    :shownPositions: links the id of every message to edit to the queue position it shows
+    """
+
+    def __init__(self, key: tuple, message: discord.Message, quantity: str, position: str, timeGap: int):
+        """
+        Constructor
+        :param key: the key of the job
+        :param message: the message to summarize
+        :param quantity: the quantity parameter of the command
+        :param position: the position parameter of the command
+        :param timeGap: the time gap of the guild in minutes
+        """
+        self.key = key
+        self.message = message
+        self.quantity = quantity
+        self.position = position
+        self.timeGap = timeGap
+        self.messagesToEdit: list[discord.Message] = []
+        self.shownPositions: dict[int, int] = {}
+
+
+# •==================•
+#    TLDR SCHEDULER
+# •==================•
+
+class TldrScheduler:
+    """
+    Runs the tldr commands on the bot's loop with a bounded number of parallel pipelines
+    The commands asking for the same summary while it is queued or running share one computation, the queued
+    commands show their position in the queue in their "Summarizing..." message
+    :bot: the bot
+    :workers: the maximum number of pipelines running at the same time
+    :jobs: links the key of every queued or running job to the job
+    :queue: the jobs waiting for a worker, in order
+    :running: the number of running jobs
+    :tasks: the running asyncio tasks, kept so that they are not garbage collected
+    """
+
+    def __init__(self, bot: discord.Client, workers: int = 2):
+        """
+        Constructor
+        :param bot: the bot
+        :param workers: the maximum number of pipelines running at the same time
+        """
+        self.bot = bot
+        self.workers = workers
+        self.jobs: dict[tuple, TldrJob] = {}
+        self.queue: deque[TldrJob] = deque()
+        self.running = 0
+        self.tasks: set[asyncio.Task] = set()
+
+    @staticmethod
+    def key(message: discord.Message, quantity: str, position: str) -> tuple:
+        """
+        Computes the key of a summary
+        :param message: the message to summarize
+        :param quantity: the quantity parameter of the command
+        :param position: the position parameter of the command
+        :return: the key
+        """
+        return message.channel.id, message.id, position, quantity
+
+    def submit(self, message: discord.Message, messageToEdit: discord.Message, quantity: str = "one",
+               position: str = "around", timeGap: int = 5) -> TldrJob:
+        """
+        Asks for a summary, joins the queued or running job asking for the same summary if there is one
+        :param message: the message to summarize
+        :param messageToEdit: the "Summarizing..." message of the command
+        :param quantity: the quantity parameter of the command
+        :param position: the position parameter of the command
+        :param timeGap: the time gap of the guild in minutes
+        :return: the job
+        """
+        key = self.key(message, quantity, position)
+        job = self.jobs.get(key)
+        if job is None:
+            job = TldrJob(key, message, quantity, position, timeGap)
+            self.jobs[key] = job
+            self.queue.append(job)
+        job.messagesToEdit.append(messageToEdit)
+        self.dispatch()
+        return job
+
+    def dispatch(self) -> None:
+        """
+        Starts the queued jobs while workers are free and updates the queue positions shown
+        :return: None
+        """
+        while self.running < self.workers and self.queue:
+            job = self.queue.popleft()
+            self.running += 1
+            self.spawn(self.run(job))
+            for messageToEdit in job.messagesToEdit:
+                if job.shownPositions.pop(messageToEdit.id, None) is not None:
+                    self.spawn(self.showPosition(messageToEdit, 0))
+
+        for position, job in enumerate(self.queue, start=1):
+            for messageToEdit in job.messagesToEdit:
+                if job.shownPositions.get(messageToEdit.id) != position:
+                    job.shownPositions[messageToEdit.id] = position
+                    self.spawn(self.showPosition(messageToEdit, position))
+
+    def spawn(self, coroutine) -> None:
+        """
+        Runs a coroutine as a task of the bot's loop
+        :param coroutine: the coroutine
+        :return: None
+        """
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    @printExceptions
+    async def showPosition(self, messageToEdit: discord.Message, position: int) -> None:
+        """
+        Shows the position of a command in the queue
+        :param messageToEdit: the "Summarizing..." message of the command
+        :param position: the position in the queue, 0 once the job runs
+        :return: None
+        """
+        if position == 0:
+            await messageToEdit.edit(content="Summarizing...")
+        else:
+            await messageToEdit.edit(content=f"Summarizing... (position {position} in the queue)")
+
+    @printExceptions
+    async def run(self, job: TldrJob) -> None:
+        """
+        Computes a summary and sends it for every command waiting for it
+        :param job: the job
+        :return: None
+        """
+        try:
+            # Commands arriving while the pipeline runs still join the job, they are read once it is done
+            summarises = await tldr.computeTldr(self.bot, job.message, job.quantity, job.position, job.timeGap)
+            del self.jobs[job.key]
+            await tldr.sendSummarises(self.bot, job.messagesToEdit, summarises or [])
+        finally:
+            self.jobs.pop(job.key, None)
+            self.running -= 1
+            self.dispatch()
@@ -0,0 +1,181 @@
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from typing import Callable
+
+from modelRegistry import residentMemory
+
+
+def modelSize(model) -> int:
+    """
+    Computes the memory taken by the weights of a model
+    :param model: the model
+    :return: the size in bytes, 0 if the model has no parameters
+    """
+    try:
+        return sum(parameter.numel() * parameter.element_size() for parameter in model.parameters())
+    except (AttributeError, TypeError):
+        return 0
+
+
+# •====================•
+#    TRANSLATION POOL
+# •====================•
+
+class TranslationPool:
+    """
+    Pool of the translation models of the language pairs seen recently, bounded by a memory budget
+    A pair that is not resident is loaded in a background thread, the texts asking for it meanwhile are not translated
+    (unless the caller waits), and the least recently used pairs are unloaded when the budget is exceeded
+    :budget: the memory the models may take, in bytes
+    :loader: the function loading the (model, tokenizer) of a pair
+    :sizeOf: the function computing the memory taken by a model
+    :models: links every resident pair to its (model, tokenizer), from the least to the most recently used
+    :sizes: links every resident pair to the memory taken by its model
+    :loading: links every pair being loaded to the event set once it is loaded
+    :stats: links every pair seen to its hits, misses (texts passed through untranslated), loads and evictions
+    """
+
+    def __init__(self, budget: int, loader: Callable[[str, str], tuple], sizeOf: Callable[[object], int] = modelSize):
+        """
+        Constructor
+        :param budget: the memory the models may take, in bytes
+        :param loader: the function loading the (model, tokenizer) of a pair
+        :param sizeOf: the function computing the memory taken by a model
+        """
+        self.budget = budget
+        self.loader = loader
+        self.sizeOf = sizeOf
+        self.models: OrderedDict[tuple[str, str], tuple] = OrderedDict()
+        self.sizes: dict[tuple[str, str], int] = {}
+        self.loading: dict[tuple[str, str], threading.Event] = {}
+        self.stats: dict[tuple[str, str], dict[str, int]] = {}
+        self.lock = threading.Lock()
+
+    def pairStats(self, pair: tuple[str, str]) -> dict[str, int]:
+        """
+        Gets the counters of a pair, the lock must be held
+        :param pair: the (source, target) languages
+        :return: the counters
+        """
+        if pair not in self.stats:
+            self.stats[pair] = {"hits": 0, "misses": 0, "loads": 0, "evictions": 0}
+        return self.stats[pair]
+
+    def get(self, src: str, trg: str, wait: bool = True) -> tuple | None:
+        """
+        Gets the model and tokenizer of a pair, starting its load if it is not resident
+        :param src: the source language
+        :param trg: the target language
+        :param wait: True to wait for the load, False to return None while the pair loads in the background
+        :return: the (model, tokenizer), None if the pair is not resident and wait is False
+        """
+        pair = (src, trg)
+        with self.lock:
+            if pair in self.models:
+                self.models.move_to_end(pair)
+                self.pairStats(pair)["hits"] += 1
+                return self.models[pair]
+            if not wait:
+                self.pairStats(pair)["misses"] += 1
+            event = self.loading.get(pair)
+            if event is None:
+                event = threading.Event()
+                self.loading[pair] = event
+                threading.Thread(target=self.load, args=(pair, event), daemon=True,
+                                 name=f"translation-{src}-{trg}").start()
+        if not wait:
+            return None
+
+        event.wait()
+        with self.lock:
+            if pair not in self.models:
+                raise RuntimeError(f"The translation model {src}-{trg} could not be loaded")
+            self.models.move_to_end(pair)
+            self.pairStats(pair)["hits"] += 1
+            return self.models[pair]
+
+    def load(self, pair: tuple[str, str], event: threading.Event) -> None:
+        """
+        Loads a pair and evicts the least recently used pairs until the budget is met, runs in its own thread
+        :param pair: the (source, target) languages
+        :param event: the event set once the pair is loaded
+        :return: None
+        """
+        try:
+            memory = residentMemory()
+            start = time.perf_counter()
+            model = self.loader(*pair)
+            size = self.sizeOf(model[0]) or max(residentMemory() - memory, 0)
+            print(f"Loaded the translation model {pair[0]}-{pair[1]} in {time.perf_counter() - start:.1f}s "
+                  f"({size / 2 ** 20:.0f} MiB)")
+            with self.lock:
+                self.models[pair] = model
+                self.sizes[pair] = size
+                self.pairStats(pair)["loads"] += 1
+                self.evict(keep=pair)
+        except:
+            traceback.print_exc()
+        finally:
+            with self.lock:
+                self.loading.pop(pair, None)
+            event.set()
+
+    def evict(self, keep: tuple[str, str] | None = None) -> None:
+        """
+        Unloads the least recently used pairs until the models fit the budget, the lock must be held
+        :param keep: a pair never evicted, the one just loaded
+        :return: None
+        """
+        for pair in list(self.models):
+            if sum(self.sizes.values()) <= self.budget:
+                break
+            if pair == keep:
+                continue
+            del self.models[pair]
+            del self.sizes[pair]
+            self.pairStats(pair)["evictions"] += 1
+            print(f"Unloaded the translation model {pair[0]}-{pair[1]}")
+
+    def set(self, src: str, trg: str, model: tuple | None, size: int = 0) -> tuple | None:
+        """
+        Replaces the model of a pair, used by the tests and benchmarks to plug in another model
+        :param src: the source language
+        :param trg: the target language
+        :param model: the new (model, tokenizer), None to unload the pair
+        :param size: the memory taken by the new model
+        :return: the previous (model, tokenizer), None if it was not resident
+        """
+        pair = (src, trg)
+        with self.lock:
+            previous = self.models.pop(pair, None)
+            self.sizes.pop(pair, None)
+            if model is not None:
+                self.models[pair] = model
+                self.sizes[pair] = size
+            return previous
+
+    def isResident(self, src: str, trg: str) -> bool:
+        """
+        Checks if the model of a pair is loaded
+        :param src: the source language
+        :param trg: the target language
+        :return: True if the pair is resident
+        """
+        return (src, trg) in self.models
+
+    def report(self) -> dict:
+        """
+        Gets the state of every pair seen
+        :return: a dict linking "src-trg" to whether the pair is resident, its size, hit rate and counters
+        """
+        with self.lock:
+            report = {}
+            for (src, trg), stats in self.stats.items():
+                requests = stats["hits"] + stats["misses"]
+                report[f"{src}-{trg}"] = {"resident": (src, trg) in self.models,
+                                          "memory": self.sizes.get((src, trg), 0),
+                                          "hitRate": stats["hits"] / requests if requests else 0.0,
+                                          **stats}
+            return report
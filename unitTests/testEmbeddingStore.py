@@ -0,0 +1,122 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from embeddingStore import EmbeddingStore
+
+
+class CountingEncoder:
+    """
+    Encoder giving a deterministic embedding per text and counting the texts it embedded
+    """
+
+    def __init__(self):
+        self.encoded = []
+
+    def __call__(self, texts):
+        self.encoded += texts
+        return np.array([np.full(4, len(text), dtype=np.float32) for text in texts])
+
+
+class TestEmbeddingStore(unittest.TestCase):
+    """
+    Tests the embedding store
+    """
+
+    def test_onlyMissingEncoded(self):
+        """
+        Tests that the messages already in the store are not encoded again
+        """
+        store = EmbeddingStore(4, capacity=10)
+        encoder = CountingEncoder()
+        first = store.getEmbeddings([1, 2], ["a", "bb"], encoder)
+        second = store.getEmbeddings([1, 2, 3], ["a", "bb", "ccc"], encoder)
+        self.assertEqual(encoder.encoded, ["a", "bb", "ccc"])
+        np.testing.assert_array_equal(first, second[:2])
+        self.assertEqual((store.hits, store.misses), (2, 3))
+
+    def test_editInvalidates(self):
+        """
+        Tests that an edited message is embedded again and replaces its old embedding
+        """
+        store = EmbeddingStore(4, capacity=10)
+        encoder = CountingEncoder()
+        store.getEmbeddings([1], ["a"], encoder)
+        edited = store.getEmbeddings([1], ["edited"], encoder)
+        self.assertEqual(encoder.encoded, ["a", "edited"])
+        self.assertEqual(edited[0][0], len("edited"))
+        self.assertEqual(len(store), 1)
+        self.assertIsNone(store.get(1, "a"))
+
+    def test_lruEviction(self):
+        """
+        Tests that the least recently used embeddings are evicted first
+        """
+        store = EmbeddingStore(4, capacity=2)
+        encoder = CountingEncoder()
+        store.getEmbeddings([1, 2], ["a", "b"], encoder)
+        store.get(1, "a")  # 2 becomes the least recently used
+        store.getEmbeddings([3], ["c"], encoder)
+        self.assertIsNotNone(store.get(1, "a"))
+        self.assertIsNone(store.get(2, "b"))
+        self.assertIsNotNone(store.get(3, "c"))
+
+    def test_half(self):
+        """
+        Tests that float16 stores return float32 embeddings rounded the same way on every call
+        """
+        store = EmbeddingStore(4, capacity=2, half=True)
+        encoder = lambda texts: np.full((len(texts), 4), 1 / 3, dtype=np.float32)
+        first = store.getEmbeddings([1], ["a"], encoder)
+        second = store.getEmbeddings([1], ["a"], encoder)
+        self.assertEqual(first.dtype, np.float32)
+        np.testing.assert_array_equal(first, second)
+        self.assertEqual(store.vectors.dtype, np.float16)
+
+    def test_diskBacking(self):
+        """
+        Tests that a saved store is reloaded from its memory-mapped file
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "embeddings")
+            store = EmbeddingStore(4, capacity=3, path=path)
+            store.getEmbeddings([1, 2], ["a", "bb"], CountingEncoder())
+            store.save()
+
+            encoder = CountingEncoder()
+            reloaded = EmbeddingStore(4, capacity=3, path=path)
+            embeddings = reloaded.getEmbeddings([1, 2], ["a", "bb"], encoder)
+            self.assertEqual(encoder.encoded, [])
+            np.testing.assert_array_equal(embeddings[:, 0], [1, 2])
+
+            # A store with different settings starts empty
+            resized = EmbeddingStore(4, capacity=5, path=path)
+            self.assertEqual(len(resized), 0)
+            del store, reloaded, resized
+
+    def test_staleIndex(self):
+        """
+        Tests that the rows reused after the last save (a crash before the next save) are not served for their old key
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "embeddings")
+            store = EmbeddingStore(4, capacity=2, path=path)
+            store.getEmbeddings([1, 2], ["a", "bb"], CountingEncoder())
+            store.save()
+            # Evicts 1 and reuses its row, the index on disk still maps 1 to the row
+            store.getEmbeddings([3], ["cccc"], CountingEncoder())
+            store.vectors.flush()
+            store.fingerprints.flush()
+
+            encoder = CountingEncoder()
+            reloaded = EmbeddingStore(4, capacity=2, path=path)
+            embeddings = reloaded.getEmbeddings([1, 2], ["a", "bb"], encoder)
+            self.assertEqual(encoder.encoded, ["a"])
+            np.testing.assert_array_equal(embeddings[:, 0], [1, 2])
+            del store, reloaded
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from guildStore import GuildStore
+
+
+class StubGuildData:
+    """
+    Stands for a GuildData, counts its serializations
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.serializations = 0
+
+    def toDict(self):
+        self.serializations += 1
+        return {"prefix": self.prefix}
+
+
+class TestGuildStore(unittest.TestCase):
+    """
+    Tests the write-behind persistence of the guilds' data
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "guilds.json")
+        self.guildsDict = {1: StubGuildData("!"), 2: StubGuildData("?")}
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def read(self):
+        with open(self.path, 'r') as f:
+            return f.read()
+
+    def test_coalescing(self):
+        """
+        Tests that the requests made during the delay are written once, and that every write serializes all the guilds
+        """
+        store = GuildStore(self.path, 0.2, lambda: set(self.guildsDict), lambda: self.guildsDict)
+        for _ in range(10):
+            store.request()
+        self.assertFalse(os.path.exists(self.path))
+        time.sleep(0.5)
+        self.assertEqual(store.writes, 1)
+        self.assertEqual(json.loads(self.read()), {"guildsId": [1, 2], "guildsDict": {"1": {"prefix": "!"},
+                                                                                     "2": {"prefix": "?"}}})
+        self.assertNotIn(" ", self.read())
+
+        self.guildsDict[2].prefix = "$"
+        store.request()
+        store.flush()
+        self.assertEqual(store.writes, 2)
+        self.assertEqual((self.guildsDict[1].serializations, self.guildsDict[2].serializations), (2, 2))
+        self.assertEqual(json.loads(self.read())["guildsDict"]["2"], {"prefix": "$"})
+
+    def test_removedGuild(self):
+        """
+        Tests that the record of a guild the bot left is removed and that a flush without a request writes nothing
+        """
+        store = GuildStore(self.path, 60, lambda: set(self.guildsDict), lambda: self.guildsDict)
+        store.request()
+        store.flush()
+        del self.guildsDict[1]
+        store.request()
+        store.flush()
+        store.flush()
+        self.assertEqual(store.writes, 2)
+        self.assertEqual(json.loads(self.read()), {"guildsId": [2], "guildsDict": {"2": {"prefix": "?"}}})
+        self.assertFalse(os.path.exists(self.path + ".tmp"))
+
+    def test_unsavedChange(self):
+        """
+        Tests that a change made without its own save is written by the next write
+        """
+        store = GuildStore(self.path, 0.2, lambda: set(self.guildsDict), lambda: self.guildsDict)
+        store.request()
+        store.flush()
+        self.guildsDict[1].prefix = "%"  # No save after this change
+        self.guildsDict[2].prefix = "$"
+        store.request()
+        time.sleep(0.5)
+        self.assertEqual(store.writes, 2)
+        self.assertEqual(json.loads(self.read())["guildsDict"], {"1": {"prefix": "%"}, "2": {"prefix": "$"}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import asyncio
+import threading
+import unittest
+
+from inferenceService import InferenceService
+
+
+class TestInferenceService(unittest.TestCase):
+    """
+    Tests the micro-batching of the inference service
+    """
+
+    def test_microBatching(self):
+        """
+        Tests that the requests submitted within the batching window run in one batch
+        """
+        batches = []
+        service = InferenceService(window=0.2, maxBatch=8)
+        service.register("length", lambda texts: batches.append(texts) or [len(text) for text in texts])
+        futures = [service.submit("length", "a" * i) for i in range(5)]
+        self.assertEqual([future.result(timeout=5) for future in futures], [0, 1, 2, 3, 4])
+        self.assertEqual(len(batches), 1)
+        report = service.report()["length"]
+        self.assertEqual((report["requests"], report["batches"], report["maxQueueDepth"]), (5, 1, 5))
+        self.assertEqual(report["meanBatch"], 5)
+
+    def test_maxBatch(self):
+        """
+        Tests that a full batch does not wait for the window and that batches are bounded
+        """
+        service = InferenceService(window=60, maxBatch=2)
+        service.register("double", lambda items: [item * 2 for item in items])
+        self.assertEqual(service.inferMany("double", [1, 2, 3, 4]), [2, 4, 6, 8])
+        self.assertEqual(service.report()["double"]["maxBatch"], 2)
+
+    def test_failure(self):
+        """
+        Tests that a bad input only fails its own request
+        """
+        service = InferenceService(window=0.2)
+        service.register("inverse", lambda items: [1 / item for item in items])
+        futures = [service.submit("inverse", item) for item in (1, 0, 4)]
+        self.assertEqual(futures[0].result(timeout=5), 1)
+        self.assertRaises(ZeroDivisionError, futures[1].result, 5)
+        self.assertEqual(futures[2].result(timeout=5), 0.25)
+
+    def test_threads(self):
+        """
+        Tests that the requests of several threads are batched together
+        """
+        service = InferenceService(window=0.2)
+        service.register("upper", lambda texts: [text.upper() for text in texts])
+        results = {}
+        threads = [threading.Thread(target=lambda i=i: results.update({i: service.infer("upper", f"t{i}")}))
+                   for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, {i: f"T{i}" for i in range(4)})
+        self.assertEqual(service.report()["upper"]["batches"], 1)
+
+
+    def test_missingOutputs(self):
+        """
+        Tests that a model returning fewer outputs than inputs fails the requests instead of leaving them waiting
+        """
+        service = InferenceService(window=0.2)
+        service.register("short", lambda items: items[:1] if len(items) > 1 else [])
+        futures = [service.submit("short", item) for item in range(3)]
+        for future in futures:
+            self.assertRaises(ValueError, future.result, 5)
+
+    def test_async(self):
+        """
+        Tests that the coroutines awaiting the service at the same time are batched together
+        """
+        service = InferenceService(window=0.2)
+        service.register("upper", lambda texts: [text.upper() for text in texts])
+
+        async def consumers():
+            return await asyncio.gather(*(service.inferAsync("upper", f"t{i}") for i in range(4)))
+
+        self.assertEqual(asyncio.run(consumers()), [f"T{i}" for i in range(4)])
+        self.assertEqual(service.report()["upper"]["batches"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import json
+import os
+import tempfile
+import unittest
+
+from infractionStore import InfractionStore
+
+
+class TestInfractionStore(unittest.TestCase):
+    """
+    Tests the SQLite infraction store
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "infractions.sqlite3")
+        self.legacyPath = os.path.join(self.directory.name, "userInfo.json")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_addAndRead(self):
+        """
+        Tests that the infractions are grouped by guild and type like the legacy file
+        """
+        store = InfractionStore(self.path)
+        store.add(1, 10, "tag", "Banned word detected")
+        store.add(1, 10, "kicks", "spam")
+        store.add(1, 20, "ban", "raid")
+        store.add(2, 10, "tag", "Banned word detected")
+        infractions = store.infractions(1, 10)
+        self.assertEqual(set(infractions), {"tag", "kicks"})
+        self.assertIn("spam", infractions["kicks"])
+        self.assertEqual([set(guild) for guild in store.infractionsEverywhere(1)], [{"tag", "kicks"}, {"ban"}])
+        self.assertEqual(store.infractions(3, 10), {})
+        store.close()
+
+    def test_migration(self):
+        """
+        Tests that the legacy JSON file is imported once
+        """
+        with open(self.legacyPath, 'w') as f:
+            json.dump({"10": {"1": {"muted": {"muted by mod": "01/01/2024 10:00:00"}}}}, f)
+        for _ in range(2):
+            store = InfractionStore(self.path, self.legacyPath)
+            self.assertEqual(store.infractions(1, 10), {"muted": {"muted by mod": "01/01/2024 10:00:00"}})
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
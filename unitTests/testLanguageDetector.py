@@ -0,0 +1,58 @@
+import unittest
+
+from languageDetector import LanguageDetector
+
+
+class TestLanguageDetector(unittest.TestCase):
+    """
+    Tests the tiered language detection
+    """
+
+    def setUp(self):
+        self.modelCalls = []
+
+    def model(self, texts):
+        self.modelCalls.append(texts)
+        return ["de"] * len(texts)
+
+    def test_cheapTiers(self):
+        """
+        Tests that the texts a cheap tier can decide never reach the model
+        """
+        detector = LanguageDetector()
+        texts = ["😂😂 https://example.com/page", "こんにちは", "what is this thing", "je ne sais pas", "Ich weiß nicht",
+                 "ok cool"]
+        self.assertEqual(detector.detectMany(texts, None, self.model), ["en", "ja", "en", "fr", "de", "de"])
+        self.assertEqual(self.modelCalls, [["ok cool"]])
+        report = detector.report()
+        self.assertEqual(report["texts"], 6)
+        self.assertAlmostEqual(report["model"], 1 / 6)
+        self.assertAlmostEqual(report["saved"], 5 / 6)
+
+    def test_otherLatinLanguages(self):
+        """
+        Tests that Spanish, Italian and Portuguese texts sharing stopwords and accents with French are not labelled
+        French: they are decided by their own stopwords or given to the model
+        """
+        detector = LanguageDetector()
+        texts = ["que la vida es bella", "la casa de mi madre es un sueño", "non è la mia macchina, è un regalo",
+                 "eu acho que a casa é la"]
+        languages = detector.detectMany(texts, None, self.model)
+        self.assertNotIn("fr", languages)
+        self.assertEqual(languages[2:], ["it", "pt"])
+        self.assertEqual(self.modelCalls, [texts[:2]])
+
+    def test_prior(self):
+        """
+        Tests that an author writing in one language gets it for ambiguous texts, unless the text contradicts it
+        """
+        detector = LanguageDetector(priorMinMessages=3)
+        detector.detectMany(["je ne sais pas"] * 3, [1] * 3, self.model)
+        self.assertEqual(detector.detectMany(["bonjour", "ok", "what is it"], [1, 2, 1], self.model),
+                         ["fr", "de", "en"])
+        self.assertEqual(self.modelCalls, [["ok"]])
+        self.assertEqual(detector.counts["prior"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+import asyncio
+import threading
+import unittest
+from types import SimpleNamespace
+
+import messageAnalysis
+from messageAnalysis import AnalysisCache, AnalysisPipeline
+
+
+class StubMessage:
+    """
+    Stands for a discord.Message, its clean content is its content and its author is unknown to the language prior
+    """
+
+    def __init__(self, id, content):
+        """
+        Constructor
+        :param id: the id of the message
+        :param content: the content of the message
+        """
+        self.id = id
+        self.content = content
+        self.author = SimpleNamespace(id=None)
+
+    @property
+    def clean_content(self):
+        """
+        Gets the content of the message
+        :return: the content
+        """
+        return self.content
+
+
+class TestMessageAnalysis(unittest.TestCase):
+    """
+    Tests the shared analysis of the messages
+    """
+
+    def setUp(self):
+        self.calls = []
+        self.loading = False
+        self.getLanguages, self.toEnglishMany = messageAnalysis.getLanguages, messageAnalysis.toEnglishMany
+
+        def getLanguages(texts):
+            self.calls.append(("languages", texts))
+            return ["fr" if text.startswith("bonjour") else "en" for text in texts]
+
+        def toEnglishMany(texts, languages, wait=True):
+            self.calls.append(("translate", texts))
+            if not wait and self.loading:
+                return [None if language == "fr" else text for text, language in zip(texts, languages)]
+            return [text.replace("bonjour", "hello") if language == "fr" else text
+                    for text, language in zip(texts, languages)]
+
+        messageAnalysis.getLanguages, messageAnalysis.toEnglishMany = getLanguages, toEnglishMany
+
+    def tearDown(self):
+        messageAnalysis.getLanguages, messageAnalysis.toEnglishMany = self.getLanguages, self.toEnglishMany
+
+    def test_translatedOnce(self):
+        """
+        Tests that a message is analysed once, even after its content was replaced by its translation
+        """
+        cache = AnalysisCache()
+        message = StubMessage(1, "bonjour tout le monde")
+        self.assertEqual(cache.english(message), "hello tout le monde")
+        cache.rewrite(message, cache.english(message))
+        cache.rewrite(message, "hello tout le monde!")
+        self.assertEqual(cache.english(message), "hello tout le monde")
+        self.assertEqual(cache.english(StubMessage(1, "bonjour tout le monde")), "hello tout le monde")
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(cache.analyse(message).language, "fr")
+
+    def test_edit(self):
+        """
+        Tests that an edited message is analysed again
+        """
+        cache = AnalysisCache()
+        cache.english(StubMessage(1, "bonjour"))
+        self.assertEqual(cache.english(StubMessage(1, "good morning")), "good morning")
+        self.assertEqual(len(self.calls), 4)
+        self.assertEqual(len(cache.records), 1)
+
+    def test_outputs(self):
+        """
+        Tests that the output of a model is computed once per version of a message
+        """
+        cache = AnalysisCache()
+        outputs = []
+        compute = lambda text: outputs.append(text) or len(text)
+        message = StubMessage(1, "hello")
+        self.assertEqual(cache.output(message, "length", compute), 5)
+        self.assertEqual(cache.output(message, "length", compute), 5)
+        self.assertEqual(outputs, ["hello"])
+
+    def test_analyseMany(self):
+        """
+        Tests that the languages of the messages missing from the cache are detected in one call
+        """
+        cache = AnalysisCache()
+        cache.english(StubMessage(1, "hello"))
+        messages = [StubMessage(1, "hello"), StubMessage(2, "bonjour"), StubMessage(3, "hi")]
+        records = cache.analyseMany(messages)
+        self.assertEqual([record.language for record in records], ["en", "fr", "en"])
+        self.assertEqual([call for call in self.calls if call[0] == "languages"],
+                         [("languages", ["hello"]), ("languages", ["bonjour", "hi"])])
+
+    def test_pending(self):
+        """
+        Tests that a message left untranslated while the translation model loads is translated on its next use,
+        without detecting its language again
+        """
+        cache = AnalysisCache()
+        message = StubMessage(1, "bonjour")
+        self.loading = True
+        self.assertEqual(cache.english(message), "bonjour")
+        self.loading = False
+        self.assertEqual(cache.english(message), "hello")
+        self.assertEqual(cache.english(message), "hello")
+        self.assertEqual([call[0] for call in self.calls], ["languages", "translate", "translate"])
+
+    def test_eviction(self):
+        """
+        Tests that the cache is bounded
+        """
+        cache = AnalysisCache(capacity=2)
+        for id in range(3):
+            cache.english(StubMessage(id, "hello"))
+        self.assertEqual(list(cache.records), [1, 2])
+
+    def test_pipeline(self):
+        """
+        Tests that the consumers of a message share its analysis, run off the awaiting loop
+        """
+        pipeline = AnalysisPipeline(AnalysisCache())
+        release = threading.Event()
+        getLanguages = messageAnalysis.getLanguages
+        messageAnalysis.getLanguages = lambda texts: release.wait() and getLanguages(texts)
+        message = StubMessage(1, "bonjour")
+
+        async def consumers():
+            tasks = [asyncio.create_task(pipeline.english(message)) for _ in range(3)]
+            await asyncio.sleep(0.05)
+            self.assertFalse(any(task.done() for task in tasks))  # The loop kept running during the analysis
+            release.set()
+            return await asyncio.gather(*tasks)
+
+        self.assertEqual(asyncio.run(consumers()), ["hello"] * 3)
+        self.assertEqual([call[0] for call in self.calls], ["languages", "translate"])
+        self.assertEqual(pipeline.pending, {})
+
+
+    def test_pipelineBatches(self):
+        """
+        Tests that the messages sent while a batch is analysed are analysed together in the next batch
+        """
+        pipeline = AnalysisPipeline(AnalysisCache())
+        release = threading.Event()
+        getLanguages = messageAnalysis.getLanguages
+        messageAnalysis.getLanguages = lambda texts: release.wait() and getLanguages(texts)
+        messages = [StubMessage(id, f"bonjour {id}") for id in range(5)]
+
+        async def consumers():
+            tasks = [asyncio.create_task(pipeline.english(message)) for message in messages[:1]]
+            await asyncio.sleep(0.05)  # The first message is being analysed
+            tasks += [asyncio.create_task(pipeline.english(message)) for message in messages[1:]]
+            await asyncio.sleep(0.05)
+            release.set()
+            return await asyncio.gather(*tasks)
+
+        self.assertEqual(asyncio.run(consumers()), [f"hello {id}" for id in range(5)])
+        self.assertEqual([texts for name, texts in self.calls if name == "languages"],
+                         [["bonjour 0"], [f"bonjour {id}" for id in range(1, 5)]])
+        self.assertEqual((pipeline.pending, pipeline.running), ({}, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
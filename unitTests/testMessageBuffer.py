@@ -0,0 +1,84 @@
+import unittest
+from types import SimpleNamespace
+
+from messageBuffer import MessageBuffer
+
+
+def stubMessage(id, channelId=1, content=""):
+    """
+    Builds a message
+    :param id: the id of the message
+    :param channelId: the id of the channel of the message
+    :param content: the content of the message
+    :return: the message
+    """
+    return SimpleNamespace(id=id, channel=SimpleNamespace(id=channelId), content=content)
+
+
+class TestMessageBuffer(unittest.TestCase):
+    """
+    Tests the per-channel message buffer
+    """
+
+    def test_beforeAfter(self):
+        """
+        Tests that the messages around a message are read in the right order
+        """
+        buffer = MessageBuffer()
+        for id in range(1, 6):
+            buffer.add(stubMessage(id))
+        messages, coverageStart = buffer.before(1, 4, 10)
+        self.assertEqual([m.id for m in messages], [3, 2, 1])
+        self.assertEqual(coverageStart, 1)
+        self.assertEqual([m.id for m in buffer.after(1, 2, 10)], [3, 4, 5])
+        self.assertEqual([m.id for m in buffer.after(1, 2, 2)], [3, 4])
+        self.assertEqual(buffer.before(2, 4, 10), ([], None))
+
+    def test_eviction(self):
+        """
+        Tests that the buffer is bounded and only covers the messages it still holds
+        """
+        buffer = MessageBuffer(size=3)
+        for id in range(1, 6):
+            buffer.add(stubMessage(id))
+        self.assertFalse(buffer.covers(1, 2))
+        self.assertTrue(buffer.covers(1, 3))
+        messages, coverageStart = buffer.before(1, 5, 10)
+        self.assertEqual([m.id for m in messages], [4, 3])
+        self.assertEqual(coverageStart, 3)
+        self.assertEqual(buffer.before(1, 2, 10), ([], None))
+
+    def test_editDelete(self):
+        """
+        Tests that edited messages are replaced, deleted messages removed, and edits of unknown messages ignored
+        """
+        buffer = MessageBuffer(size=3)
+        for id in range(1, 4):
+            buffer.add(stubMessage(id))
+        buffer.add(stubMessage(2, content="edited"), edited=True)
+        buffer.remove(1, 3)
+        buffer.add(stubMessage(5, content="edited"), edited=True)  # Never buffered (not consented when sent)
+        self.assertEqual([(m.id, m.content) for m in buffer.after(1, 0, 10)], [(1, ""), (2, "edited")])
+
+        # The deleted message no longer takes a place in the buffer
+        buffer.add(stubMessage(6))
+        self.assertEqual(list(buffer.order[1]), [1, 2, 6])
+        self.assertTrue(buffer.covers(1, 1))
+
+    def test_reset(self):
+        """
+        Tests that the buffer no longer covers anything after the gateway session is lost
+        """
+        buffer = MessageBuffer()
+        for id in range(1, 4):
+            buffer.add(stubMessage(id))
+        buffer.reset()
+        self.assertFalse(buffer.covers(1, 2))
+        self.assertEqual(buffer.before(1, 3, 10), ([], None))
+        buffer.add(stubMessage(10))
+        self.assertFalse(buffer.covers(1, 3))
+        self.assertTrue(buffer.covers(1, 10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+
+from modelRegistry import ModelRegistry
+
+
+class TestModelRegistry(unittest.TestCase):
+    """
+    Tests the model registry
+    """
+
+    def test_lazyLoading(self):
+        """
+        Tests that a model is only loaded on its first use, once
+        """
+        loads = []
+        registry = ModelRegistry()
+        registry.register("model", lambda: loads.append("model") or "loaded model")
+        self.assertFalse(registry.isLoaded("model"))
+        self.assertEqual(loads, [])
+
+        self.assertEqual(registry.get("model"), "loaded model")
+        self.assertEqual(registry.get("model"), "loaded model")
+        self.assertEqual(loads, ["model"])
+        report = registry.report()["model"]
+        self.assertTrue(report["loaded"])
+        self.assertGreaterEqual(report["loadTime"], 0)
+        self.assertGreaterEqual(report["memory"], 0)
+
+    def test_warmUp(self):
+        """
+        Tests that the warm-up list is loaded in the background and that unknown models are skipped
+        """
+        registry = ModelRegistry()
+        registry.register("a", lambda: "a")
+        registry.register("b", lambda: "b")
+        registry.warmUpInBackground(["a", "unknown"]).join()
+        self.assertTrue(registry.isLoaded("a"))
+        self.assertFalse(registry.isLoaded("b"))
+        registry.warmUp()
+        self.assertTrue(registry.isLoaded("b"))
+
+    def test_set(self):
+        """
+        Tests that a model can be replaced and restored
+        """
+        registry = ModelRegistry()
+        registry.register("model", lambda: "loaded model")
+        self.assertIsNone(registry.set("model", "stub"))
+        self.assertEqual(registry.get("model"), "stub")
+        self.assertEqual(registry.set("model", None), "stub")
+        self.assertEqual(registry.get("model"), "loaded model")
+
+
+if __name__ == '__main__':
+    unittest.main()
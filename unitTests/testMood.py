@@ -1,6 +1,9 @@
+import asyncio
 import unittest
+from types import SimpleNamespace
 
 import mood
+from inferenceService import InferenceService
 
 
 class TestMood(unittest.TestCase):
@@ -133,5 +136,56 @@ class TestMood(unittest.TestCase):
             self.assertEqual(test.read(), expected.read())
 
 
+    def test_refreshMoodsBatched(self):
+        """
+        Tests that the users of a guild are submitted to the emotion model together and that their messages are cleared
+        """
+        batches = []
+        service = InferenceService(window=0.2)
+        service.register("emotion", lambda texts: batches.append(texts) or
+                         [[{"label": "joy", "score": 0.9}, {"label": "neutral", "score": 0.1}] for _ in texts])
+        guildData = SimpleNamespace(userActive={1: True, 2: True, 3: True},
+                                    userMessages={1: ["a"], 2: ["b", "c"], 3: []},
+                                    moods={1: mood.Mood.HAPPY, 2: mood.Mood.HAPPY})
+        bot = SimpleNamespace(guildsDict={7: guildData})
+        inferenceService, mood.inferenceService = mood.inferenceService, service
+        try:
+            asyncio.run(mood.refreshMoods(bot, 7))
+        finally:
+            mood.inferenceService = inferenceService
+
+        self.assertEqual(batches, [["a", "b. c"]])
+        self.assertEqual(guildData.userMessages, {1: [], 2: [], 3: []})
+
+    def test_emotionsOfLongTexts(self):
+        """
+        Tests that the texts too long for the emotion model are split into sentences whose emotions are averaged, the
+        same way by the blocking and the asynchronous paths
+        """
+        texts = []
+
+        def emotions(batch):
+            texts.extend(batch)
+            if any(len(text) > 10 for text in batch):
+                raise ValueError("Too long")
+            return [[{"label": m.emotionName, "score": 1.0 if m.emotionName == "joy" and "yay" in text else 0.0}
+                     for m in mood.Mood] for text in batch]
+
+        service = InferenceService(window=0)
+        service.register("emotion", emotions)
+        inferenceService, mood.inferenceService = mood.inferenceService, service
+        try:
+            blocking = mood.getEmotions(["yay yay! meh meh."])
+            asynchronous = asyncio.run(mood.getEmotionsAsync(["yay yay! meh meh."]))
+            neutral = mood.getEmotions(["one very long sentence"])
+        finally:
+            mood.inferenceService = inferenceService
+
+        self.assertEqual(blocking, asynchronous)
+        self.assertEqual(blocking[3], {"label": "joy", "score": 0.5})
+        self.assertIn("yay yay!", texts)
+        self.assertEqual({emotion["label"]: emotion["score"] for emotion in neutral}["neutral"], 1)
+
+
 if __name__ == '__main__':
     unittest.main()
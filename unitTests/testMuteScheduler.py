@@ -0,0 +1,103 @@
+import asyncio
+import time
+import unittest
+from types import SimpleNamespace
+
+import mod
+import muteScheduler
+from muteScheduler import MuteScheduler
+
+
+class TestMuteScheduler(unittest.TestCase):
+    """
+    Tests the expiry heap of the mutes
+    """
+
+    def setUp(self):
+        self.unmuted = []
+        self.unmuteUser = mod.unmuteUser
+
+        self.failing = set()
+
+        async def unmuteUser(bot, guildId, userId):
+            if (guildId, userId) in self.failing:
+                self.failing.remove((guildId, userId))
+                return None
+            self.unmuted.append((guildId, userId))
+            del bot.guildsDict[guildId].muted_users[userId]
+            return True
+
+        mod.unmuteUser = unmuteUser
+
+    def tearDown(self):
+        mod.unmuteUser = self.unmuteUser
+
+    def test_legacyMinutes(self):
+        """
+        Tests that the remaining minutes saved by older versions are converted to timestamps
+        """
+        self.assertEqual(muteScheduler.expiryTimestamp(5, now=1000), 1300)
+        self.assertEqual(muteScheduler.expiryTimestamp(1.7e9, now=1000), 1.7e9)
+
+    def test_expiry(self):
+        """
+        Tests that the mutes due during downtime are lifted at startup, that the timer wakes up for an earlier mute,
+        and that lifted mutes are skipped
+        """
+        now = time.time()
+        guildData = SimpleNamespace(muted_users={1: [now - 60, []], 2: [now + 3600, []], 3: [now + 0.2, []]})
+        bot = SimpleNamespace(guildsDict={10: guildData})
+        scheduler = MuteScheduler(bot)
+
+        async def scenario():
+            scheduler.load()
+            scheduler.start(asyncio.get_running_loop())
+            await asyncio.sleep(0.05)
+            self.assertEqual(self.unmuted, [(10, 1)])  # Catch-up pass
+
+            guildData.muted_users[4] = [time.time() + 0.1, []]
+            scheduler.schedule(10, 4, guildData.muted_users[4][0])
+            del guildData.muted_users[3]  # Unmuted by hand
+            await asyncio.sleep(0.4)
+            self.assertEqual(self.unmuted, [(10, 1), (10, 4)])
+            self.assertEqual(scheduler.nextExpiry(), guildData.muted_users[2][0])
+
+        asyncio.run(scenario())
+
+    def test_retry(self):
+        """
+        Tests that a mute that failed to lift is kept and lifted by a later attempt
+        """
+        now = time.time()
+        guildData = SimpleNamespace(muted_users={1: [now - 60, []]})
+        bot = SimpleNamespace(guildsDict={10: guildData})
+        scheduler = MuteScheduler(bot, retryDelay=0.1)
+        self.failing.add((10, 1))
+
+        async def scenario():
+            scheduler.load()
+            scheduler.start(asyncio.get_running_loop())
+            await asyncio.sleep(0.05)
+            self.assertEqual(self.unmuted, [])
+            self.assertIn(1, guildData.muted_users)
+            self.assertEqual(scheduler.failures, {(10, 1): 1})
+            await asyncio.sleep(0.2)
+            self.assertEqual(self.unmuted, [(10, 1)])
+            self.assertEqual((scheduler.unmutes, scheduler.retries, scheduler.failures), (1, 1, {}))
+
+        asyncio.run(scenario())
+
+    def test_memberGone(self):
+        """
+        Tests that the mute of a user who left the guild is dropped
+        """
+        saved = []
+        guildData = SimpleNamespace(muted_users={1: [time.time() - 60, []]})
+        bot = SimpleNamespace(guildsDict={10: guildData}, save=lambda: saved.append(True),
+                              get_guild=lambda guildId: SimpleNamespace(get_member=lambda userId: None))
+        self.assertTrue(asyncio.run(self.unmuteUser(bot, 10, 1)))
+        self.assertEqual((guildData.muted_users, saved), ({}, [True]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import discord
+import numpy as np
+
+from segmenter import ChannelSegmenter, ConversationSegmenter
+
+START = datetime(2023, 5, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def stubMessage(id, minutes, repliedId=None, channelId=1):
+    """
+    Builds a message sent a number of minutes after START
+    :param id: the id of the message
+    :param minutes: the number of minutes after START
+    :param repliedId: the id of the replied message, None if the message is not a reply
+    :param channelId: the id of the channel of the message
+    :return: the message
+    """
+    if repliedId is None:
+        return SimpleNamespace(id=id, created_at=START + timedelta(minutes=minutes), type=discord.MessageType.default,
+                               reference=None, channel=SimpleNamespace(id=channelId))
+    return SimpleNamespace(id=id, created_at=START + timedelta(minutes=minutes), type=discord.MessageType.reply,
+                           reference=SimpleNamespace(message_id=repliedId), channel=SimpleNamespace(id=channelId))
+
+
+def topic(index):
+    """
+    Builds the embedding of a topic, topics are orthogonal to each other
+    :param index: the index of the topic
+    :return: the normalized embedding
+    """
+    embedding = np.zeros(4, dtype=np.float32)
+    embedding[index] = 1.
+    return embedding
+
+
+class TestSegmenter(unittest.TestCase):
+    """
+    Tests the live conversation segmenter
+    """
+
+    def threadIds(self, segmenter, messageId):
+        return [message.id for message in segmenter.thread(messageId)]
+
+    def test_similarMessagesJoin(self):
+        """
+        Tests that messages about the same topic join the same thread and other topics start a new one
+        """
+        segmenter = ChannelSegmenter()
+        segmenter.add(stubMessage(1, 0), topic(0), 5)
+        segmenter.add(stubMessage(2, 1), topic(1), 5)
+        segmenter.add(stubMessage(3, 2), topic(0), 5)
+        segmenter.add(stubMessage(4, 3), topic(1), 5)
+        self.assertEqual(self.threadIds(segmenter, 1), [1, 3])
+        self.assertEqual(self.threadIds(segmenter, 4), [2, 4])
+
+    def test_replyJoins(self):
+        """
+        Tests that a reply joins the thread of the replied message whatever its content
+        """
+        segmenter = ChannelSegmenter()
+        segmenter.add(stubMessage(1, 0), topic(0), 5)
+        segmenter.add(stubMessage(2, 1), topic(1), 5)
+        segmenter.add(stubMessage(3, 30, repliedId=1), topic(2), 5)
+        self.assertEqual(self.threadIds(segmenter, 3), [1, 3])
+
+    def test_timeGap(self):
+        """
+        Tests that a message sent after the time gap starts a new thread
+        """
+        segmenter = ChannelSegmenter()
+        segmenter.add(stubMessage(1, 0), topic(0), 5)
+        segmenter.add(stubMessage(2, 4), topic(0), 5)
+        segmenter.add(stubMessage(3, 8), topic(0), 5)
+        segmenter.add(stubMessage(4, 20), topic(0), 5)
+        self.assertEqual(self.threadIds(segmenter, 1), [1, 2, 3])
+        self.assertEqual(self.threadIds(segmenter, 4), [4])
+
+    def test_unionMerges(self):
+        """
+        Tests that a reply linking two threads merges them
+        """
+        segmenter = ChannelSegmenter()
+        segmenter.add(stubMessage(1, 0), topic(0), 5)
+        segmenter.add(stubMessage(2, 1), topic(1), 5)
+        segmenter.add(stubMessage(3, 2), topic(0), 5)
+        segmenter.add(stubMessage(4, 3), topic(1), 5)
+        segmenter.add(stubMessage(5, 4, repliedId=2), topic(0), 5)
+        self.assertEqual(self.threadIds(segmenter, 5), [2, 4, 5])
+        segmenter.add(stubMessage(6, 5, repliedId=1), topic(2), 5)
+        segmenter.union(5, 6)
+        self.assertEqual(self.threadIds(segmenter, 1), [1, 2, 3, 4, 5, 6])
+
+    def test_eviction(self):
+        """
+        Tests that the oldest threads are forgotten when the channel holds too many messages
+        """
+        segmenter = ChannelSegmenter(maxMessages=3)
+        segmenter.add(stubMessage(1, 0), topic(0), 5)
+        segmenter.add(stubMessage(2, 1), topic(0), 5)
+        segmenter.add(stubMessage(3, 2), topic(1), 5)
+        segmenter.add(stubMessage(4, 3), topic(1), 5)
+        self.assertIsNone(segmenter.thread(1))
+        self.assertIsNone(segmenter.thread(2))
+        self.assertEqual(self.threadIds(segmenter, 4), [3, 4])
+
+    def test_channels(self):
+        """
+        Tests that every channel has its own threads
+        """
+        segmenter = ConversationSegmenter()
+        segmenter.add(stubMessage(1, 0, channelId=1), topic(0), 5)
+        segmenter.add(stubMessage(2, 1, channelId=2), topic(0), 5)
+        self.assertEqual([message.id for message in segmenter.thread(1, 1)], [1])
+        self.assertIsNone(segmenter.thread(1, 2))
+        self.assertIsNone(segmenter.thread(3, 1))
+
+    def test_threadTexts(self):
+        """
+        Tests that the texts of a thread follow the edits of its messages and are forgotten with the thread
+        """
+        segmenter = ConversationSegmenter(maxMessages=2)
+        segmenter.add(stubMessage(1, 0), topic(0), 5, "hello")
+        segmenter.add(stubMessage(2, 1), topic(0), 5, "how are you")
+        segmenter.add(stubMessage(2, 1), topic(0), 5, "how are you doing")
+        thread, texts = segmenter.threadTexts(1, 2)
+        self.assertEqual([message.id for message in thread], [1, 2])
+        self.assertEqual(texts, {1: "hello", 2: "how are you doing"})
+
+        segmenter.add(stubMessage(3, 2), topic(1), 5, "bye")
+        self.assertIsNone(segmenter.threadTexts(1, 1))
+        self.assertEqual(segmenter.channels[1].texts, {3: "bye"})
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import time
+import unittest
+
+from summaryCache import SummaryCache
+
+
+class TestSummaryCache(unittest.TestCase):
+    """
+    Tests the summary cache
+    """
+
+    def test_key(self):
+        """
+        Tests that the key changes with the messages, their content and the generation parameters
+        """
+        key = SummaryCache.key([1, 2], "a: hello \n", 11, 2)
+        self.assertEqual(key, SummaryCache.key([1, 2], "a: hello \n", 11, 2))
+        self.assertNotEqual(key, SummaryCache.key([2, 1], "a: hello \n", 11, 2))
+        self.assertNotEqual(key, SummaryCache.key([1, 2], "a: hello! \n", 11, 2))
+        self.assertNotEqual(key, SummaryCache.key([1, 2], "a: hello \n", 12, 3))
+
+    def test_counters(self):
+        """
+        Tests that the hits and misses are counted
+        """
+        cache = SummaryCache()
+        self.assertIsNone(cache.get("a"))
+        cache.put("a", "summary")
+        self.assertEqual(cache.get("a"), "summary")
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_eviction(self):
+        """
+        Tests that the least recently used summaries are evicted first
+        """
+        cache = SummaryCache(capacity=2)
+        cache.put("a", "1")
+        cache.put("b", "2")
+        cache.get("a")
+        cache.put("c", "3")
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get("a"), "1")
+        self.assertIsNone(cache.get("b"))
+
+    def test_ttl(self):
+        """
+        Tests that expired summaries are not served
+        """
+        cache = SummaryCache(ttl=0.01)
+        cache.put("a", "1")
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
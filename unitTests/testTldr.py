@@ -1,13 +1,109 @@
+import asyncio
 import unittest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
 
+import discord
+import numpy as np
 import torch
 from sentence_transformers import SentenceTransformer
 
-from tldr import embedding, distance
+import tldr
+from messageBuffer import MessageBuffer
+from modelRegistry import registry
+from segmenter import ConversationSegmenter
+from tldr import clusterSimilarity, distance, distanceMatrix, findMinMatrix, wardClustering
 
 sentenceModel = SentenceTransformer('sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
 
 
+def embedding(text):
+    """
+    Embeds a text with the test model
+    :param text: the text to embed
+    :return: the embedding of the text
+    """
+    return sentenceModel.encode(text, convert_to_tensor=True)
+
+
+def loopDistanceMatrix(messageEmbeddings, tokenMessages, messages, band):
+    """
+    Reference implementation of the distance matrix, one pair at a time (as tldr.similarity used to do)
+    :param messageEmbeddings: the normalized embeddings
+    :param tokenMessages: the texts of the messages
+    :param messages: the messages
+    :param band: number of previous messages compared, None for all of them
+    :return: the distance matrix
+    """
+    nbMessages = len(tokenMessages)
+    similarityMatrix = np.full((nbMessages, nbMessages), -1.0)
+    messagesId = [message.id for message in messages]
+
+    for i in range(nbMessages - 1, -1, -1):
+        actualDiscordMessage = messages[i]
+        if actualDiscordMessage.type == discord.MessageType.reply:
+            repliedMessageId = actualDiscordMessage.reference.message_id
+            if repliedMessageId in messagesId:
+                index = messagesId.index(repliedMessageId)
+                similarityMatrix[i][index] = 0.
+                similarityMatrix[index][i] = 0.
+                continue
+        if not tokenMessages[i]:
+            continue
+        stop = -1 if band is None else i - band - 1
+        for j in range(i - 1, stop, -1):
+            if j < 0:
+                break
+            if not tokenMessages[j]:
+                continue
+            dist = distance(messageEmbeddings[i], messageEmbeddings[j])
+            similarityMatrix[i][j] = dist
+            similarityMatrix[j][i] = dist
+
+    return similarityMatrix
+
+
+def loopClustering(similarityMatrix):
+    """
+    Reference implementation of the clustering, recomputing every cluster distance at each merge
+    (as tldr.clustering used to do)
+    :param similarityMatrix: the distance matrix
+    :return: the list of clusters of indexes
+    """
+    cluster = [[i] for i in range(len(similarityMatrix))]
+    while len(cluster) > 1:
+        clusterSimi = clusterSimilarity(similarityMatrix, cluster)
+        minI, minJ, min = findMinMatrix(clusterSimi)
+        if min > -0.1 and len(cluster) <= 3:
+            break
+        cluster[minI] = cluster[minI] + cluster[minJ]
+        cluster.pop(minJ)
+    return cluster
+
+
+def syntheticWindow(nbMessages, seed):
+    """
+    Builds random embeddings, texts and messages with replies and empty messages
+    :param nbMessages: the number of messages
+    :param seed: the random seed
+    :return: the embeddings, the texts and the messages
+    """
+    rng = np.random.default_rng(seed)
+    messageEmbeddings = rng.standard_normal((nbMessages, 32)).astype(np.float32)
+    messageEmbeddings /= np.linalg.norm(messageEmbeddings, axis=1, keepdims=True)
+    tokenMessages = ["" if rng.random() < 0.1 else f"message {i}" for i in range(nbMessages)]
+    messages = []
+    for i in range(nbMessages):
+        if i > 0 and rng.random() < 0.2:
+            # replies to an earlier message, sometimes outside of the window
+            repliedId = int(rng.integers(0, i)) if rng.random() < 0.8 else 10 ** 9
+            messages.append(SimpleNamespace(id=i, type=discord.MessageType.reply,
+                                            reference=SimpleNamespace(message_id=repliedId)))
+        else:
+            messages.append(SimpleNamespace(id=i, type=discord.MessageType.default, reference=None))
+    return messageEmbeddings, tokenMessages, messages
+
+
 class TestTldr(unittest.TestCase):
     def test_embedding(self):
         emb = embedding("Hello world")
@@ -33,6 +129,243 @@ class TestTldr(unittest.TestCase):
         d = distance(emb6, emb7)
         print(d)
 
+    def test_distanceMatrix(self):
+        """
+        Tests that the banded distance matrix matches the pair by pair computation of similarity and similarityAll
+        """
+        for seed, nbMessages in enumerate([0, 1, 2, 11, 40, 150]):
+            messageEmbeddings, tokenMessages, messages = syntheticWindow(nbMessages, seed)
+            for band in [10, None]:
+                expected = loopDistanceMatrix(messageEmbeddings, tokenMessages, messages, band)
+                result = distanceMatrix(messageEmbeddings, tokenMessages, messages, band=band)
+                self.assertEqual(result.shape, expected.shape)
+                np.testing.assert_array_equal(result == -1.0, expected == -1.0)
+                np.testing.assert_array_equal(result == 0.0, expected == 0.0)
+                np.testing.assert_allclose(result, expected, rtol=1e-6, atol=1e-7)
+
+    def test_wardClustering(self):
+        """
+        Tests that the incremental clustering gives the same clusters as recomputing every cluster distance
+        """
+        for seed, nbMessages in enumerate([1, 2, 3, 4, 12, 30, 60]):
+            messageEmbeddings, tokenMessages, messages = syntheticWindow(nbMessages, seed)
+            for band in [10, None]:
+                similarityMatrix = distanceMatrix(messageEmbeddings, tokenMessages, messages, band=band)
+                self.assertEqual(wardClustering(similarityMatrix), loopClustering(similarityMatrix))
+
+    def test_summarizeBatches(self):
+        """
+        Tests that batched summarization keeps the order of the clusters and the (summary, first message) contract
+        """
+        calls = []
+
+        def recordingSummarizer(texts, **kwargs):
+            calls.append(len(texts))
+            return [{"summary_text": text.split(":")[0]} for text in texts]
+
+        lengths = [1, 12, 3, 25, 2, 8]
+        clusters = [[SimpleNamespace(content="word " * length, author=SimpleNamespace(nick=None, name=f"user{i}"))]
+                    for i, length in enumerate(lengths)]
+        summarizer = registry.set("summary", recordingSummarizer)
+        try:
+            serial = tldr.summarize(clusters, batchSize=1, useCache=False)
+            batched = tldr.summarize(clusters, batchSize=4, useCache=False)
+        finally:
+            registry.set("summary", summarizer)
+
+        expected = [(f"user{i}", cluster[0]) for i, cluster in enumerate(clusters)]
+        self.assertEqual(serial, expected)
+        self.assertEqual(batched, expected)
+        self.assertEqual(calls[:len(clusters)], [1] * len(clusters))
+        self.assertLess(len(calls) - len(clusters), len(clusters))
+
+    def test_summarizeParameters(self):
+        """
+        Tests that every text of a batch is summarized with its own generation parameters, the ones of its cache key
+        """
+        calls = []
+
+        def recordingSummarizer(texts, max_length, min_length, **kwargs):
+            calls.append((texts, max_length, min_length))
+            return [{"summary_text": "summary"} for _ in texts]
+
+        lengths = [1, 2, 3, 5, 8, 12, 18, 25, 40, 60]
+        texts = ["word " * length for length in lengths]
+        summarizer = registry.set("summary", recordingSummarizer)
+        try:
+            tldr.summarizeTexts(texts, batchSize=8)
+        finally:
+            registry.set("summary", summarizer)
+
+        self.assertEqual(sorted(text for batch, _, _ in calls for text in batch), sorted(texts))
+        self.assertLess(len(calls), len(texts))
+        for batch, maxLength, minLength in calls:
+            for text in batch:
+                self.assertEqual(tldr.generationParameters(text), (maxLength, minLength))
+
+    def test_summarizeCache(self):
+        """
+        Tests that a cluster summarized once is served from the cache until one of its messages changes
+        """
+        calls = []
+
+        def recordingSummarizer(texts, **kwargs):
+            calls.append(len(texts))
+            return [{"summary_text": text.split(":")[0]} for text in texts]
+
+        clusters = [[SimpleNamespace(id=100 * i + j, content=f"message {j}",
+                                     author=SimpleNamespace(nick=None, name=f"user{i}")) for j in range(3)]
+                    for i in range(2)]
+        summarizer = registry.set("summary", recordingSummarizer)
+        tldr.summaryCache.clear()
+        try:
+            first = tldr.summarize(clusters)
+            second = tldr.summarize(clusters)
+            self.assertEqual(first, second)
+            self.assertEqual(sum(calls), 2)
+
+            clusters[1][2].content = "edited"
+            tldr.summarize(clusters)
+            self.assertEqual(sum(calls), 3)
+        finally:
+            registry.set("summary", summarizer)
+            tldr.summaryCache.clear()
+
+    def test_mapReduceSummarize(self):
+        """
+        Tests that a long cluster is summarized from chunks fitting the budget, level by level, into one summary
+        """
+        budget = 40
+        texts = []
+
+        class WordSummarizer:
+            """
+            Summarizes a text into its first words, counts the tokens as words
+            """
+            tokenizer = staticmethod(lambda lines, **kwargs: {"input_ids": [line.split() for line in lines]})
+
+            def __call__(self, batch, **kwargs):
+                texts.extend(batch)
+                return [{"summary_text": " ".join(text.split()[:4])} for text in batch]
+
+        cluster = [SimpleNamespace(id=i, content=f"message number {i} of a long thread",
+                                   author=SimpleNamespace(nick=None, name=f"user{i % 3}")) for i in range(60)]
+        summarizer, chunkTokens = registry.set("summary", WordSummarizer()), tldr.summaryChunkTokens
+        tldr.summaryChunkTokens = budget
+        try:
+            summaries = tldr.summarize([cluster], batchSize=4, useCache=False)
+        finally:
+            registry.set("summary", summarizer)
+            tldr.summaryChunkTokens = chunkTokens
+
+        self.assertEqual(len(summaries), 1)
+        self.assertIs(summaries[0][1], cluster[0])
+        self.assertGreater(len(texts), 2)
+        for text in texts:
+            self.assertLessEqual(len(text.replace("\n", "").split()), budget)
+
+    def test_getChatByTimeStream(self):
+        """
+        Tests that the history stops at the first time gap and that the kept messages are streamed in batches
+        """
+        class Channel:
+            id = 1
+
+            async def history(self, limit, before=None, after=None):
+                for m in sorted((m for m in messages if m.id < before.id), key=lambda m: -m.id)[:limit]:
+                    yield m
+
+        channel = Channel()
+        start = datetime(2024, 1, 1)
+        # 150 messages a minute apart, then a silence of an hour, then 250 messages a minute apart
+        dates = [start + timedelta(minutes=i) for i in range(150)] + \
+                [start + timedelta(minutes=210 + i) for i in range(250)]
+        messages = [SimpleNamespace(id=i + 1, channel=channel, content=f"message {i}", created_at=date,
+                                    author=SimpleNamespace(bot=False)) for i, date in enumerate(dates)]
+        bot = SimpleNamespace(messageBuffer=MessageBuffer())
+        batches = []
+
+        chat, index = asyncio.run(tldr.getChatByTime(bot, messages[-1], 5, positionParameter="above",
+                                                     onMessages=lambda batch: batches.append(len(batch))))
+        self.assertEqual([m.id for m in chat], [m.id for m in messages[150:]])
+        self.assertEqual(index, 249)
+        self.assertEqual(sum(batches), 250)
+        self.assertTrue(all(size <= tldr.streamBatchSize for size in batches))
+
+        chat, index = asyncio.run(tldr.getChatByTime(bot, messages[-1], 5, positionParameter="above", limit=100))
+        self.assertEqual(len(chat), 101)
+
+    def test_computeTldrTranslations(self):
+        """
+        Tests that the chat is summarized from the texts returned by prepareMessages and that a batch that could not
+        be translated cancels the tldr instead of summarizing the original texts
+        """
+        class Channel:
+            id = 1
+
+            async def history(self, limit, before=None, after=None):
+                for m in sorted((m for m in messages if m.id < before.id), key=lambda m: -m.id)[:limit]:
+                    yield m
+
+        channel = Channel()
+        start = datetime(2024, 1, 1)
+        messages = [SimpleNamespace(id=i + 1, channel=channel, content=f"message {i}", created_at=start,
+                                    type=discord.MessageType.default, reference=None,
+                                    author=SimpleNamespace(bot=False, nick=None, name="user")) for i in range(4)]
+        bot = SimpleNamespace(messageBuffer=MessageBuffer(), tldrExecutor=None)
+        summarized = []
+
+        def recordingSummarizer(texts, **kwargs):
+            summarized.extend(texts)
+            return [{"summary_text": "summary"} for _ in texts]
+
+        encoder = SimpleNamespace(encode=lambda texts: np.ones((len(texts), 4), dtype=np.float32))
+        saved = (registry.set("summary", recordingSummarizer), registry.set("embedding", encoder),
+                 tldr.prepareMessages, tldr.embeddingStore, tldr.segmenter)
+        tldr.embeddingStore = tldr.EmbeddingStore(4, capacity=10)
+        tldr.segmenter = ConversationSegmenter()
+        try:
+            tldr.prepareMessages = lambda batch: [f"english {m.id}" for m in batch]
+            summaries = asyncio.run(tldr.computeTldr(bot, messages[-1], "one", "above", 5))
+            self.assertEqual([m.content for m in messages], [f"message {i}" for i in range(4)])
+            self.assertEqual(len(summaries), 1)
+            self.assertIn("user: english 1", summarized[0])
+            self.assertNotIn("message", summarized[0])
+
+            summarized.clear()
+            tldr.prepareMessages = lambda batch: None
+            self.assertEqual(asyncio.run(tldr.computeTldr(bot, messages[-1], "one", "above", 5)), [])
+            self.assertEqual(summarized, [])
+        finally:
+            registry.set("summary", saved[0])
+            registry.set("embedding", saved[1])
+            tldr.prepareMessages, tldr.embeddingStore, tldr.segmenter = saved[2:]
+
+    def test_segmentedThreadKeepsMessages(self):
+        """
+        Tests that the segmented fast path summarizes the English texts stored by ingestMessage without changing the
+        shared messages
+        """
+        channel = SimpleNamespace(id=1)
+        start = datetime(2024, 1, 1)
+        messages = [SimpleNamespace(id=i + 1, channel=channel, content=f"le café n°{i}!", created_at=start,
+                                    type=discord.MessageType.default, reference=None,
+                                    author=SimpleNamespace(nick=None, name="user")) for i in range(3)]
+        segmenter = tldr.segmenter
+        tldr.segmenter = ConversationSegmenter()
+        try:
+            for message in messages:
+                tldr.segmenter.add(message, np.ones(4, dtype=np.float32) / 2, 5, f"the coffee n{message.id - 1}!")
+            thread, texts = tldr.segmentedThread(messages[1], "one", "around")
+        finally:
+            tldr.segmenter = segmenter
+
+        self.assertEqual([m.id for m in thread], [1, 2, 3])
+        self.assertEqual([m.content for m in messages], ["le café n°0!", "le café n°1!", "le café n°2!"])
+        self.assertEqual(texts, {1: "the coffee n0!", 2: "the coffee n1!", 3: "the coffee n2!"})
+        self.assertEqual(tldr.clusterLines(thread, texts),
+                         ["user: the coffee n0!", "user: the coffee n1!", "user: the coffee n2!"])
+
 
 if __name__ == '__main__':
     unittest.main()
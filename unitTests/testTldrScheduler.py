@@ -0,0 +1,88 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+
+import tldr
+from tldrScheduler import TldrScheduler
+
+
+class StubMessageToEdit:
+    """
+    Stands for a "Summarizing..." message, records its edits
+    """
+
+    def __init__(self, id):
+        """
+        Constructor
+        :param id: the id of the message
+        """
+        self.id = id
+        self.contents = []
+
+    async def edit(self, content):
+        """
+        Records an edit
+        :param content: the new content
+        """
+        self.contents.append(content)
+
+
+class TestTldrScheduler(unittest.TestCase):
+    """
+    Tests the scheduler of the tldr commands
+    """
+
+    def setUp(self):
+        self.computeTldr, self.sendSummarises = tldr.computeTldr, tldr.sendSummarises
+
+    def tearDown(self):
+        tldr.computeTldr, tldr.sendSummarises = self.computeTldr, self.sendSummarises
+
+    def test_coalescing(self):
+        """
+        Tests that the commands asking for the same summary share one computation and that the queue is bounded
+        """
+        computed = []
+        sent = []
+        running = []
+        maxRunning = []
+
+        async def computeTldr(bot, message, quantity, position, timeGap):
+            computed.append((message.id, position, quantity))
+            running.append(message.id)
+            maxRunning.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(message.id)
+            return [(f"summary {message.id}", message)]
+
+        async def sendSummarises(bot, messagesToEdit, summarises):
+            sent.append(([m.id for m in messagesToEdit], summarises[0][0]))
+
+        tldr.computeTldr, tldr.sendSummarises = computeTldr, sendSummarises
+        channel = SimpleNamespace(id=1)
+        messages = [SimpleNamespace(id=i, channel=channel) for i in range(4)]
+        toEdit = [StubMessageToEdit(100 + i) for i in range(6)]
+
+        async def burst():
+            scheduler = TldrScheduler(bot=None, workers=2)
+            scheduler.submit(messages[0], toEdit[0])
+            scheduler.submit(messages[0], toEdit[1])
+            scheduler.submit(messages[1], toEdit[2])
+            scheduler.submit(messages[2], toEdit[3])
+            scheduler.submit(messages[2], toEdit[4])
+            scheduler.submit(messages[2], toEdit[5], position="above")
+            while scheduler.jobs or scheduler.tasks:
+                await asyncio.sleep(0.005)
+
+        asyncio.run(burst())
+        self.assertEqual(len(computed), 4)
+        self.assertLessEqual(max(maxRunning), 2)
+        self.assertIn(([100, 101], "summary 0"), sent)
+        self.assertIn(([103, 104], "summary 2"), sent)
+        self.assertEqual(toEdit[3].contents[0], "Summarizing... (position 1 in the queue)")
+        self.assertEqual(toEdit[5].contents[0], "Summarizing... (position 2 in the queue)")
+        self.assertEqual(toEdit[3].contents[-1], "Summarizing...")
+
+
+if __name__ == '__main__':
+    unittest.main()
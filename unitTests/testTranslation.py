@@ -0,0 +1,80 @@
+import unittest
+
+import utils
+
+
+class StubTokenizer:
+    """
+    Stands for a MarianMT tokenizer, every word is one token
+    """
+
+    def __call__(self, texts, add_special_tokens=True, **kwargs):
+        if add_special_tokens:
+            return {"texts": texts}
+        return {"input_ids": [[0] * len(text.split()) for text in texts]}
+
+    def batch_decode(self, texts, skip_special_tokens=True):
+        return [text.upper() for text in texts]
+
+
+class StubModel:
+    """
+    Stands for a MarianMT model, remembers the batches given to generate
+    """
+
+    def __init__(self):
+        self.batches = []
+
+    def generate(self, texts):
+        self.batches.append(texts)
+        return texts
+
+
+class TestTranslation(unittest.TestCase):
+    """
+    Tests the batched and cached translation
+    """
+
+    def setUp(self):
+        self.model = StubModel()
+        self.previous = utils.translationPool.set("fr", "en", (self.model, StubTokenizer()))
+        self.maxTokens = utils.translationMaxTokens
+        utils.translationCache.clear()
+
+    def tearDown(self):
+        utils.translationPool.set("fr", "en", self.previous)
+        utils.translationMaxTokens = self.maxTokens
+        utils.translationCache.clear()
+
+    def test_packSegments(self):
+        """
+        Tests that a text is split between sentences, and between words for a sentence longer than the maximum
+        """
+        text = "un deux. trois quatre cinq! six sept huit neuf dix onze"
+        self.assertEqual(utils.packSegments(text, StubTokenizer(), 5),
+                         ["un deux. trois quatre cinq!", "six sept huit neuf dix", "onze"])
+
+    def test_translateMany(self):
+        """
+        Tests that the segments of every text are translated together and that the translations are cached
+        """
+        utils.translationMaxTokens = 3
+        texts = ["bonjour. salut", "", "une phrase bien trop longue", "bonjour. salut"]
+        self.assertEqual(utils.translateMany(texts, "fr", "en", batchSize=16),
+                         ["BONJOUR. SALUT", "", "UNE PHRASE BIEN TROP LONGUE", "BONJOUR. SALUT"])
+        self.assertEqual(len(self.model.batches), 1)
+        self.assertEqual(sorted(self.model.batches[0]), ["bonjour. salut", "trop longue", "une phrase bien"])
+
+        self.assertEqual(utils.translate("bonjour. salut", "fr", "en"), "BONJOUR. SALUT")
+        self.assertEqual(len(self.model.batches), 1)
+
+    def test_toEnglishMany(self):
+        """
+        Tests that only the French texts are translated
+        """
+        self.assertEqual(utils.toEnglishMany(["hello", "bonjour", "hola"], ["en", "fr", "es"]),
+                         ["hello", "BONJOUR", "hola"])
+
+
+if __name__ == '__main__':
+    unittest.main()
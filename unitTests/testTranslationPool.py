@@ -0,0 +1,54 @@
+import threading
+import unittest
+
+from translationPool import TranslationPool
+
+
+class TestTranslationPool(unittest.TestCase):
+    """
+    Tests the memory-bounded pool of translation models
+    """
+
+    def setUp(self):
+        self.loads = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def loader(self, src, trg):
+        self.release.wait()
+        self.loads.append((src, trg))
+        return f"{src}-{trg}", "tokenizer"
+
+    def test_eviction(self):
+        """
+        Tests that the least recently used pairs are unloaded when the budget is exceeded
+        """
+        pool = TranslationPool(200, self.loader, sizeOf=lambda model: 100)
+        pool.get("fr", "en")
+        pool.get("de", "en")
+        pool.get("fr", "en")
+        pool.get("es", "en")
+        self.assertEqual(list(pool.models), [("fr", "en"), ("es", "en")])
+        report = pool.report()
+        self.assertFalse(report["de-en"]["resident"])
+        self.assertEqual(report["de-en"]["evictions"], 1)
+        self.assertEqual(report["fr-en"]["hits"], 2)
+
+    def test_backgroundLoad(self):
+        """
+        Tests that a pair that is not resident is loaded in the background when the caller does not wait
+        """
+        pool = TranslationPool(200, self.loader, sizeOf=lambda model: 100)
+        self.release.clear()
+        self.assertIsNone(pool.get("fr", "en", wait=False))
+        self.assertIsNone(pool.get("fr", "en", wait=False))
+        self.release.set()
+        self.assertEqual(pool.get("fr", "en"), ("fr-en", "tokenizer"))
+        self.assertEqual(self.loads, [("fr", "en")])
+        report = pool.report()["fr-en"]
+        self.assertEqual((report["hits"], report["misses"]), (1, 2))
+        self.assertAlmostEqual(report["hitRate"], 1 / 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import random
+import unittest
+
+from wordMatcher import BannedWordMatcher
+
+
+class TestWordMatcher(unittest.TestCase):
+    """
+    Tests the Aho–Corasick banned word matcher
+    """
+
+    def test_substring(self):
+        """
+        Tests that the words are found anywhere, including words that are suffixes of other words
+        """
+        matcher = BannedWordMatcher(["he", "she", "hers", "his"])
+        self.assertEqual(matcher.find("ushers"), "she")
+        self.assertEqual(matcher.find("ahis"), "his")
+        self.assertIsNone(matcher.find("hxe"))
+        self.assertIsNone(matcher.find("SHE"))
+        self.assertIsNone(BannedWordMatcher([]).find("anything"))
+
+    def test_modes(self):
+        """
+        Tests the case folding and whole word modes
+        """
+        self.assertEqual(BannedWordMatcher(["Darn"], caseFold=True).find("DARN it"), "Darn")
+        matcher = BannedWordMatcher(["ass"], wholeWords=True)
+        self.assertIsNone(matcher.find("a classic assumption"))
+        self.assertEqual(matcher.find("what an ass!"), "ass")
+
+    def test_bruteForce(self):
+        """
+        Tests that the matcher finds a word exactly when one of the words is in the text
+        """
+        randomGenerator = random.Random(0)
+        for _ in range(300):
+            words = ["".join(randomGenerator.choices("abc", k=randomGenerator.randint(1, 4))) for _ in range(5)]
+            text = "".join(randomGenerator.choices("abc ", k=20))
+            found = BannedWordMatcher(words).find(text)
+            self.assertEqual(found is not None, any(word in text for word in words))
+            if found is not None:
+                self.assertIn(found, text)
+
+
+if __name__ == '__main__':
+    unittest.main()
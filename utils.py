@@ -1,12 +1,23 @@
+import hashlib
+import inspect
 import math
+import os
+import re
+import threading
 import traceback
+from collections import OrderedDict
 from functools import wraps
 
 import numpy as np
+import torch
+from dotenv import load_dotenv
 from matplotlib.colors import ListedColormap
 from transformers import AutoTokenizer
 from transformers import MarianMTModel, pipeline
 
+from modelRegistry import registry
+from translationPool import TranslationPool
+
 
 # •===========•
 #    MATHS
@@ -82,13 +93,180 @@ def get_colourmap(c1, c2):
     return ListedColormap(vals)
 
 
+# •============•
+#    SETTINGS
+# •============•
+
+load_dotenv()
+
+
+def getSetting(name: str, default):
+    """
+    Reads a setting from the environment (.env file), cast to the type of its default value
+    :param name: the name of the setting
+    :param default: the value used when the setting is not defined
+    :return: the value of the setting
+    """
+    value = os.getenv(name)
+    if value is None or value == "":
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes", "on")
+    if default is None:
+        return value
+    return type(default)(value)
+
+
+# •===========•
+#    HASHING
+# •===========•
+
+
+def contentHash(text: str) -> str:
+    """
+    Computes a short hash of the content of a message, used to detect edited messages in caches
+    :param text: the content of the message
+    :return: the hexadecimal hash of the content
+    """
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=8).hexdigest()
+
+
+# •=======================•
+#    INFERENCE BACKENDS
+# •=======================•
+
+# Backends a model can be loaded with: plain PyTorch, dynamically quantized int8 PyTorch or an ONNX Runtime graph
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def modelBackend(name: str) -> str:
+    """
+    Gets the backend a model is loaded with, from the BACKEND_<NAME> setting or else the INFERENCE_BACKEND setting
+    :param name: the name of the model in the settings (language, translation, emotion, sentiment, embedding, summary)
+    :return: the backend
+    """
+    backend = getSetting(f"BACKEND_{name.upper()}", getSetting("INFERENCE_BACKEND", "torch")).lower()
+    if backend not in BACKENDS:
+        print(f"Unknown inference backend {backend} for the {name} model, using torch")
+        return "torch"
+    return backend
+
+
+def quantize(model: torch.nn.Module) -> torch.nn.Module:
+    """
+    Quantizes the linear layers of a model to int8 (weights are quantized once, activations on the fly)
+    :param model: the PyTorch model
+    :return: the quantized model
+    """
+    return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def onnxModelClass(task: str):
+    """
+    Gets the ONNX Runtime model class of a task, optimum is an optional dependency
+    :param task: the task of the pipeline
+    :return: the optimum.onnxruntime class, None if optimum is not installed
+    """
+    try:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTModelForSeq2SeqLM, \
+            ORTModelForSequenceClassification
+    except ImportError:
+        return None
+    if task in ("summarization", "translation"):
+        return ORTModelForSeq2SeqLM
+    if task == "feature-extraction":
+        return ORTModelForFeatureExtraction
+    return ORTModelForSequenceClassification
+
+
+def loadPipeline(name: str, task: str, model: str, backend: str | None = None, **kwargs):
+    """
+    Loads a transformers pipeline with the backend chosen for the model
+    :param name: the name of the model in the settings
+    :param task: the task of the pipeline
+    :param model: the name of the model on the Hugging Face hub
+    :param backend: the backend, None for the one in the settings
+    :param kwargs: the other arguments of the pipeline
+    :return: the pipeline
+    """
+    if backend is None:
+        backend = modelBackend(name)
+
+    if backend == "onnx":
+        modelClass = onnxModelClass(task)
+        if modelClass is not None:
+            tokenizer = kwargs.pop("tokenizer", model)
+            return pipeline(task, model=modelClass.from_pretrained(model, export=True),
+                            tokenizer=AutoTokenizer.from_pretrained(tokenizer), **kwargs)
+        print(f"optimum[onnxruntime] is not installed, the {name} model is loaded with torch")
+
+    loaded = pipeline(task, model=model, **kwargs)
+    if backend == "int8":
+        loaded.model = quantize(loaded.model)
+    return loaded
+
+
+def loadSeq2SeqModel(name: str, model: str, backend: str | None = None):
+    """
+    Loads a sequence to sequence model (MarianMT) with the backend chosen for the model
+    :param name: the name of the model in the settings
+    :param model: the name of the model on the Hugging Face hub
+    :param backend: the backend, None for the one in the settings
+    :return: the model, it has a generate method whatever the backend
+    """
+    if backend is None:
+        backend = modelBackend(name)
+
+    if backend == "onnx":
+        modelClass = onnxModelClass("translation")
+        if modelClass is not None:
+            return modelClass.from_pretrained(model, export=True)
+        print(f"optimum[onnxruntime] is not installed, the {name} model is loaded with torch")
+
+    loaded = MarianMTModel.from_pretrained(model)
+    if backend == "int8":
+        loaded = quantize(loaded)
+    return loaded
+
+
 # •====================•
 #    TEXT TRANSLATION
 # •====================•
 
-detect_language = pipeline("text-classification", "papluca/xlm-roberta-base-language-detection")
+registry.register("language", lambda: loadPipeline("language", "text-classification",
+                                                   "papluca/xlm-roberta-base-language-detection"))
+
+# Number of texts per forward pass of the language detection model
+languageBatchSize = getSetting("LANGUAGE_BATCH_SIZE", 32)
+# Number of tokens of a text given to the language detection model
+languageMaxTokens = getSetting("LANGUAGE_MAX_TOKENS", 128)
+
+
+def loadTranslationModel(src, trg):
+    """
+    Loads the MarianMT model translating a language to another
+    :param src: the source language
+    :param trg: the target language
+    :return: the model and the tokenizer
+    """
+    model_name = f"Helsinki-NLP/opus-mt-{src}-{trg}"
+    return loadSeq2SeqModel("translation", model_name), AutoTokenizer.from_pretrained(model_name)
+
 
-translation_models = {}
+# The translation models of the recent language pairs, bounded by TRANSLATION_MEMORY_MB
+translationPool = TranslationPool(getSetting("TRANSLATION_MEMORY_MB", 1200) * 2 ** 20, loadTranslationModel)
+registry.registerFamily("translation-", lambda name: translationPool.get(*name.split("-")[1:3]))
+
+
+def translationModel(src, trg, wait=True):
+    """
+    Gets the MarianMT model and tokenizer translating a language to another, loaded on first use
+    :param src: the source language
+    :param trg: the target language
+    :param wait: True to wait for the model if it is not loaded, False to load it in the background
+    :return: the model and the tokenizer, None if the model is not loaded and wait is False
+    """
+    return translationPool.get(src, trg, wait)
 
 
 def getLanguage(text):
@@ -97,16 +275,152 @@ def getLanguage(text):
     :param text: the text to detect
     :return: the language of the text
     """
-    # batch = detection_tokenizer([text], return_tensors="pt")
-    # with torch.no_grad():
-    #     outputs = detection_model(**batch)
-    #
-    # answer: torch.Tensor = outputs.logits.argmax()
+    return getLanguages([text])[0]
 
-    try:
-        return detect_language(text)[0]["label"]
-    except:  # If the text is too long we analyse only the first half
-        return detect_language(text[:len(text) // 2])[0]["label"]
+
+def getLanguages(texts, batchSize=None):
+    """
+    Detect the language of many texts at once
+    The texts are truncated to LANGUAGE_MAX_TOKENS tokens (the beginning of a text is enough to know its language) and
+    sorted by length so that the padded batches given to the model waste as little as possible
+    :param texts: the texts to detect
+    :param batchSize: the number of texts per forward pass, None for the LANGUAGE_BATCH_SIZE setting
+    :return: the language of every text
+    """
+    if not texts:
+        return []
+    if batchSize is None:
+        batchSize = languageBatchSize
+
+    detect_language = registry.get("language")
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    languages = [None] * len(texts)
+    results = detect_language([texts[i] for i in order], batch_size=batchSize, truncation=True,
+                              max_length=languageMaxTokens)
+    for i, result in zip(order, results):
+        languages[i] = result["label"]
+    return languages
+
+
+# Translations already computed, keyed by (text, source language, target language)
+translationCache: OrderedDict[tuple[str, str, str], str] = OrderedDict()
+translationCacheLock = threading.Lock()
+translationCacheSize = getSetting("TRANSLATION_CACHE_SIZE", 5000)
+# Maximum number of tokens of a segment given to MarianMT, longer texts are split between sentences
+translationMaxTokens = getSetting("TRANSLATION_MAX_TOKENS", 256)
+# Number of segments translated in one call of generate
+translationBatchSize = getSetting("TRANSLATION_BATCH_SIZE", 16)
+
+
+def splitSentences(text):
+    """
+    Split a text into sentences
+    :param text: the text to split
+    :return: the sentences, with their final punctuation
+    """
+    return [sentence for sentence in re.split(r"(?<=[.!?])\s+|\n+", text) if sentence.strip()]
+
+
+def packSegments(text, tokenizer, maxTokens):
+    """
+    Split a text into segments of whole sentences of at most maxTokens tokens
+    A sentence longer than maxTokens is split between words
+    :param text: the text to split
+    :param tokenizer: the tokenizer of the translation model
+    :param maxTokens: the maximum number of tokens of a segment
+    :return: the segments
+    """
+    pieces = []
+    for sentence in splitSentences(text):
+        words = sentence.split()
+        lengths = [len(ids) for ids in tokenizer(words, add_special_tokens=False)["input_ids"]] if words else []
+        if sum(lengths) <= maxTokens:
+            pieces.append((sentence, sum(lengths)))
+            continue
+        piece, tokens = [], 0
+        for word, length in zip(words, lengths):
+            if piece and tokens + length > maxTokens:
+                pieces.append((" ".join(piece), tokens))
+                piece, tokens = [], 0
+            piece.append(word)
+            tokens += length
+        pieces.append((" ".join(piece), tokens))
+
+    segments, tokens = [], 0
+    for piece, length in pieces:
+        if segments and tokens + length <= maxTokens:
+            segments[-1] += " " + piece
+            tokens += length
+        else:
+            segments.append(piece)
+            tokens = length
+    return segments
+
+
+def translateMany(texts, src, trg, batchSize=None, wait=True):
+    """
+    Translate many texts from a language to another
+    The translations are cached, the other texts are split into segments fitting the model, and the segments of every
+    text are translated together in padded batches of segments of similar length
+    :param texts: the texts to translate
+    :param src: the source language
+    :param trg: the target language
+    :param batchSize: the number of segments per call of generate, None for the TRANSLATION_BATCH_SIZE setting
+    :param wait: True to wait for the model if it is not loaded, False to load it in the background
+    :return: the translated texts, None for the texts left untranslated because the model is loading
+    """
+    if batchSize is None:
+        batchSize = translationBatchSize
+
+    translations = [None] * len(texts)
+    missing: dict[str, list[int]] = {}
+    with translationCacheLock:
+        for i, text in enumerate(texts):
+            key = (text, src, trg)
+            if not text.strip():
+                translations[i] = text
+            elif key in translationCache:
+                translationCache.move_to_end(key)
+                translations[i] = translationCache[key]
+            else:
+                missing.setdefault(text, []).append(i)
+    if not missing:
+        return translations
+
+    model = translationModel(src, trg, wait)
+    if model is None:
+        return translations
+    translation_model, translation_tokenizer = model
+    segments = []  # (index of the text in missing, segment)
+    for index, text in enumerate(missing):
+        segments += [(index, segment) for segment in packSegments(text, translation_tokenizer, translationMaxTokens)]
+
+    order = sorted(range(len(segments)), key=lambda i: len(segments[i][1]))
+    translatedSegments = [None] * len(segments)
+    for start in range(0, len(order), batchSize):
+        batchOrder = order[start:start + batchSize]
+        batch = translation_tokenizer([segments[i][1] for i in batchOrder], return_tensors="pt", padding=True,
+                                      truncation=True, max_length=translationMaxTokens)
+        generated_ids = translation_model.generate(**batch)
+        for i, translated in zip(batchOrder, translation_tokenizer.batch_decode(generated_ids,
+                                                                                skip_special_tokens=True)):
+            translatedSegments[i] = translated
+
+    parts: list[list[str]] = [[] for _ in missing]
+    for (index, _), translated in zip(segments, translatedSegments):
+        parts[index].append(translated)
+
+    with translationCacheLock:
+        for (text, indexes), textParts in zip(missing.items(), parts):
+            translation = " ".join(textParts)
+            for i in indexes:
+                translations[i] = translation
+            translationCache[(text, src, trg)] = translation
+            translationCache.move_to_end((text, src, trg))
+        while len(translationCache) > translationCacheSize:
+            translationCache.popitem(last=False)
+
+    return translations
 
 
 def translate(text, src, trg):
@@ -117,35 +431,40 @@ def translate(text, src, trg):
     :param trg: the target language
     :return: the translated text
     """
-    if (src, trg) not in translation_models:
-        model_name = f"Helsinki-NLP/opus-mt-{src}-{trg}"
-        translation_models[(src, trg)] = (
-            MarianMTModel.from_pretrained(model_name), AutoTokenizer.from_pretrained(model_name))
+    return translateMany([text], src, trg)[0]
 
-    translation_model, translation_tokenizer = translation_models[(src, trg)]
 
-    try:
-        batch = translation_tokenizer([text], return_tensors="pt")
-        generated_ids = translation_model.generate(**batch)
-        return translation_tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
-    except:  # If the text is too long we split it in two, translate it and concatenate the results
-        # Could be improved by splitting the text in sentences instead of half
-        return translate(text[:len(text) // 2], src, trg) + translate(text[len(text) // 2:], src, trg)
+# Languages translated to english, every one needs a Helsinki-NLP/opus-mt-<language>-en model
+translationLanguages = [language.strip() for language in getSetting("TRANSLATION_LANGUAGES", "fr").split(",")
+                        if language.strip()]
 
 
-def toEnglish(text):
+def toEnglish(text, language=None):
     """
     Translate a text to english
     :param text: the text to translate
+    :param language: the language of the text, None to detect it
     :return: the translated text
     """
-    language = getLanguage(text)
+    if language is None:
+        language = getLanguage(text)
+    return toEnglishMany([text], [language])[0]
+
 
-    if language == "en":
-        return text
-    if language == "fr":
-        return translate(text, language, "en")
-    return text
+def toEnglishMany(texts, languages, wait=True):
+    """
+    Translate many texts to english, the texts of the same language are translated together
+    :param texts: the texts to translate
+    :param languages: the language of every text
+    :param wait: True to wait for the models that are not loaded, False to load them in the background
+    :return: the translated texts, None for the texts left untranslated because their model is loading
+    """
+    english = list(texts)
+    for language in set(languages) & set(translationLanguages):
+        indexes = [i for i, textLanguage in enumerate(languages) if textLanguage == language]
+        for i, translation in zip(indexes, translateMany([texts[i] for i in indexes], language, "en", wait=wait)):
+            english[i] = translation
+    return english
 
 
 def toFrench(text):
@@ -182,10 +501,19 @@ def timeIt(func):
 
 def printExceptions(f):
     """
-    Decorator that prints the exceptions of a function
+    Decorator that prints the exceptions of a function (or of a coroutine function)
     :param f: the function to be wrapped
     :return: the wrapped function
     """
+    if inspect.iscoroutinefunction(f):
+        @wraps(f)
+        async def asyncWrapper(*args, **kwargs):
+            try:
+                return await f(*args, **kwargs)
+            except:
+                traceback.print_exc()
+
+        return asyncWrapper
 
     @wraps(f)
     def wrapper(*args, **kwargs):
@@ -0,0 +1,101 @@
+from collections import deque
+
+
+# •========================•
+#    BANNED WORD MATCHER
+# •========================•
+
+class BannedWordMatcher:
+    """
+    Aho–Corasick automaton finding banned words in a text in one pass, in time linear in the length of the text
+    whatever the number of banned words
+    :caseFold: True to ignore the case of the words and of the texts
+    :wholeWords: True to only match whole words, False to match the words anywhere (inside other words too)
+    :words: the banned words, as given
+    :lengths: the length of every folded banned word
+    :transitions: links every state to its transitions, by character (state 0 is the root)
+    :fail: the state to fall back to from every state when a character has no transition
+    :outputs: the indexes of the words ending at every state, including the words of its fail states
+    """
+
+    def __init__(self, words: list[str], caseFold: bool = False, wholeWords: bool = False):
+        """
+        Constructor, compiles the automaton
+        :param words: the banned words
+        :param caseFold: True to ignore the case of the words and of the texts
+        :param wholeWords: True to only match whole words
+        """
+        self.caseFold = caseFold
+        self.wholeWords = wholeWords
+        self.words = [word for word in words if word]
+        self.lengths = [len(self.fold(word)) for word in self.words]
+        self.transitions: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        self.outputs: list[list[int]] = [[]]
+
+        for index, word in enumerate(self.words):
+            state = 0
+            for character in self.fold(word):
+                if character not in self.transitions[state]:
+                    self.transitions.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.transitions[state][character] = len(self.transitions) - 1
+                state = self.transitions[state][character]
+            self.outputs[state].append(index)
+
+        # Breadth-first, so the fail state of a state is computed before the states below it
+        queue = deque(self.transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, child in self.transitions[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and character not in self.transitions[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.transitions[fallback].get(character, 0) if state else 0
+                self.outputs[child] = self.outputs[child] + self.outputs[self.fail[child]]
+
+    def fold(self, text: str) -> str:
+        """
+        Folds the case of a text if the matcher ignores the case
+        :param text: the text
+        :return: the folded text
+        """
+        return text.casefold() if self.caseFold else text
+
+    def find(self, text: str) -> str | None:
+        """
+        Finds the first banned word of a text
+        :param text: the text
+        :return: the banned word (as given), None if the text has none
+        """
+        text = self.fold(text)
+        state = 0
+        for end, character in enumerate(text, start=1):
+            while state and character not in self.transitions[state]:
+                state = self.fail[state]
+            state = self.transitions[state].get(character, 0)
+            for index in self.outputs[state]:
+                if not self.wholeWords or self.isWord(text, end - self.lengths[index], end):
+                    return self.words[index]
+        return None
+
+    @staticmethod
+    def isWord(text: str, start: int, end: int) -> bool:
+        """
+        Checks that a match is not part of a longer word
+        :param text: the text
+        :param start: the index of the first character of the match
+        :param end: the index after the last character of the match
+        :return: True if the characters around the match are not letters, digits or underscores
+        """
+        return (start == 0 or not (text[start - 1].isalnum() or text[start - 1] == "_")) and \
+            (end == len(text) or not (text[end].isalnum() or text[end] == "_"))
+
+    def __len__(self) -> int:
+        """
+        Gets the number of banned words
+        :return: the number of banned words
+        """
+        return len(self.words)